@@ -0,0 +1,97 @@
+import ftplib
+import mmap
+import posixpath
+import anyio
+from contextlib import asynccontextmanager
+
+# what a dropped session looks like, as opposed to e.g. a missing file
+SESSION_ERRORS = (OSError, EOFError, ftplib.error_temp)
+
+
+class AsyncFileTransfer:
+    """ftp/sftp transfers for one controller, run in worker threads off the event loop
+
+    logged-in sessions are kept open and reused between transfers, up to
+    max_sessions of them run in parallel. an idle session is checked with a
+    keepalive before it is reused, one the controller has dropped is replaced
+    """
+
+    def __init__(self, new_wrapper, max_sessions: int = 2) -> None:
+        """new_wrapper() returns an unconnected FTPWrapper/SFTPWrapper for the controller"""
+        self._new_wrapper = new_wrapper
+        self._limiter = anyio.CapacityLimiter(max_sessions)
+        self._idle = []
+
+    async def aclose(self) -> None:
+        idle, self._idle = self._idle, []
+        for ftp, _ in idle:
+            await anyio.to_thread.run_sync(ftp.close)
+
+    async def read_text(self, remotedir: str, remotefile: str) -> str:
+        return await self._run(remotedir, lambda ftp: ftp.gettext(remotefile))
+
+    async def read_lines(self, remotedir: str, remotefile: str) -> list:
+        text = await self.read_text(remotedir, remotefile)
+        return text.split('\n')
+
+    async def download(self, remotedir: str, remotefile: str, localfile: str) -> int:
+        """stream straight to disk, returns the number of bytes written"""
+        def transfer(ftp):
+            with open(localfile, 'wb') as fout:
+                ftp.download(remotefile, fout)
+                return fout.tell()
+        return await self._run(remotedir, transfer)
+
+    async def download_to_buffer(self, remotedir: str, remotefile: str) -> mmap.mmap:
+        """stream into an anonymous memory map sized from the remote file"""
+        def transfer(ftp):
+            buffer = mmap.mmap(-1, max(1, ftp.size(remotefile)))
+            ftp.download(remotefile, buffer)
+            buffer.seek(0)
+            return buffer
+        return await self._run(remotedir, transfer)
+
+    async def upload(self, data: bytes, remotedir: str, remotefile: str) -> None:
+        await self._run(remotedir, lambda ftp: ftp.putbytes(data, remotefile))
+
+    async def _run(self, remotedir: str, transfer):
+        def in_thread(session):
+            ftp, login_dir = session
+            # a reused session is wherever the last transfer left it
+            ftp.cwd(posixpath.join(login_dir, remotedir))
+            return transfer(ftp)
+
+        async with self._limiter:
+            async with self._session() as session:
+                return await anyio.to_thread.run_sync(in_thread, session)
+
+    @asynccontextmanager
+    async def _session(self):
+        session = await self._idle_session()
+        if session is None:
+            session = await anyio.to_thread.run_sync(self._connect)
+        try:
+            yield session
+        except BaseException:
+            # state unknown: do not hand it out again
+            with anyio.CancelScope(shield=True):
+                await anyio.to_thread.run_sync(session[0].close)
+            raise
+        self._idle.append(session)
+
+    async def _idle_session(self):
+        """an idle session that still answers, or None"""
+        while self._idle:
+            session = self._idle.pop()
+            try:
+                await anyio.to_thread.run_sync(session[0].keepalive)
+                return session
+            except SESSION_ERRORS:
+                # dropped by the controller while idle
+                await anyio.to_thread.run_sync(session[0].close)
+        return None
+
+    def _connect(self) -> tuple:
+        ftp = self._new_wrapper()
+        ftp.connect()
+        return ftp, ftp.pwd()
@@ -0,0 +1,390 @@
+"""benchmarks for the protocol, parsing and discovery hot paths
+
+    python -m <package>.benchmarks --save baseline.json
+    python -m <package>.benchmarks --compare baseline.json --tolerance 0.25
+
+the comparison run exits with status 1 when any result is worse than the
+baseline by more than the tolerance
+"""
+import argparse
+import json
+import platform
+import socket
+import socketserver
+import sys
+import threading
+import time
+import anyio
+from . import connection_pool
+from . import framing
+from . import ftp_wrappers
+from . import newport_xps
+from . import selector_client
+from . import simulator
+from . import trio_socket
+from . import xps_socket
+
+BASELINE_VERSION = 1
+
+# --backend name -> anyio backend and its options
+BACKENDS = {
+    "asyncio": ("asyncio", {}),
+    "trio": ("trio", {}),
+    "uvloop": ("asyncio", {"use_uvloop": True}),
+}
+
+
+class Result:
+    """one measured number, and which direction is better"""
+
+    def __init__(self, name: str, value: float, unit: str, higher_is_better: bool = False) -> None:
+        self.name = name
+        self.value = value
+        self.unit = unit
+        self.higher_is_better = higher_is_better
+
+    def to_dict(self) -> dict:
+        return {"value": self.value, "unit": self.unit, "higher_is_better": self.higher_is_better}
+
+
+def best_of(function, repeats: int = 5) -> float:
+    """shortest of several timed runs, the one least disturbed by the rest of the machine"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_async(backend: str, function, *args):
+    name, options = BACKENDS[backend]
+    return anyio.run(function, *args, backend=name, backend_options=options)
+
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# synthetic inputs
+
+def reply_bytes(size: int) -> bytes:
+    """a successful reply carrying about size bytes of comma separated values"""
+    field = b"1.234567,"
+    return b"0," + field * max(1, size // len(field)) + b"0" + framing.END_OF_API
+
+
+def synthetic_ini(n_groups: int, n_positioners: int = 1) -> list:
+    """stripped lines of a system.ini with n_groups groups, as get_ini_lines returns them"""
+    key = "SingleAxisInUse" if n_positioners == 1 else "MultipleAxesInUse"
+    group_names = [f"G{i}" for i in range(n_groups)]
+    lines = ["[GROUPS]", f"{key} = {', '.join(group_names)}"]
+    positioner_names = [f"P{j}" for j in range(n_positioners)]
+    for group_name in group_names:
+        lines += ["", f"[{group_name}]", f"PositionerInUse = {', '.join(positioner_names)}"]
+        for positioner_name in positioner_names:
+            lines += ["", f"[{group_name}.{positioner_name}]", "StageName = @SIM@SIMULATED_STAGE@",
+                      "PlugNumber = 1", "MotorDriverModel = XPS-DRV11", "EncoderType = AquadB",
+                      "MaximumVelocity = 20", "MaximumAcceleration = 80"]
+    return lines
+
+
+class BlobServer(socketserver.ThreadingTCPServer):
+    """loopback stand-in answering every command with the same canned reply"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, reply: bytes) -> None:
+        self.reply = reply
+        super().__init__(("127.0.0.1", 0), _BlobHandler)
+        self.port = self.server_address[1]
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class _BlobHandler(socketserver.BaseRequestHandler):
+
+    def handle(self) -> None:
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        pending = b""
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                return
+            pending += data
+            n_commands = pending.count(b")")
+            pending = pending[pending.rfind(b")") + 1:]
+            for _ in range(n_commands):
+                self.request.sendall(self.server.reply)
+
+
+# benchmarks
+
+def bench_framing(quick: bool, backend: str) -> list:
+    results = []
+    n_replies = 2000 if quick else 20000
+    small = reply_bytes(24)
+    stream = small * n_replies
+
+    def frame_small():
+        framer = framing.ReplyFramer()
+        for start in range(0, len(stream), 2048):
+            framer.feed(stream[start:start + 2048])
+            reply = framer.next_reply()
+            while reply is not None:
+                framing.parse_reply(reply)
+                reply = framer.next_reply()
+
+    seconds = best_of(frame_small)
+    results.append(Result("framing.small_replies_per_s", n_replies / seconds, "1/s", True))
+
+    for megabytes in (1, 4):
+        large = reply_bytes(megabytes * 1000000)
+
+        def frame_large():
+            framer = framing.ReplyFramer()
+            view = memoryview(large)
+            for start in range(0, len(large), 2048):
+                framer.feed(view[start:start + 2048])
+                reply = framer.next_reply()
+                if reply is not None:
+                    framing.parse_reply(reply)
+
+        seconds = best_of(frame_large, 3)
+        results.append(Result(f"framing.reply_{megabytes}mb_s", seconds, "s"))
+    return results
+
+
+def bench_parse_ini(quick: bool, backend: str) -> list:
+    results = []
+    for n_groups in ((500,) if quick else (500, 2000, 5000)):
+        lines = synthetic_ini(n_groups)
+        seconds = best_of(lambda: ftp_wrappers.FTPBaseWrapper.parse_ftp_string(lines))
+        results.append(Result(f"parse_ini.{2 * n_groups + 1}_sections_s", seconds, "s"))
+    return results
+
+
+async def _async_large_replies(port: int, repeats: int) -> float:
+    async with trio_socket.AsyncSocket("127.0.0.1", port, timeout=60.0) as sock:
+        await sock.send_recv("BlobGet(char *)")
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            await sock.send_recv("BlobGet(char *)")
+            times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_large_replies(quick: bool, backend: str) -> list:
+    results = []
+    for megabytes in ((1,) if quick else (1, 4)):
+        server = BlobServer(reply_bytes(megabytes * 1000000))
+        try:
+            seconds = run_async(backend, _async_large_replies, server.port, 3)
+            results.append(Result(f"async_socket.reply_{megabytes}mb_s", seconds, "s"))
+
+            sock = xps_socket.XpsSocket("127.0.0.1", server.port)
+            sock.send_recv("BlobGet(char *)")
+            seconds = best_of(lambda: sock.send_recv("BlobGet(char *)"), 3)
+            results.append(Result(f"xps_socket.reply_{megabytes}mb_s", seconds, "s"))
+        finally:
+            server.close()
+    return results
+
+
+async def _async_round_trips(n_commands: int) -> list:
+    results = []
+    command = "GroupPositionCurrentGet(G1,double *)"
+    async with simulator.XpsSimulator(n_groups=4) as sim:
+        async with trio_socket.AsyncSocket(sim.host, sim.port) as sock:
+            await sock.send_recv(command)
+            latencies = []
+            for _ in range(n_commands):
+                start = time.perf_counter()
+                await sock.send_recv(command)
+                latencies.append(time.perf_counter() - start)
+            results += [
+                Result("async_socket.round_trip_p50_s", percentile(latencies, 0.5), "s"),
+                Result("async_socket.round_trip_p99_s", percentile(latencies, 0.99), "s"),
+                Result("async_socket.sequential_commands_per_s", n_commands / sum(latencies), "1/s", True),
+            ]
+
+            batch = [command] * 100
+            start = time.perf_counter()
+            for _ in range(n_commands // 100):
+                await sock.send_recv_many(batch)
+            seconds = time.perf_counter() - start
+            results.append(Result("async_socket.pipelined_commands_per_s",
+                                  (n_commands // 100) * 100 / seconds, "1/s", True))
+
+        async with connection_pool.ConnectionPool(sim.host, sim.port, size=4) as pool:
+            async def worker(n):
+                for _ in range(n):
+                    await pool.send_recv(command)
+
+            start = time.perf_counter()
+            async with anyio.create_task_group() as nursery:
+                for _ in range(16):
+                    nursery.start_soon(worker, n_commands // 16)
+            seconds = time.perf_counter() - start
+            results.append(Result("connection_pool.concurrent_commands_per_s",
+                                  16 * (n_commands // 16) / seconds, "1/s", True))
+    return results
+
+
+def bench_round_trips(quick: bool, backend: str) -> list:
+    n_commands = 1000 if quick else 5000
+    results = run_async(backend, _async_round_trips, n_commands)
+
+    sim = simulator.XpsSimulator(n_groups=4).start_in_thread(BACKENDS[backend][0])
+    try:
+        sock = xps_socket.XpsSocket(sim.host, sim.port)
+        command = "GroupPositionCurrentGet(G1,double *)"
+        latencies = []
+        for _ in range(n_commands):
+            start = time.perf_counter()
+            sock.send_recv(command)
+            latencies.append(time.perf_counter() - start)
+
+        with selector_client.SelectorClient() as client:
+            for index in range(4):
+                client.add(f"C{index}", sim.host, sim.port)
+            batches = {name: [command] * 25 for name in client.names}
+            client.send_recv_many(batches)
+            start = time.perf_counter()
+            for _ in range(n_commands // 100):
+                client.send_recv_many(batches)
+            seconds = time.perf_counter() - start
+    finally:
+        sim.stop_thread()
+    results += [
+        Result("xps_socket.round_trip_p50_s", percentile(latencies, 0.5), "s"),
+        Result("xps_socket.round_trip_p99_s", percentile(latencies, 0.99), "s"),
+        Result("selector_client.multiplexed_commands_per_s", (n_commands // 100) * 100 / seconds, "1/s", True),
+    ]
+    return results
+
+
+async def _factory_build(n_groups: int) -> float:
+    async with simulator.XpsSimulator(n_groups=n_groups) as sim:
+        async with connection_pool.ConnectionPool(sim.host, sim.port, size=4) as pool:
+            start = time.perf_counter()
+            xps = await newport_xps.XpsFactory(ftp_port=sim.ftp_port).build(pool)
+            seconds = time.perf_counter() - start
+            await xps.aclose()
+    return seconds
+
+
+def bench_factory_build(quick: bool, backend: str) -> list:
+    results = []
+    for n_groups in ((8, 64) if quick else (8, 64, 256)):
+        seconds = min(run_async(backend, _factory_build, n_groups) for _ in range(3))
+        results.append(Result(f"factory_build.{n_groups}_groups_s", seconds, "s"))
+    return results
+
+
+BENCHMARKS = {
+    "framing": bench_framing,
+    "parse_ini": bench_parse_ini,
+    "large_replies": bench_large_replies,
+    "round_trips": bench_round_trips,
+    "factory_build": bench_factory_build,
+}
+
+
+def run(names: list = None, quick: bool = False, backend: str = "asyncio") -> list:
+    results = []
+    for name in names or BENCHMARKS:
+        results += BENCHMARKS[name](quick, backend)
+    return results
+
+
+# baselines
+
+def to_baseline(results: list, backend: str = "asyncio") -> dict:
+    return {
+        "version": BASELINE_VERSION,
+        "backend": backend,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "results": {result.name: result.to_dict() for result in results},
+    }
+
+
+def save_baseline(results: list, filename: str, backend: str = "asyncio") -> None:
+    with open(filename, "w") as fout:
+        json.dump(to_baseline(results, backend), fout, indent=2, sort_keys=True)
+
+
+def load_baseline(filename: str) -> dict:
+    with open(filename) as fin:
+        baseline = json.load(fin)
+    if baseline.get("version") != BASELINE_VERSION:
+        raise ValueError(f"{filename}: unsupported baseline version {baseline.get('version')}")
+    return baseline
+
+
+def compare(baseline: dict, results: list, tolerance: float = 0.2, backend: str = None) -> list:
+    """(name, baseline value, new value) of every result worse than the baseline by more than tolerance
+
+    backend: the one the results were measured on. timings from different
+    event loops are not comparable, so a baseline from another one is refused
+    """
+    if backend is not None and baseline.get("backend", backend) != backend:
+        raise ValueError(f"baseline measured on {baseline['backend']}, results on {backend}")
+    regressions = []
+    for result in results:
+        reference = baseline["results"].get(result.name)
+        if reference is None:
+            continue
+        old = reference["value"]
+        if result.higher_is_better:
+            worse = result.value < old * (1 - tolerance)
+        else:
+            worse = result.value > old * (1 + tolerance)
+        if worse:
+            regressions.append((result.name, old, result.value))
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("names", nargs="*", metavar="NAME",
+                        help=f"benchmarks to run, default all of: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--quick", action="store_true", help="smaller inputs, fewer repeats")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="asyncio",
+                        help="event loop for the async benchmarks (uvloop needs the uvloop package)")
+    parser.add_argument("--save", metavar="FILE", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="fail on regressions against a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative slowdown before a result counts as a regression")
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = run(args.names, args.quick, args.backend)
+    for result in results:
+        print(f"{result.name:48s} {result.value:14.6g} {result.unit}")
+    if args.save:
+        save_baseline(results, args.save, args.backend)
+
+    if args.compare:
+        try:
+            regressions = compare(load_baseline(args.compare), results, args.tolerance, args.backend)
+        except ValueError as err:
+            parser.error(f"{args.compare}: {err}")
+        for name, old, new in regressions:
+            print(f"REGRESSION {name}: {old:.6g} -> {new:.6g}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
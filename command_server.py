@@ -0,0 +1,71 @@
+import math
+import anyio
+import anyio.from_thread
+from . import framing
+
+
+class CommandServer:
+    """the command port side shared by the simulator and the replay server
+
+    commands on one connection are answered in order: _reply_to gives the
+    reply to each one and when to deliver it. fragment_size splits replies
+    into several writes
+    """
+    fragment_size = None
+    # start_in_thread: the blocking portal running the loop, and this server entered in it
+    _portal_context = None
+    _thread_context = None
+
+    def start_in_thread(self, backend: str = "asyncio") -> "CommandServer":
+        """serve from an event loop of its own on a background thread, for synchronous clients like XpsSocket"""
+        self._portal_context = anyio.from_thread.start_blocking_portal(backend)
+        portal = self._portal_context.__enter__()
+        # entered and exited in one task of the portal's loop
+        self._thread_context = portal.wrap_async_context_manager(self)
+        self._thread_context.__enter__()
+        return self
+
+    def stop_thread(self) -> None:
+        self._thread_context.__exit__(None, None, None)
+        self._portal_context.__exit__(None, None, None)
+
+    async def _reply_to(self, command: str):
+        """(reply text without the terminator, time to deliver it), or None to close the connection"""
+        raise NotImplementedError
+
+    async def _serve_commands(self, stream: anyio.abc.SocketStream) -> None:
+        send_replies, pending_replies = anyio.create_memory_object_stream(math.inf)
+        async with stream, anyio.create_task_group() as task_group:
+            task_group.start_soon(self._send_replies, stream, pending_replies)
+            async with send_replies:
+                buffer = b""
+                while True:
+                    try:
+                        data = await stream.receive(65536)
+                    except (anyio.EndOfStream, anyio.BrokenResourceError):
+                        break
+                    buffer += data
+                    while b")" in buffer:
+                        end = buffer.index(b")") + 1
+                        command, buffer = buffer[:end].decode(), buffer[end:]
+                        answer = await self._reply_to(command)
+                        if answer is None:
+                            # replies already queued still go out, then the connection closes
+                            return
+                        reply, deliver_at = answer
+                        send_replies.send_nowait((reply.encode() + framing.END_OF_API, deliver_at))
+
+    async def _send_replies(self, stream: anyio.abc.SocketStream, pending_replies) -> None:
+        step = self.fragment_size
+        async for reply, deliver_at in pending_replies:
+            # a tcp stream keeps its order: a late reply holds up the ones behind it
+            await anyio.sleep_until(deliver_at)
+            try:
+                if not step:
+                    await stream.send(reply)
+                    continue
+                for start in range(0, len(reply), step):
+                    await stream.send(reply[start:start + step])
+                    await anyio.sleep(0)
+            except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+                return
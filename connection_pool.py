@@ -0,0 +1,71 @@
+import anyio
+from contextlib import asynccontextmanager, AsyncExitStack
+from . import instrumentation as instr
+from . import wire_recorder
+from . import trio_socket
+
+
+class ConnectionPool:
+    """a fixed number of connections to the XPS command port
+
+    each command checks out one connection exclusively, tasks waiting for a
+    connection are served first come, first served
+    """
+
+    def __init__(self, host: str, port: int = 5001, size: int = 4,
+                 instrumentation: instr.Instrumentation = None, recorder: wire_recorder.WireRecorder = None,
+                 timeout: float = 10.0):
+        if size < 1:
+            raise ValueError("pool size must be at least 1")
+        self.host = host
+        self.port_number = port
+        self.size = size
+        # shared by every connection of the pool
+        self.instrumentation = instrumentation
+        # optional, shared by every connection of the pool
+        self.recorder = recorder
+        # seconds each connection waits for the replies of a call, see AsyncSocket
+        self.timeout = timeout
+        self._exit_stack = None
+        self._idle_send, self._idle_recv = anyio.create_memory_object_stream(size)
+
+    async def __aenter__(self):
+        async with AsyncExitStack() as stack:
+            for _ in range(self.size):
+                sock = trio_socket.AsyncSocket(self.host, self.port_number, self.instrumentation,
+                                               timeout=self.timeout, recorder=self.recorder)
+                self._idle_send.send_nowait(await stack.enter_async_context(sock))
+            self._exit_stack = stack.pop_all()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._exit_stack.aclose()
+        self._exit_stack = None
+
+    @asynccontextmanager
+    async def checkout(self):
+        # memory channels hand out values to waiting receivers in FIFO order
+        sock = await self._idle_recv.receive()
+        try:
+            yield sock
+        finally:
+            self._idle_send.send_nowait(sock)
+
+    # timeout: seconds to wait for the replies, None for commands answered when motion ends,
+    # the default -1 keeps the connection's own deadline
+    async def send_recv(self, cmd, timeout: float = -1):
+        async with self.checkout() as sock:
+            return await sock.send_recv(cmd, timeout)
+
+    # the whole batch is pipelined down a single connection
+    async def send_recv_many(self, cmds, timeout: float = -1) -> list:
+        async with self.checkout() as sock:
+            return await sock.send_recv_many(cmds, timeout)
+
+    async def send_recv_raw(self, cmd, timeout: float = -1) -> str:
+        async with self.checkout() as sock:
+            return await sock.send_recv_raw(cmd, timeout)
+
+    async def send_recv_raw_many(self, cmds, timeout: float = -1) -> list:
+        async with self.checkout() as sock:
+            return await sock.send_recv_raw_many(cmds, timeout)
@@ -0,0 +1,250 @@
+import anyio
+from contextlib import AsyncExitStack
+from . import connection_pool
+from . import instrumentation as instr
+from . import motion_channel
+from . import motion_group
+from . import newport_xps
+from . import status_codes
+from . import status_data
+from . import trio_socket
+from . import wire_recorder
+
+
+class StopIncomplete(trio_socket.MyException):
+    """some groups could not be told to stop, every other stop was still sent
+
+    stopped: the groups that were stopped, errors: group (or controller) -> exception
+    """
+
+    def __init__(self, stopped: list, errors: dict):
+        super().__init__("could not stop " + "; ".join(f"{name}: {err}" for name, err in errors.items()))
+        self.stopped = stopped
+        self.errors = errors
+
+
+class FleetController:
+    """one controller of a fleet: its command pool, motion channels and discovered groups
+
+    entering opens the motion channels, connect() the pool and discovery
+    """
+
+    def __init__(self, host: str, port: int = 5001, name: str = None, pool_size: int = 4,
+                 factory: newport_xps.XpsFactory = None, recorder: wire_recorder.WireRecorder = None) -> None:
+        """name: the controller's part of fleet paths, default the host
+        recorder: optional, logs the traffic of the pool and the motion channels"""
+        self.host = host
+        self.port_number = port
+        self.name = name or host
+        self.pool_size = pool_size
+        self.factory = factory or newport_xps.XpsFactory()
+        self.instrumentation = instr.Instrumentation(host)
+        self.recorder = recorder
+        self.pool = None
+        self.motion = None
+        self.xps = None
+        self._exit_stack = None
+        # the pool and ftp sessions, opened by connect()
+        self._connections = None
+
+    async def __aenter__(self):
+        async with AsyncExitStack() as stack:
+            # unwound in reverse: drop the connections, then wait for running moves
+            self.motion = await stack.enter_async_context(
+                motion_channel.MotionChannels(self.host, self.port_number, self.instrumentation, self.recorder))
+            stack.push_async_callback(self._disconnect)
+            self._exit_stack = stack.pop_all()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._exit_stack.__aexit__(exc_type, exc_val, exc_tb)
+        self._exit_stack = None
+
+    async def connect(self) -> None:
+        """open the pool and discover the groups; may run in a task other than the one that entered"""
+        async with AsyncExitStack() as stack:
+            self.pool = await stack.enter_async_context(connection_pool.ConnectionPool(
+                self.host, self.port_number, self.pool_size, self.instrumentation, self.recorder))
+            self.xps = await self.factory.build(self.pool)
+            stack.push_async_callback(self.xps.aclose)
+            self._connections = stack.pop_all()
+
+    async def _disconnect(self) -> None:
+        if self._connections is not None:
+            await self._connections.aclose()
+            self._connections = None
+
+    # GroupPositionCurrentGet :  Return current positions, every group in one pipelined batch
+    async def positions(self, groups: list = None) -> dict:
+        groups = self.xps.groups if groups is None else groups
+        replies = await self.pool.send_recv_raw_many(
+            [group.vector_command("GroupPositionCurrentGet") for group in groups])
+        return {group.name: group.parse_vector(reply) for group, reply in zip(groups, replies)}
+
+    # GroupMoveAbort :  Abort a move, on every group
+    async def stop(self) -> list:
+        """names of the groups whose move was aborted
+
+        StopIncomplete once every group has been tried, if any could not be reached
+        """
+        stopped = []
+        errors = {}
+
+        async def abort(group):
+            try:
+                await self.pool.send_recv(f"GroupMoveAbort({group.name})")
+            except trio_socket.MyException as err:
+                if err.code != status_codes.ERR_NOT_ALLOWED:
+                    # no answer or another error: the group may still be moving
+                    errors[group.name] = err
+                # otherwise not moving
+                return
+            stopped.append(group.name)
+
+        async with anyio.create_task_group() as nursery:
+            for group in self.xps.groups:
+                nursery.start_soon(abort, group)
+        if errors:
+            raise StopIncomplete(stopped, errors)
+        return stopped
+
+
+class XpsFleet:
+    """several controllers as one, groups addressed as 'controller/group'
+
+        async with XpsFleet(["xps1", "xps2"]) as fleet:
+            await fleet.move_to("xps2/XY", [1.0, 2.0])
+            reports = await fleet.status()
+
+    connecting, discovery and the fleet wide operations run concurrently on
+    every controller, so they take about as long as the slowest controller
+    """
+    separator = "/"
+
+    def __init__(self, controllers) -> None:
+        """controllers: host names or FleetController instances"""
+        self.controllers = {}
+        for controller in controllers:
+            if isinstance(controller, str):
+                controller = FleetController(controller)
+            if controller.name in self.controllers:
+                raise ValueError(f"two controllers named {controller.name}")
+            self.controllers[controller.name] = controller
+        self._exit_stack = None
+
+    async def __aenter__(self):
+        async with AsyncExitStack() as stack:
+            # motion channels hold a nursery, they are entered here in this task
+            for controller in self.controllers.values():
+                await stack.enter_async_context(controller)
+            # the slow part: connections and discovery, all controllers at once
+            async with anyio.create_task_group() as nursery:
+                for controller in self.controllers.values():
+                    nursery.start_soon(controller.connect)
+            self._exit_stack = stack.pop_all()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._exit_stack.__aexit__(exc_type, exc_val, exc_tb)
+        self._exit_stack = None
+
+    @property
+    def paths(self) -> list:
+        """'controller/group' for every group of the fleet"""
+        return [self.separator.join((controller.name, group.name))
+                for controller in self.controllers.values() for group in controller.xps.groups]
+
+    def resolve(self, path: str) -> tuple:
+        """'controller/group' -> (FleetController, XpsMotionGroup)"""
+        name, separator, group_name = path.rpartition(self.separator)
+        if not separator:
+            raise ValueError(f"expected 'controller{self.separator}group', got '{path}'")
+        controller = self.controllers.get(name)
+        if controller is None:
+            raise ValueError(f"unknown controller '{name}'")
+        return controller, controller.xps.get_group(group_name)
+
+    def group(self, path: str) -> motion_group.XpsMotionGroup:
+        return self.resolve(path)[1]
+
+    async def position(self, path: str):
+        controller, group = self.resolve(path)
+        return await group.get_current_position(controller.pool)
+
+    async def positions(self, paths: list = None) -> dict:
+        """path -> current position, of paths or every group; one batch per controller"""
+        by_controller = {}
+        for path in (self.paths if paths is None else paths):
+            controller, group = self.resolve(path)
+            by_controller.setdefault(controller.name, []).append(group)
+
+        results = await self._fan_out({name: (lambda controller, groups=groups: controller.positions(groups))
+                                       for name, groups in by_controller.items()})
+        return {self.separator.join((name, group_name)): position
+                for name, positions in results.items() for group_name, position in positions.items()}
+
+    async def status(self, names: list = None) -> dict:
+        """controller name -> StatusReport, of names or every controller"""
+        return await self._fan_out({name: self._collect_status for name in names or self.controllers})
+
+    async def get_status(self, path: str):
+        controller, group = self.resolve(path)
+        return await group.get_status(controller.pool)
+
+    async def move_to(self, path: str, target_position):
+        controller, group = self.resolve(path)
+        return await group.move_to(controller.pool, target_position)
+
+    def start_move_to(self, path: str, target_position) -> motion_channel.MoveHandle:
+        controller, group = self.resolve(path)
+        return group.start_move_to(controller.motion, target_position)
+
+    async def move_many(self, targets: dict) -> None:
+        """path -> target position, all moves at once; returns when every move has ended"""
+        handles = [self.start_move_to(path, target) for path, target in targets.items()]
+        for handle in handles:
+            await handle.wait()
+
+    async def stop_all(self) -> list:
+        """abort every move of the fleet, returns the paths of the groups that were moving
+
+        a controller that cannot be reached does not hold up the others: once
+        all have been tried StopIncomplete reports it, by path or controller name
+        """
+        stopped = []
+        errors = {}
+
+        async def stop(controller):
+            try:
+                group_names = await controller.stop()
+            except StopIncomplete as err:
+                group_names = err.stopped
+                errors.update((self.separator.join((controller.name, name)), group_err)
+                              for name, group_err in err.errors.items())
+            except Exception as err:
+                group_names = []
+                errors[controller.name] = err
+            stopped.extend(self.separator.join((controller.name, name)) for name in group_names)
+
+        async with anyio.create_task_group() as nursery:
+            for controller in self.controllers.values():
+                nursery.start_soon(stop, controller)
+        if errors:
+            raise StopIncomplete(stopped, errors)
+        return stopped
+
+    @staticmethod
+    async def _collect_status(controller: FleetController) -> status_data.StatusReport:
+        return await controller.xps.collect_status(controller.pool)
+
+    async def _fan_out(self, calls: dict) -> dict:
+        """controller name -> coroutine function of the controller, all run concurrently"""
+        results = {}
+
+        async def call(name, function):
+            results[name] = await function(self.controllers[name])
+
+        async with anyio.create_task_group() as nursery:
+            for name, function in calls.items():
+                nursery.start_soon(call, name, function)
+        return {name: results[name] for name in calls}
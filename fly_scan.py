@@ -0,0 +1,111 @@
+import math
+import anyio
+from . import connection_pool
+from . import gathering
+from . import motion_channel
+from . import motion_group
+from .numpy_support import check_numpy, np
+
+
+class FlyScan:
+    """one continuous move instead of a move-settle-read cycle per point
+
+    position compare sends a pulse every step between start and stop. the
+    pulses are expected to be wired from the positioner's PCO output to the
+    controller's trigger input, where external gathering latches the position
+    at each one. the move starts and ends a run-up distance outside the scan
+    so the stage is at constant velocity while pulses are sent
+    """
+    # extra run-up on top of the distance needed to reach velocity
+    run_up_margin = 1.2
+
+    def __init__(self, group: motion_group.XpsMotionGroup, start: float, stop: float,
+                 step: float, velocity: float) -> None:
+        if step <= 0 or velocity <= 0:
+            raise ValueError("step and velocity must be positive")
+        if len(group.positioners) != 1:
+            raise ValueError("fly scans need a single positioner group")
+        self.group = group
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.velocity = velocity
+
+    @property
+    def n_points(self) -> int:
+        return int(math.floor(abs(self.stop - self.start) / self.step + 1e-9)) + 1
+
+    @property
+    def direction(self) -> int:
+        return 1 if self.stop >= self.start else -1
+
+    def run_up_distance(self) -> float:
+        accel = self.group.positioner.max_accel
+        return self.run_up_margin * self.velocity ** 2 / (2 * accel)
+
+    @property
+    def move_start(self) -> float:
+        return self.start - self.direction * self.run_up_distance()
+
+    @property
+    def move_end(self) -> float:
+        return self.stop + self.direction * self.run_up_distance()
+
+    def expected_positions(self):
+        """positions at which position compare fires"""
+        return self.start + self.direction * self.step * np.arange(self.n_points)
+
+    def check_limits(self) -> list:
+        pos = self.group.positioner
+        problems = []
+        if self.velocity > pos.max_velocity:
+            problems.append(f"velocity {self.velocity:g} > {pos.max_velocity:g}")
+        for position in (self.move_start, self.move_end):
+            if not pos.min_position <= position <= pos.max_position:
+                problems.append(f"run-up position {position:g} outside "
+                                f"[{pos.min_position:g}, {pos.max_position:g}]")
+        return problems
+
+    async def run(self, xps, pool: connection_pool.ConnectionPool,
+                  motion: motion_channel.MotionChannels) -> dict:
+        """run the scan on controller xps (a NewportXps),
+        returns {'target': expected trigger positions, 'position': latched positions}"""
+        check_numpy()
+        problems = self.check_limits()
+        if problems:
+            raise ValueError("fly scan outside limits: " + "; ".join(problems))
+
+        pos_name = self.group.positioner.name
+        # PositionerSGammaParametersGet :  Read dynamic parameters for one axe of a group for a future displacement
+        velocity, accel, min_jerk, max_jerk = await pool.send_recv(
+            f"PositionerSGammaParametersGet({pos_name},double *,double *,double *,double *)")
+
+        await self.group.start_move_to(motion, self.move_start).wait()
+        try:
+            low, high = sorted((self.start, self.stop))
+            await pool.send_recv_many([
+                f"PositionerSGammaParametersSet({pos_name},{self.velocity},{accel},{min_jerk},{max_jerk})",
+                # PositionerPositionCompareSet :  Set position compare parameters
+                f"PositionerPositionCompareSet({pos_name},{low},{high},{self.step})",
+                # PositionerPositionCompareEnable :  Enable position compare
+                f"PositionerPositionCompareEnable({pos_name})",
+                # GatheringExternalConfigurationSet :  Configuration acquisition
+                f"GatheringExternalConfigurationSet({pos_name}.{gathering.EXTERNAL_LATCH_POSITION})",
+                # GatheringExternalArm :  Arm the external gathering
+                "GatheringExternalArm()",
+            ])
+            await self.group.start_move_to(motion, self.move_end).wait()
+            # GatheringExternalStopAndSave :  Stop acquisition and save data
+            await pool.send_recv("GatheringExternalStopAndSave()")
+        finally:
+            # restore the controller even if the scan was cancelled
+            with anyio.CancelScope(shield=True):
+                await pool.send_recv_many([
+                    # PositionerPositionCompareDisable :  Disable position compare
+                    f"PositionerPositionCompareDisable({pos_name})",
+                    f"PositionerSGammaParametersSet({pos_name},{velocity},{accel},{min_jerk},{max_jerk})",
+                ])
+
+        _, samples = await xps.fetch_gathering_file(gathering.EXTERNAL_GATHERING_FILE)
+        positions = samples[:, 0].copy() if samples.size else np.empty(0)
+        return {"target": self.expected_positions(), "position": positions}
@@ -0,0 +1,155 @@
+END_OF_API = b',EndOfAPI'
+
+# controller error codes, the first value of an error reply
+ERR_STRING_TOO_LONG = -3
+ERR_UNKNOWN_COMMAND = -4
+ERR_WRONG_FORMAT = -7
+ERR_WRONG_PARAMETERS_NUMBER = -9
+ERR_OUT_OF_RANGE = -17
+ERR_POSITIONER_NAME = -18
+ERR_GROUP_NAME = -19
+ERR_NOT_ALLOWED = -22
+ERR_MOVE_ABORTED = -27
+
+
+class MyException(Exception):
+    """XPS Controller Exception"""
+
+    def __init__(self, msg, code: int = None):
+        self.msg = msg
+        # the controller's error code, None when the error did not come from a reply
+        self.code = code
+
+    def __str__(self):
+        return str(self.msg)
+
+
+class XpsTimeout(MyException):
+    """no reply before the deadline, the connection is reset"""
+
+
+class ConnectionLost(MyException):
+    """the connection dropped before every reply was read"""
+
+
+class DesyncError(ConnectionLost):
+    """a reply did not match its command, the stream can no longer be trusted"""
+
+
+class ReplyFramer:
+    """splits the byte stream coming back from the controller into replies
+
+    received bytes are appended to one growing bytearray and only the newly
+    arrived bytes are scanned for the terminator, so framing stays linear in
+    the size of the reply. bytes following a terminator are kept for the next
+    reply, as happens when commands are pipelined
+    """
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        # no terminator starts before this offset
+        self._scan_from = 0
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def feed(self, data) -> None:
+        """append received bytes (bytes, bytearray or memoryview)"""
+        self._buffer += data
+
+    def next_reply(self):
+        """returns the text of the next complete reply without its terminator, or None"""
+        end = self._buffer.find(END_OF_API, self._scan_from)
+        if end == -1:
+            # the terminator may straddle the next chunk
+            self._scan_from = max(0, len(self._buffer) - len(END_OF_API) + 1)
+            return None
+
+        # decode straight out of the receive buffer, without an intermediate bytes copy
+        with memoryview(self._buffer) as view, view[:end] as frame:
+            reply = str(frame, 'utf-8')
+        # deleting from the front of a bytearray does not move the remaining bytes
+        del self._buffer[:end + len(END_OF_API)]
+        self._scan_from = 0
+        return reply
+
+    def clear(self) -> None:
+        self._buffer.clear()
+        self._scan_from = 0
+
+
+def command_name(command: str) -> str:
+    """'GroupMoveAbsolute(G1.P1,1.0)' -> 'GroupMoveAbsolute'"""
+    end = command.find('(')
+    return command if end == -1 else command[:end]
+
+
+# *Get functions that clear what they read: sent twice, the second reply loses the value
+READ_AND_CLEAR = frozenset(['PositionerErrorGet'])
+# functions that only read, though their names do not end in Get
+READ_ONLY = frozenset(['PositionerErrorRead'])
+
+
+def is_read_only(command: str) -> bool:
+    """*Get functions only read controller state, sending one twice is harmless
+    (apart from those in READ_AND_CLEAR)"""
+    name = command_name(command)
+    if name in READ_ONLY:
+        return True
+    return name.endswith('Get') and name not in READ_AND_CLEAR
+
+
+def expected_fields(command: str):
+    """number of values a successful reply carries, None if it cannot be told
+
+    char * outputs may themselves contain commas
+    """
+    n_outputs = command.count('*')
+    if n_outputs == 0 or 'char *' in command:
+        return None
+    return n_outputs
+
+
+def check_reply(command: str, reply: str) -> int:
+    """error code of the reply, ValueError when the reply cannot be the answer to command"""
+    comma = reply.find(',')
+    try:
+        err = int(reply if comma == -1 else reply[:comma])
+    except ValueError:
+        raise ValueError(f"unreadable reply {reply[:40]!r} to {command}") from None
+    n_fields = expected_fields(command)
+    if err == 0 and n_fields is not None and reply.count(',') != n_fields:
+        raise ValueError(f"{reply.count(',')} values in reply to {command}")
+    return err
+
+
+def split_reply(reply: str) -> tuple:
+    """'err,field,field' -> (err, 'field,field'), the values are left for the caller to decode"""
+    comma = reply.find(',')
+    if comma == -1:
+        return int(reply), ''
+    return int(reply[:comma]), reply[comma + 1:]
+
+
+def parse_reply(reply: str) -> tuple:
+    """'err,field,field' -> (err, [field, field])"""
+    parsed = reply.split(',')
+    return int(parsed[0]), parsed[1:]
+
+
+def unpack_reply(reply: str):
+    """the single field of a reply or the list of its fields, MyException for an error reply"""
+    err, fields = parse_reply(reply)
+    if err != 0:
+        raise MyException(fields, err)
+    if len(fields) == 1:
+        return fields[0]
+    return fields
+
+
+def checked_values(reply: str) -> str:
+    """the values of a reply as one undivided string, MyException for an error reply"""
+    err, values = split_reply(reply)
+    if err != 0:
+        raise MyException(values.split(','), err)
+    return values
@@ -36,20 +36,35 @@ class FTPBaseWrapper(object):
     """base clase for ftp interactions for Newport XPS
     needs to be overwritten -- use SFTPWrapper or FTPWrapper"""
     def __init__(self, host=None, username='Administrator',
-                 password='Administrator'):
+                 password='Administrator', port=None):
         self.host = host
         self.username = username
         self.password = password
+        # None: the protocol's standard port
+        self.port = port
         self._conn = None
 
     def get_ini_info(self, ftphome):
+        lines = self.get_ini_lines(ftphome)
+        parsed = self.parse_ftp_string(lines)
+        return parsed
+
+    def get_ini_lines(self, ftphome):
+        "stripped lines of system.ini"
         self.connect()
         self.cwd(os.path.join(ftphome, 'Config'))
         lines = self.getlines('system.ini')
         lines = [line.strip() for line in lines]
         self.close()
-        parsed = self.parse_ftp_string(lines)
-        return parsed
+        return lines
+
+    def get_gathering_text(self, ftphome, filename='Gathering.dat'):
+        "whole text of the last GatheringStopAndSave (or GatheringExternalStopAndSave)"
+        self.connect()
+        self.cwd(os.path.join(ftphome, 'Public'))
+        text = self.gettext(filename)
+        self.close()
+        return text
 
     @staticmethod
     def parse_ftp_string(string_in):
@@ -85,28 +100,61 @@ class FTPBaseWrapper(object):
     def cwd(self, remotedir):
         self._conn.cwd(remotedir)
 
+    def pwd(self):
+        return self._conn.pwd()
+
     def connect(self):
         raise NotImplemented
 
     def save(self, remotefile, localfile):
         "save remote file to local file"
+        with open(localfile, 'wb') as fout:
+            self.download(remotefile, fout)
+
+    def download(self, remotefile, fileobj):
+        "stream remote file into a writable file object, chunk by chunk"
         raise NotImplemented
 
-    def getlines(self, remotefile):
-        "read text of remote file"
+    def size(self, remotefile):
+        "size of remote file in bytes"
         raise NotImplemented
 
+    def keepalive(self):
+        "cheap round trip on an open session, raises if it has dropped"
+        raise NotImplemented
+
+    def gettext(self, remotefile):
+        "read text of remote file"
+        tmp = bytesio()
+        self.download(remotefile, tmp)
+        return bytes2str(tmp.getvalue())
+
+    def getlines(self, remotefile):
+        "read lines of remote file"
+        return self.gettext(remotefile).split('\n')
+
     def put(self, text, remotefile):
         "put text to remote file"
+        self.putbytes(six.b(text), remotefile)
+
+    def putbytes(self, data, remotefile):
+        "put bytes to remote file, the buffer is sent as is without copying"
         raise NotImplemented
 
+    def put_trajectory(self, data, filename, ftphome):
+        "upload trajectory file contents (bytes) to Public/Trajectories"
+        self.connect()
+        self.cwd(os.path.join(ftphome, 'Public', 'Trajectories'))
+        self.putbytes(data, filename)
+        self.close()
+
 
 class SFTPWrapper(FTPBaseWrapper):
     """wrap ftp interactions for Newport XPS models D"""
     def __init__(self, host=None, username='Administrator',
-                 password='Administrator'):
+                 password='Administrator', port=None):
         FTPBaseWrapper.__init__(self, host=host,
-                                username=username, password=password)
+                                username=username, password=password, port=port)
 
     def connect(self):
 
@@ -118,57 +166,54 @@ class SFTPWrapper(FTPBaseWrapper):
         self._conn = pysftp.Connection(self.host,
                                        username=self.username,
                                        password=self.username,
+                                       port=self.port or 22,
                                        cnopts=cnopts)
 
-    def save(self, remotefile, localfile):
-        "save remote file to local file"
-        self._conn.get(remotefile, remotefile)
+    def download(self, remotefile, fileobj):
+        "stream remote file into a writable file object, chunk by chunk"
+        self._conn.getfo(remotefile, fileobj)
 
-    def getlines(self, remotefile):
-        "read text of remote file"
-        tmp = bytesio()
-        self._conn.getfo(remotefile, tmp)
-        tmp.seek(0)
-        text = bytes2str(tmp.read())
-        return text.split('\n')
+    def size(self, remotefile):
+        return self._conn.stat(remotefile).st_size
 
-    def put(self, text, remotefile):
-        txtfile = bytesio(six.b(text))
-        self._conn.putfo(txtfile, remotefile)
+    def keepalive(self):
+        self._conn.normalize('.')
+
+    def pwd(self):
+        return self._conn.pwd
+
+    def putbytes(self, data, remotefile):
+        # BytesIO shares the buffer of a bytes object rather than copying it
+        self._conn.putfo(bytesio(data), remotefile)
 
 
 class FTPWrapper(FTPBaseWrapper):
     """wrap ftp interactions for Newport XPS models C and Q"""
+    blocksize = 65536
+
     def __init__(self, host=None, username='Administrator',
-                 password='Administrator'):
+                 password='Administrator', port=None):
         FTPBaseWrapper.__init__(self, host=host,
-                                username=username, password=password)
+                                username=username, password=password, port=port)
 
     def connect(self):
 
         self._conn = ftplib.FTP()
-        self._conn.connect(self.host)
+        self._conn.connect(self.host, self.port or 21)
         self._conn.login(self.username, self.password)
 
-    def save(self, remotefile, localfile):
-        "save remote file to local file"
-        output = []
-        x = self._conn.retrbinary('RETR %s' % remotefile, output.append)
-        open_opts = {}
-        if six.PY3:
-            open_opts['encoding'] = FTP_ENCODING
-        with open(localfile, 'w', **open_opts) as fout:
-            fout.write(''.join([bytes2str(s) for s in output]))
+    def download(self, remotefile, fileobj):
+        "stream remote file into a writable file object, chunk by chunk"
+        self._conn.retrbinary('RETR %s' % remotefile, fileobj.write, blocksize=self.blocksize)
 
-    def getlines(self, remotefile):
-        "read text of remote file"
-        output = []
-        self._conn.retrbinary('RETR %s' % remotefile, output.append)
-        text = ''.join([bytes2str(line) for line in output])
-        return text.split('\n')
+    def size(self, remotefile):
+        self._conn.voidcmd('TYPE I')
+        return self._conn.size(remotefile)
 
-    def put(self, text, remotefile):
-        txtfile = bytesio(six.b(text))
-        # print(" Put ", text, txtfile)
-        self._conn.storbinary('STOR %s' % remotefile, txtfile)
+    def keepalive(self):
+        self._conn.voidcmd('NOOP')
+
+    def putbytes(self, data, remotefile):
+        # BytesIO shares the buffer of a bytes object rather than copying it
+        self._conn.storbinary('STOR %s' % remotefile, bytesio(data))
 
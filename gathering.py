@@ -0,0 +1,150 @@
+import io
+import anyio
+from . import connection_pool
+from . import motion_group
+from . import status_codes
+from . import trio_socket
+from .numpy_support import check_numpy, np
+
+# gatherable quantities of a positioner, appended to its full name
+CURRENT_POSITION = "CurrentPosition"
+SETPOINT_POSITION = "SetpointPosition"
+FOLLOWING_ERROR = "FollowingError"
+CURRENT_VELOCITY = "CurrentVelocity"
+SETPOINT_VELOCITY = "SetpointVelocity"
+CURRENT_ACCELERATION = "CurrentAcceleration"
+SETPOINT_ACCELERATION = "SetpointAcceleration"
+
+# files written by GatheringStopAndSave and GatheringExternalStopAndSave
+GATHERING_FILE = "Gathering.dat"
+EXTERNAL_GATHERING_FILE = "ExternalGathering.dat"
+# position latched by a pulse on the controller's trigger input
+EXTERNAL_LATCH_POSITION = "ExternalLatchPosition"
+
+
+def parse_gathering_lines(text: str, n_columns: int):
+    """';' separated values, one sample per line -> (n_samples, n_columns) array
+
+    the whole block is parsed in one call into numpy rather than line by line
+    """
+    check_numpy()
+    values = np.fromstring(text.replace(';', ' '), sep=' ')
+    return values.reshape(-1, n_columns)
+
+
+def parse_gathering_file(text: str):
+    """text of Gathering.dat -> (column names, (n_samples, n_columns) array)
+
+    the controller writes a header before the samples, every line up to the
+    first one starting with a number is treated as header
+    """
+    check_numpy()
+    header = []
+    body_start = 0
+    for line in io.StringIO(text):
+        stripped = line.strip()
+        if stripped and (stripped[0].isdigit() or stripped[0] in "+-."):
+            n_columns = len(stripped.split())
+            break
+        header.append(stripped)
+        body_start += len(line)
+    else:
+        return [], np.empty((0, 0))
+
+    values = np.fromstring(text[body_start:], sep=' ')
+    # column names come from the last header line with one entry per column
+    names = [f"column{i}" for i in range(n_columns)]
+    for line in reversed(header):
+        if len(line.split()) == n_columns:
+            names = line.split()
+            break
+    return names, values.reshape(-1, n_columns)
+
+
+class Gathering:
+    """the controller's internal data acquisition
+
+    quantities are configured per motion group, samples are pulled back in
+    large blocks while the run is going and written straight into one
+    preallocated array
+    """
+    # lines per GatheringDataMultipleLinesGet, halved when the reply is too big for the controller
+    chunk_lines = 1000
+
+    def __init__(self) -> None:
+        self.quantities = []
+        self.data = None
+        self.n_samples = 0
+        self.n_read = 0
+
+    def add(self, group: motion_group.XpsMotionGroup, *quantities: str) -> None:
+        """gather quantities for every positioner of group"""
+        for pos in group.positioners:
+            for quantity in quantities or (CURRENT_POSITION,):
+                self.quantities.append(f"{pos.name}.{quantity}")
+
+    def columns(self) -> dict:
+        """quantity name -> view onto the samples read so far"""
+        return {name: self.data[:self.n_read, i] for i, name in enumerate(self.quantities)}
+
+    # GatheringConfigurationSet :  Configuration acquisition
+    async def configure(self, pool: connection_pool.ConnectionPool):
+        if not self.quantities:
+            raise ValueError("no quantities to gather")
+        return await pool.send_recv(f"GatheringConfigurationSet({','.join(self.quantities)})")
+
+    # GatheringRun :  Start a new gathering
+    async def run(self, pool: connection_pool.ConnectionPool, n_samples: int, divisor: int = 1):
+        check_numpy()
+        self.data = np.empty((n_samples, len(self.quantities)))
+        self.n_samples = n_samples
+        self.n_read = 0
+        return await pool.send_recv(f"GatheringRun({n_samples},{divisor})")
+
+    # GatheringStop :  Stop the data gathering (without saving to file)
+    async def stop(self, pool: connection_pool.ConnectionPool):
+        return await pool.send_recv("GatheringStop()")
+
+    # GatheringStopAndSave :  Stop acquisition and save data
+    async def stop_and_save(self, pool: connection_pool.ConnectionPool):
+        return await pool.send_recv("GatheringStopAndSave()")
+
+    # GatheringCurrentNumberGet :  Maximum number of samples and current number during acquisition
+    async def current_number(self, pool: connection_pool.ConnectionPool) -> tuple:
+        current, maximum = await pool.send_recv("GatheringCurrentNumberGet(int *,int *)")
+        return int(current), int(maximum)
+
+    async def fetch_available(self, pool: connection_pool.ConnectionPool) -> int:
+        """read every sample gathered since the last call, returns the number read"""
+        current, _ = await self.current_number(pool)
+        available = min(current, self.n_samples)
+        start = self.n_read
+        while self.n_read < available:
+            await self._fetch_block(pool, min(self.chunk_lines, available - self.n_read))
+        return self.n_read - start
+
+    async def stream(self, pool: connection_pool.ConnectionPool, poll_interval: float = 0.1):
+        """pull samples while the run is going, returns the array once all have been read"""
+        while self.n_read < self.n_samples:
+            await self.fetch_available(pool)
+            if self.n_read < self.n_samples:
+                await anyio.sleep(poll_interval)
+        return self.data
+
+    # GatheringDataMultipleLinesGet :  Get multiple data lines from gathering buffer
+    async def _fetch_block(self, pool: connection_pool.ConnectionPool, n_lines: int) -> None:
+        try:
+            # the lines as one undivided text, parsed in a single call below
+            reply = await pool.send_recv_raw(
+                f"GatheringDataMultipleLinesGet({self.n_read},{n_lines},char *)")
+        except trio_socket.MyException as err:
+            if err.code != status_codes.ERR_STRING_TOO_LONG or n_lines == 1:
+                raise
+            # reply would not fit the controller's buffer: ask for less next time
+            self.chunk_lines = max(1, n_lines // 2)
+            return
+        block = parse_gathering_lines(reply, len(self.quantities))
+        if not len(block):
+            raise trio_socket.MyException(f"no gathering data at sample {self.n_read}")
+        self.data[self.n_read:self.n_read + len(block)] = block
+        self.n_read += len(block)
@@ -0,0 +1,162 @@
+import bisect
+import math
+from . import framing
+
+# upper bounds in seconds of the latency histogram buckets, the last one catches everything
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+                   0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, math.inf)
+
+
+class CommandStats:
+    """counters for one command name, all allocated when the name is first seen"""
+
+    def __init__(self) -> None:
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # controller error code -> count, 0 is not recorded
+        self.errors = {}
+
+    def quantile(self, q: float) -> float:
+        """estimate from the histogram: the upper bound of the bucket holding quantile q"""
+        if self.count == 0:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS, self.bucket_counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max_seconds)
+        return self.max_seconds
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_seconds": self.total_seconds,
+            "max_seconds": self.max_seconds,
+            "p50_seconds": self.quantile(0.5),
+            "p99_seconds": self.quantile(0.99),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "buckets": list(zip(LATENCY_BUCKETS, self.bucket_counts)),
+            "errors": dict(self.errors),
+        }
+
+
+class Instrumentation:
+    """latency, traffic and error counters for the commands sent to one controller
+
+    meant to be left switched on: recording a reply only bumps preallocated
+    counters. share one instance between all the connections to a controller.
+    trace, if set, is called as trace(command, seconds, error_code) after
+    every reply
+    """
+
+    def __init__(self, host: str = "", trace=None) -> None:
+        self.host = host
+        self.trace = trace
+        self.commands = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.timeouts = 0
+        self.reconnects = 0
+
+    def begin(self, n_commands: int = 1) -> None:
+        """n_commands were written and are waiting for their replies"""
+        self.in_flight += n_commands
+        if self.in_flight > self.max_in_flight:
+            self.max_in_flight = self.in_flight
+
+    def record(self, command: str, seconds: float, bytes_sent: int,
+               bytes_received: int, error_code: int) -> None:
+        """one reply arrived, seconds after its command was submitted"""
+        self.in_flight -= 1
+        name = framing.command_name(command)
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = self.commands[name] = CommandStats()
+        stats.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        stats.count += 1
+        stats.total_seconds += seconds
+        if seconds > stats.max_seconds:
+            stats.max_seconds = seconds
+        stats.bytes_sent += bytes_sent
+        stats.bytes_received += bytes_received
+        if error_code != 0:
+            stats.errors[error_code] = stats.errors.get(error_code, 0) + 1
+        if self.trace is not None:
+            self.trace(command, seconds, error_code)
+
+    def abandon(self, n_commands: int) -> None:
+        """n_commands will never get a reply, e.g. the connection broke"""
+        self.in_flight -= n_commands
+
+    def record_timeout(self) -> None:
+        self.timeouts += 1
+
+    def record_reconnect(self) -> None:
+        self.reconnects += 1
+
+    def reset(self) -> None:
+        self.commands = {}
+        self.max_in_flight = self.in_flight
+        self.timeouts = 0
+        self.reconnects = 0
+
+    def slowest(self, n: int = 5) -> list:
+        """[(command name, mean seconds)] for the n commands slowest on average"""
+        means = [(name, stats.total_seconds / stats.count)
+                 for name, stats in self.commands.items() if stats.count]
+        return sorted(means, key=lambda item: item[1], reverse=True)[:n]
+
+    def snapshot(self) -> dict:
+        return {
+            "host": self.host,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "timeouts": self.timeouts,
+            "reconnects": self.reconnects,
+            "commands": {name: stats.to_dict() for name, stats in self.commands.items()},
+        }
+
+    def prometheus_text(self, prefix: str = "xps") -> str:
+        """the counters in the Prometheus text exposition format"""
+        host = f'host="{self.host}"'
+        lines = [
+            f"# TYPE {prefix}_command_duration_seconds histogram",
+        ]
+        for name, stats in sorted(self.commands.items()):
+            labels = f'{host},command="{name}"'
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS, stats.bucket_counts):
+                cumulative += n
+                le = "+Inf" if math.isinf(bound) else repr(bound)
+                lines.append(f'{prefix}_command_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{prefix}_command_duration_seconds_sum{{{labels}}} {stats.total_seconds!r}")
+            lines.append(f"{prefix}_command_duration_seconds_count{{{labels}}} {stats.count}")
+
+        for metric in ("bytes_sent", "bytes_received"):
+            lines.append(f"# TYPE {prefix}_command_{metric}_total counter")
+            for name, stats in sorted(self.commands.items()):
+                lines.append(f'{prefix}_command_{metric}_total{{{host},command="{name}"}} '
+                             f'{getattr(stats, metric)}')
+
+        lines.append(f"# TYPE {prefix}_command_errors_total counter")
+        for name, stats in sorted(self.commands.items()):
+            for code, n in sorted(stats.errors.items()):
+                lines.append(f'{prefix}_command_errors_total{{{host},command="{name}",code="{code}"}} {n}')
+
+        lines += [
+            f"# TYPE {prefix}_in_flight gauge",
+            f"{prefix}_in_flight{{{host}}} {self.in_flight}",
+            f"# TYPE {prefix}_in_flight_max gauge",
+            f"{prefix}_in_flight_max{{{host}}} {self.max_in_flight}",
+            f"# TYPE {prefix}_timeouts_total counter",
+            f"{prefix}_timeouts_total{{{host}}} {self.timeouts}",
+            f"# TYPE {prefix}_reconnects_total counter",
+            f"{prefix}_reconnects_total{{{host}}} {self.reconnects}",
+        ]
+        return "\n".join(lines) + "\n"
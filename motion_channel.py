@@ -0,0 +1,88 @@
+import anyio
+from contextlib import AsyncExitStack
+from . import instrumentation as instr
+from . import trio_socket
+from . import wire_recorder
+
+
+class MoveHandle:
+    """a motion command running on its own connection; await wait() for the controller's reply"""
+
+    def __init__(self, group_name: str, command: str) -> None:
+        self.group_name = group_name
+        self.command = command
+        self.result = None
+        self.error = None
+        self._finished = anyio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self._finished.is_set()
+
+    async def wait(self):
+        await self._finished.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class MotionChannels:
+    """dedicated connections for commands the controller only answers once motion ends
+    (GroupMoveAbsolute, GroupMoveRelative, GroupHomeSearch ...)
+
+    each group gets its own connection, opened on first use, so a move never
+    holds up the pool used for status reads, and several groups can move at once
+    """
+
+    def __init__(self, host: str, port: int = 5001, instrumentation: instr.Instrumentation = None,
+                 recorder: wire_recorder.WireRecorder = None) -> None:
+        self.host = host
+        self.port_number = port
+        # optional, usually the ones shared with the controller's pool
+        self.instrumentation = instrumentation
+        self.recorder = recorder
+        self._channels = {}
+        self._open_lock = anyio.Lock()
+        self._exit_stack = None
+        self._nursery = None
+
+    async def __aenter__(self):
+        async with AsyncExitStack() as stack:
+            # unwound in reverse: wait for running moves, then close the channels
+            stack.push_async_callback(self._close_channels)
+            self._nursery = await stack.enter_async_context(anyio.create_task_group())
+            self._exit_stack = stack.pop_all()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._exit_stack.__aexit__(exc_type, exc_val, exc_tb)
+        self._exit_stack = None
+        self._nursery = None
+
+    def start(self, group_name: str, command: str) -> MoveHandle:
+        handle = MoveHandle(group_name, command)
+        self._nursery.start_soon(self._run, handle)
+        return handle
+
+    async def _run(self, handle: MoveHandle) -> None:
+        try:
+            sock = await self._channel_for(handle.group_name)
+            handle.result = await sock.send_recv(handle.command)
+        except Exception as err:
+            handle.error = err
+        finally:
+            handle._finished.set()
+
+    async def _channel_for(self, group_name: str) -> trio_socket.AsyncSocket:
+        async with self._open_lock:
+            if group_name not in self._channels:
+                # a move is answered when it ends, however long that takes
+                sock = trio_socket.AsyncSocket(self.host, self.port_number, self.instrumentation, timeout=None,
+                                              recorder=self.recorder)
+                self._channels[group_name] = await sock.__aenter__()
+        return self._channels[group_name]
+
+    async def _close_channels(self) -> None:
+        channels, self._channels = self._channels, {}
+        for sock in channels.values():
+            await sock.__aexit__(None, None, None)
@@ -1,5 +1,19 @@
-from . import trio_socket
-import trio
+import numbers
+from . import connection_pool
+from . import motion_channel
+from . import status_codes
+from . import status_data
+from . import xps_api
+from .numpy_support import HAS_NUMPY, np
+
+
+def _as_array(reply):
+    """float replies, or the undivided values text of one reply -> array (tuple of floats without numpy)"""
+    if isinstance(reply, str):
+        return xps_api.function("GroupPositionCurrentGet").decode(reply)
+    if HAS_NUMPY:
+        return np.array(reply, dtype=float)
+    return tuple(float(val) for val in reply)
 
 
 # hardware level: called by group
@@ -15,123 +29,213 @@ class XpsPositioner:
         self.stage_type = stage_type
         self.plug_number = plug_number
 
-    async def find_hardware_limits(self, sock: trio_socket.AsyncSocket) -> None:
-        await self._find_max_vel_and_accel(sock)
-        await self._find_travel_lims(sock)
-
-    async def hardware_status_get(self, sock: trio_socket.AsyncSocket) -> str:
-        # PositionerHardwareStatusGet :  Read positioner hardware status
-        hardware_status_code = await sock.send_recv(f"PositionerHardwareStatusGet({self.name},int *)")
-        # PositionerHardwareStatusStringGet :  Return the positioner hardware status string corresponding to the positioner error code
-        return await sock.send_recv(f"PositionerHardwareStatusStringGet({hardware_status_code}, char *)")
-
-    async def get_positioner_errors(self, sock: trio_socket.AsyncSocket) -> str:
-        # PositionerErrorGet :  Read and clear positioner error code
-        hardware_status_code =  await sock.send_recv(f"PositionerErrorGet({self.name},int *)")
-        # PositionerErrorStringGet :  Return the positioner status string corresponding to the positioner error code
-        return await sock.send_recv(f"PositionerErrorStringGet({hardware_status_code}, char *)")
+    # errors propagate to the caller, discovery collects them per group
+    async def find_hardware_limits(self, pool: connection_pool.ConnectionPool) -> None:
+        # both queries are pipelined down one connection: a single round trip
+        vel_and_accel, travel_lims = await pool.send_recv_many([
+            self._max_vel_and_accel_cmd(), self._travel_lims_cmd()])
+        self.max_velocity, self.max_accel = (float(val) for val in vel_and_accel)
+        self.min_position, self.max_position = (float(val) for val in travel_lims)
+
+    # text lookups go through the code -> string cache: one round trip once it is warm
+    async def hardware_status_get(self, pool: connection_pool.ConnectionPool,
+                                  strings: status_codes.StatusStringCache = None) -> str:
+        hardware_status_code = await self.hardware_status_code_get(pool)
+        if strings is None:
+            strings = status_codes.cache_for()
+        return await strings.hardware_status_string(pool, hardware_status_code)
+
+    async def get_positioner_errors(self, pool: connection_pool.ConnectionPool,
+                                    strings: status_codes.StatusStringCache = None) -> str:
+        positioner_error_code = await self.positioner_error_code_get(pool)
+        if strings is None:
+            strings = status_codes.cache_for()
+        return await strings.positioner_error_string(pool, positioner_error_code)
+
+    # PositionerHardwareStatusGet :  Read positioner hardware status
+    async def hardware_status_code_get(self, pool: connection_pool.ConnectionPool) -> int:
+        return int(await pool.send_recv(f"PositionerHardwareStatusGet({self.name},int *)"))
+
+    # PositionerErrorGet :  Read and clear positioner error code
+    async def positioner_error_code_get(self, pool: connection_pool.ConnectionPool) -> int:
+        return int(await pool.send_recv(f"PositionerErrorGet({self.name},int *)"))
+
+    async def hardware_status_flags(self, pool: connection_pool.ConnectionPool) -> list:
+        return status_codes.decode_hardware_status(await self.hardware_status_code_get(pool))
+
+    # note that reading the error code clears it on the controller
+    async def positioner_error_flags(self, pool: connection_pool.ConnectionPool) -> list:
+        return status_codes.decode_positioner_error(await self.positioner_error_code_get(pool))
 
 ##################
 
-    async def _find_travel_lims(self, sock: trio_socket.AsyncSocket) -> None:
-        try:
-            (self.min_position, self.max_position) = await self._get_travel_lims(sock)
-        except:
-            print(f"could not set travel lims for {self.name}")
-
-    # PositionerTravelLimitsGet :  Return maximum and minimum possible displacements of the positioner
-    async def _get_travel_lims(self, sock: trio_socket.AsyncSocket) -> tuple:
-        lo_lim, hi_lim = await sock.send_recv(
-            f"PositionerUserTravelLimitsGet({self.name},double *,double *)")
-        return float(lo_lim), float(hi_lim)
-
-    async def _find_max_vel_and_accel(self, sock: trio_socket.AsyncSocket) -> None:
-        try:
-            self.max_velocity, self.max_accel = await self._get_positioner_max_vel_and_accel(sock)
-        except:
-            print("could not set max velo/accel for {self.name}")
+    # PositionerUserTravelLimitsGet :  Return maximum and minimum possible displacements of the positioner
+    def _travel_lims_cmd(self) -> str:
+        return f"PositionerUserTravelLimitsGet({self.name},double *,double *)"
 
     # PositionerMaximumVelocityAndAccelerationGet :  Return maximum velocity and acceleration of the positioner
-    async def _get_positioner_max_vel_and_accel(self, sock: trio_socket.AsyncSocket) -> tuple:
-        try:
-            max_velocity, max_accel = await sock.send_recv(
-                f"PositionerMaximumVelocityAndAccelerationGet({self.name},double *,double *)")
-            return float(max_velocity), float(max_accel)
-        except:
-            print("could not set max velo/accel for {self.name}")
+    def _max_vel_and_accel_cmd(self) -> str:
+        return f"PositionerMaximumVelocityAndAccelerationGet({self.name},double *,double *)"
 
 
 # callable by xps
 class XpsMotionGroup():
-    positioner: XpsPositioner = None
     type = "SingleAxes"
 
-    def __init__(self, name: str) -> None:
+    def __init__(self, name: str, group_type: str = None) -> None:
         self.name = name
+        if group_type is not None:
+            self.type = group_type
+        # in the order of PositionerInUse: the order of every vector command
+        self.positioners = []
 
-    async def add_positioner(self, name, stage_type: str,
-                             plug_number: str, sock: trio_socket.AsyncSocket):
-        self.positioner = XpsPositioner(name, stage_type, plug_number)
-        await self.positioner.find_hardware_limits(sock)
+    @property
+    def positioner(self) -> XpsPositioner:
+        """the only positioner of a SingleAxis or Spindle group (the first of any other)"""
+        return self.positioners[0] if self.positioners else None
 
-    async def get_full_status(self, sock: trio_socket.AsyncSocket) -> str:
-        out = []
-        group_status = await self.get_status(sock)
-        hardware_status = await self.get_positioner_status(sock)
-        positioner_errors = await self.get_positioner_errors(sock)
+    @positioner.setter
+    def positioner(self, positioner: XpsPositioner) -> None:
+        self.positioners = [positioner]
 
-        out.append(f"{self.name} ({self.type}), Status: {group_status}")
-        out.append(f"   {self.positioner.name} {self.positioner.stage_type}")
-        out.append(f"      Hardware Status: {hardware_status}")
-        out.append(f"      Positioner Errors: {positioner_errors}")
-        return "\n".join(out)
-
-    async def get_positioner_status(self, sock: trio_socket.AsyncSocket):
-        return await self.positioner.hardware_status_get(sock)
+    async def add_positioner(self, name, stage_type: str,
+                             plug_number: str, pool: connection_pool.ConnectionPool):
+        positioner = XpsPositioner(name, stage_type, plug_number)
+        self.positioners.append(positioner)
+        await positioner.find_hardware_limits(pool)
+
+    async def get_full_status(self, pool: connection_pool.ConnectionPool,
+                              strings: status_codes.StatusStringCache = None) -> str:
+        group_status = await self.collect_status(pool, strings)
+        return group_status.to_text()
+
+    # GroupStatusGet, PositionerHardwareStatusGet and PositionerErrorRead pipelined: one round trip
+    async def collect_status(self, pool: connection_pool.ConnectionPool,
+                             strings: status_codes.StatusStringCache = None) -> status_data.GroupStatus:
+        replies = await pool.send_recv_many(self.status_commands())
+        return await self.parse_status(pool, replies, strings)
+
+    # PositionerErrorRead leaves the error code set, unlike PositionerErrorGet: polling
+    # status does not hide errors from positioner_error_code_get, and the batch is safe to re-send
+    def status_commands(self) -> list:
+        commands = [f"GroupStatusGet({self.name},int *)"]
+        for pos in self.positioners:
+            commands += [f"PositionerHardwareStatusGet({pos.name},int *)",
+                         f"PositionerErrorRead({pos.name},int *)"]
+        return commands
+
+    async def parse_status(self, pool: connection_pool.ConnectionPool, replies: list,
+                           strings: status_codes.StatusStringCache = None) -> status_data.GroupStatus:
+        """replies to status_commands -> GroupStatus, texts only cost a round trip if not cached"""
+        if strings is None:
+            strings = status_codes.cache_for()
+        status_code, *codes = (int(reply) for reply in replies)
+        positioner_statuses = []
+        for pos, hardware_status_code, positioner_error_code in zip(self.positioners, codes[::2], codes[1::2]):
+            positioner_statuses.append(status_data.PositionerStatus(
+                pos.name, pos.stage_type,
+                hardware_status_code, await strings.hardware_status_string(pool, hardware_status_code),
+                positioner_error_code, await strings.positioner_error_string(pool, positioner_error_code)))
+        return status_data.GroupStatus(self.name, self.type, status_code, positioner_statuses)
+
+    async def get_positioner_status(self, pool: connection_pool.ConnectionPool,
+                                    strings: status_codes.StatusStringCache = None):
+        return await self.positioner.hardware_status_get(pool, strings)
 
     # GroupStatusGet :  Return group status
-    async def get_status(self, sock: trio_socket.AsyncSocket):
-        return int(await sock.send_recv(f"GroupStatusGet({self.name},int *)"))
+    async def get_status(self, pool: connection_pool.ConnectionPool):
+        return int(await pool.send_recv_raw(f"GroupStatusGet({self.name},int *)"))
         # todo: some error handling based off looking for "ready" in "GroupStatusListGet(char *)"
 
-    async def get_positioner_errors(self, sock: trio_socket.AsyncSocket):
-        return await self.positioner.get_positioner_errors(sock)
+    async def get_status_string(self, pool: connection_pool.ConnectionPool,
+                                strings: status_codes.StatusStringCache = None) -> str:
+        if strings is None:
+            strings = status_codes.cache_for()
+        return await strings.group_status_string(pool, await self.get_status(pool))
+
+    async def get_positioner_errors(self, pool: connection_pool.ConnectionPool,
+                                    strings: status_codes.StatusStringCache = None):
+        return await self.positioner.get_positioner_errors(pool, strings)
 
     # GroupPositionCurrentGet :  Return current positions
-    async def get_current_position(self, sock: trio_socket.AsyncSocket) -> float:
-        position = await sock.send_recv(f"GroupPositionCurrentGet({self.name},double *)")
-        return float(position)
+    async def get_current_position(self, pool: connection_pool.ConnectionPool):
+        """a float for single positioner groups, otherwise an array with one entry per positioner"""
+        return self.parse_vector(await pool.send_recv_raw(self.vector_command("GroupPositionCurrentGet")))
 
     # GroupPositionTargetGet :  Return target positions
-    async def get_target_position(self, sock: trio_socket.AsyncSocket):
-        position = await sock.send_recv(f"GroupPositionTargetGet({self.name},double *)")
-        return float(position)
+    async def get_target_position(self, pool: connection_pool.ConnectionPool):
+        return self.parse_vector(await pool.send_recv_raw(self.vector_command("GroupPositionTargetGet")))
 
     # GroupVelocityCurrentGet :  Return current velocities
-    async def get_current_velocity(self, sock: trio_socket.AsyncSocket):
-        velocity = await sock.send_recv(f"GroupVelocityCurrentGet({self.name},double *)")
-        return float(velocity)
+    async def get_current_velocity(self, pool: connection_pool.ConnectionPool):
+        return self.parse_vector(await pool.send_recv_raw(self.vector_command("GroupVelocityCurrentGet")))
+
+    # all positions in one round trip, always as an array
+    async def get_current_positions(self, pool: connection_pool.ConnectionPool):
+        return _as_array(await pool.send_recv_raw(self.vector_command("GroupPositionCurrentGet")))
 
     # GroupMoveAbsolute :  Do an absolute move
-    async def move_to(self, sock: trio_socket.AsyncSocket, target_position):
+    async def move_to(self, pool: connection_pool.ConnectionPool, target_position):
         #todo check target position: lock the stage
         self.check_position_within_limits(target_position)
-        ret_str = await sock.send_recv(f"GroupMoveAbsolute({self.name},{target_position})")
+        # answered when the move ends: no deadline, however long it takes
+        ret_str = await pool.send_recv(self.move_command("GroupMoveAbsolute", target_position), timeout=None)
         return ret_str
 
     # GroupMoveRelative :  Do a relative move
-    async def move_by(self, sock: trio_socket.AsyncSocket, relative_movement):
-        ret_str = await sock.send_recv(f"GroupMoveRelative({self.name},{relative_movement})")
+    async def move_by(self, pool: connection_pool.ConnectionPool, relative_movement):
+        ret_str = await pool.send_recv(self.move_command("GroupMoveRelative", relative_movement),
+                                       timeout=None)
         return ret_str
 
-    def check_position_within_limits(self, position:float):
-        assert (position < self.positioner.max_position), "target position beyond max"
-        assert(position > self.positioner.min_position), "target position beyond min"
+    # GroupMoveAbsolute on the group's motion channel: returns without waiting for the move
+    def start_move_to(self, motion: motion_channel.MotionChannels,
+                      target_position) -> motion_channel.MoveHandle:
+        self.check_position_within_limits(target_position)
+        return motion.start(self.name, self.move_command("GroupMoveAbsolute", target_position))
+
+    # GroupMoveRelative on the group's motion channel: returns without waiting for the move
+    def start_move_by(self, motion: motion_channel.MotionChannels,
+                      relative_movement) -> motion_channel.MoveHandle:
+        return motion.start(self.name, self.move_command("GroupMoveRelative", relative_movement))
+
+    def check_position_within_limits(self, position):
+        """ValueError for a target outside the travel limits, see motion_planner for arrays of targets"""
+        for pos, target in zip(self.positioners, self._per_positioner(position)):
+            if pos.max_position is not None and target > pos.max_position:
+                raise ValueError(f"{pos.name}: target position {target:g} beyond max {pos.max_position:g}")
+            if pos.min_position is not None and target < pos.min_position:
+                raise ValueError(f"{pos.name}: target position {target:g} beyond min {pos.min_position:g}")
+
+    def vector_command(self, function: str) -> str:
+        """e.g. GroupPositionCurrentGet(XY,double *,double *): one output per positioner"""
+        return xps_api.function(function).command(self.name, n_values=max(1, len(self.positioners)))
+
+    def move_command(self, function: str, values) -> str:
+        """e.g. GroupMoveAbsolute(XY,1.0,2.0): one target per positioner"""
+        return f"{function}({self.name},{','.join(str(val) for val in self._per_positioner(values))})"
+
+    def parse_vector(self, reply):
+        if len(self.positioners) <= 1:
+            return float(reply)
+        return _as_array(reply)
+
+    def _per_positioner(self, values) -> list:
+        if isinstance(values, (numbers.Number, str)):
+            values = [values]
+        values = [float(val) for val in values]
+        if len(values) != max(1, len(self.positioners)):
+            raise ValueError(f"{self.name} needs {len(self.positioners)} values, got {len(values)}")
+        return values
 
     # GroupInitialize :  Start the initialization
-    async def initialise(self, sock: trio_socket.AsyncSocket):
-        return await sock.send_recv(f"GroupInitialize({self.name})")
+    async def initialise(self, pool: connection_pool.ConnectionPool):
+        return await pool.send_recv(f"GroupInitialize({self.name})")
 
     # GroupHomeSearch :  Start home search sequence
-    async def search_for_home(self, sock: trio_socket.AsyncSocket):
-        return await sock.send_recv(f"GroupHomeSearch({self.name})")
+    async def search_for_home(self, pool: connection_pool.ConnectionPool):
+        return await pool.send_recv(f"GroupHomeSearch({self.name})", timeout=None)
+
+    # GroupHomeSearch on the group's motion channel: returns without waiting for the search
+    def start_search_for_home(self, motion: motion_channel.MotionChannels) -> motion_channel.MoveHandle:
+        return motion.start(self.name, f"GroupHomeSearch({self.name})")
@@ -0,0 +1,115 @@
+import anyio
+from . import connection_pool
+from . import motion_group
+from .numpy_support import check_numpy, np
+
+# GroupStatusGet codes of a group still in motion:
+# homing, moving, trajectory, jogging, spinning
+MOVING_STATES = (43, 44, 45, 47, 51)
+
+
+class MotionPlanner:
+    """limit checks and move durations for one group, on whole arrays of moves at once
+
+    targets are one value per move for single positioner groups, otherwise
+    one row per move and one column per positioner. durations follow the
+    trapezoidal profile of each positioner (constant acceleration up to the
+    move velocity), plus the jerk time for the S-gamma profile the controller
+    actually runs. a group move ends when its slowest positioner arrives
+    """
+
+    def __init__(self, group: motion_group.XpsMotionGroup, velocity=None, accel=None,
+                 jerk_time=0.0) -> None:
+        """velocity, accel: move parameters, default each positioner's maximum
+        jerk_time: seconds added to every move by the S-gamma jerk phases"""
+        check_numpy()
+        self.group = group
+        positioners = group.positioners
+        self.names = [pos.name for pos in positioners]
+        self.max_velocity = np.array([pos.max_velocity for pos in positioners], dtype=float)
+        self.max_accel = np.array([pos.max_accel for pos in positioners], dtype=float)
+        self.min_position = np.array([pos.min_position for pos in positioners], dtype=float)
+        self.max_position = np.array([pos.max_position for pos in positioners], dtype=float)
+
+        self.velocity = self._per_positioner(self.max_velocity if velocity is None else velocity)
+        self.accel = self._per_positioner(self.max_accel if accel is None else accel)
+        self.jerk_time = self._per_positioner(jerk_time)
+        if np.any(self.velocity <= 0) or np.any(self.velocity > self.max_velocity):
+            raise ValueError(f"move velocity {self.velocity} outside (0, {self.max_velocity}]")
+        if np.any(self.accel <= 0) or np.any(self.accel > self.max_accel):
+            raise ValueError(f"move acceleration {self.accel} outside (0, {self.max_accel}]")
+
+    # PositionerSGammaParametersGet :  Read dynamic parameters for one axe of a group for a future displacement
+    @classmethod
+    async def from_controller(cls, group: motion_group.XpsMotionGroup,
+                              pool: connection_pool.ConnectionPool) -> "MotionPlanner":
+        """a planner with the velocity, acceleration and jerk times the controller will move with"""
+        replies = await pool.send_recv_many(
+            [f"PositionerSGammaParametersGet({pos.name},double *,double *,double *,double *)"
+             for pos in group.positioners])
+        velocity, accel, min_jerk, max_jerk = np.array(replies, dtype=float).reshape(-1, 4).T
+        # the controller picks a jerk time between the two, depending on the move
+        return cls(group, velocity, accel, (min_jerk + max_jerk) / 2)
+
+    def as_targets(self, targets):
+        """targets -> array of shape (n_moves, n_positioners)"""
+        targets = np.asarray(targets, dtype=float)
+        n_positioners = len(self.names)
+        if n_positioners == 1:
+            return targets.reshape(-1, 1)
+        if targets.ndim == 1:
+            targets = targets.reshape(1, -1)
+        if targets.ndim != 2 or targets.shape[1] != n_positioners:
+            raise ValueError(f"{self.group.name} needs {n_positioners} values per move, "
+                             f"got shape {targets.shape}")
+        return targets
+
+    def check_limits(self, targets) -> list:
+        """every target outside its positioner's travel limits, one line per positioner and side"""
+        targets = self.as_targets(targets)
+        problems = []
+        for side, outside, limit in (("below", targets < self.min_position, self.min_position),
+                                     ("above", targets > self.max_position, self.max_position)):
+            for i in np.flatnonzero(outside.any(axis=0)):
+                moves = np.flatnonzero(outside[:, i])
+                problems.append(f"{self.names[i]}: {len(moves)} targets {side} {limit[i]:g}, "
+                                f"first {targets[moves[0], i]:g} at move {moves[0]}")
+        return problems
+
+    def verify_limits(self, targets) -> None:
+        problems = self.check_limits(targets)
+        if problems:
+            raise ValueError("targets outside limits: " + "; ".join(problems))
+
+    def axis_times(self, start, targets):
+        """seconds each positioner takes for each move of the sequence start -> targets[0] -> targets[1] ...
+        shape (n_moves, n_positioners)"""
+        targets = self.as_targets(targets)
+        start = self.as_targets(start)[:1]
+        distance = np.abs(np.diff(np.concatenate([start, targets]), axis=0))
+        v, a = self.velocity, self.accel
+        # full velocity is reached once the two ramps, v^2/a together, fit in the distance
+        times = np.where(distance >= v * v / a, distance / v + v / a, 2 * np.sqrt(distance / a))
+        return np.where(distance > 0, times + self.jerk_time, 0.0)
+
+    def move_times(self, start, targets):
+        """seconds the group takes for each move of the sequence, shape (n_moves,)"""
+        return self.axis_times(start, targets).max(axis=1)
+
+    def move_time(self, start, target) -> float:
+        return float(self.move_times(start, target)[0])
+
+    async def wait_for_move(self, pool: connection_pool.ConnectionPool, duration: float,
+                            poll_interval: float = 0.02) -> int:
+        """sleep through the predicted duration of a move, then poll GroupStatusGet
+        until the group has stopped; returns the final status"""
+        await anyio.sleep(duration)
+        while True:
+            status = int(await self.group.get_status(pool))
+            if status not in MOVING_STATES:
+                return status
+            await anyio.sleep(poll_interval)
+
+    def _per_positioner(self, values):
+        values = np.asarray(values, dtype=float)
+        return np.broadcast_to(values, (len(self.names),)).astype(float)
@@ -1,9 +1,33 @@
+from . import async_ftp
+from . import fly_scan
 from . import ftp_wrappers
+from . import gathering
+from . import instrumentation as instr
+import os
 import time
 from socket import getfqdn
+from . import motion_channel
 from . import motion_group
+from . import connection_pool
+from . import setpoint_stream
+from . import status_codes
+from . import status_data
+from . import telemetry
+from . import topology_cache
+from . import trajectory
 from . import trio_socket
-import trio
+from . import wire_recorder
+import anyio
+
+
+# GROUPS section of system.ini -> group type
+GROUP_TYPES = {
+    "SingleAxisInUse": "SingleAxes",
+    "SpindleInUse": "Spindle",
+    "XYInUse": "XY",
+    "XYZInUse": "XYZ",
+    "MultipleAxesInUse": "MultipleAxes",
+}
 
 
 # todo exceptions are not handled
@@ -19,33 +43,42 @@ class XPSException(Exception):
 
 class XpsFactory:
 
-    async def build(self, sock: trio_socket.AsyncSocket):
-        model, firmware_version = await self.determine_xps_model(sock)
+    def __init__(self, cache: topology_cache.TopologyCache = None, ftp_port: int = None):
+        # with a cache, reconnects skip ftp and hardware discovery when nothing changed
+        self.cache = cache
+        # None: the standard ftp/sftp port
+        self.ftp_port = ftp_port
 
-        host = sock.host
+    async def build(self, pool: connection_pool.ConnectionPool):
+        model, firmware_version = await self.determine_xps_model(pool)
+
+        host = pool.host
         if model == "C":
-            xps = NewportXpsC(host, firmware_version)
+            xps = NewportXpsC(host, firmware_version, ftp_port=self.ftp_port, port=pool.port_number,
+                              instrumentation=pool.instrumentation, recorder=pool.recorder)
         elif model == "D":
-            xps = NewportXpsD(host, firmware_version)
+            xps = NewportXpsD(host, firmware_version, ftp_port=self.ftp_port, port=pool.port_number,
+                              instrumentation=pool.instrumentation, recorder=pool.recorder)
         elif model == "Q":
-            xps = NewportXpsQ(host, firmware_version)
+            xps = NewportXpsQ(host, firmware_version, ftp_port=self.ftp_port, port=pool.port_number,
+                              instrumentation=pool.instrumentation, recorder=pool.recorder)
         else:
             raise
 
-        await xps.initialise_groups(sock)
+        await xps.initialise_groups(pool, self.cache)
 
         return xps
 
     @staticmethod
-    async def determine_xps_model(sock):
+    async def determine_xps_model(pool):
 
-        firmware_version = await NewportXps.firmware_version_get(sock)
+        firmware_version = await NewportXps.firmware_version_get(pool)
 
         if 'XPS-C' in firmware_version:
             model = "C"
         elif 'XPS-D' in firmware_version:
             model = "D"
-            val = await sock.send_recv('InstallerVersionGet(char *)')
+            val = await pool.send_recv('InstallerVersionGet(char *)')
             firmware_version = val
         elif 'XPS-Q' in firmware_version:
             model = "Q"
@@ -56,79 +89,241 @@ class XpsFactory:
 
 
 class NewportXps:
-    groups = []
     ftp = None
     ftp_home = None
+    telemetry_service = None
+    file_transfer = None
+    _fqdn = None
 
-    def __init__(self, host, firmware_version, username='Administrator', password='Administrator'):
+    def __init__(self, host, firmware_version, username='Administrator', password='Administrator',
+                 ftp_port=None, port=5001, instrumentation: instr.Instrumentation = None,
+                 recorder: wire_recorder.WireRecorder = None):
 
         self.host = host
+        # the command port, for the connections opened on the controller's behalf
+        self.port_number = port
+        # shared with the pool the controller was built on, for the streams' connections
+        self.instrumentation = instrumentation
+        self.recorder = recorder
         self.username = username
         self.password = password
+        self.ftp_port = ftp_port
         self.firmware_version = firmware_version
 
-    async def initialise_groups(self, sock: trio_socket.AsyncSocket):
-        self._setup_ftp_client()
+        # code -> text lookups are shared by every controller on this firmware
+        self.status_strings = status_codes.cache_for(firmware_version)
 
-        # todo : merge in the ftp functions
-        await self._setup_stage_and_group_info(sock)
+        self.groups = []
+        # positioner name -> exception raised while querying it
+        self.discovery_errors = {}
 
-    async def status_report(self, sock: trio_socket.AsyncSocket):
+    async def initialise_groups(self, pool: connection_pool.ConnectionPool,
+                                cache: topology_cache.TopologyCache = None):
+        self._setup_ftp_client()
+        self.file_transfer = async_ftp.AsyncFileTransfer(self._new_ftp_wrapper)
+
+        snapshot = None
+        if cache is not None:
+            snapshot = cache.load(self.host, self.firmware_version)
+            # warm start: no reboot means system.ini has not been re-read
+            if snapshot is not None and await self._restore_snapshot(pool, snapshot, same_boot=True):
+                return
+
+        # get the lines via ftp connection, off the event loop
+        ini_lines = await self.file_transfer.read_lines(os.path.join(self.ftp_home, 'Config'), 'system.ini')
+        ini_lines = [line.strip() for line in ini_lines]
+        fingerprint = topology_cache.ini_fingerprint(ini_lines)
+
+        if snapshot is None or snapshot.ini_fingerprint != fingerprint or \
+                not await self._restore_snapshot(pool, snapshot, same_boot=False):
+            await self._setup_stage_and_group_info(pool, self.ftp.parse_ftp_string(ini_lines))
+
+        if cache is not None and not self.discovery_errors:
+            boot_time, objects_list = await self._snapshot_check_values(pool)
+            cache.save(topology_cache.TopologySnapshot.from_groups(
+                self.host, self.firmware_version, fingerprint, boot_time, objects_list, self.groups))
+
+    async def status_report(self, pool: connection_pool.ConnectionPool):
         """return printable status report"""
+        report = await self.collect_status(pool)
+        return report.to_text()
 
-        out = await self._create_status_header(sock)
+    async def collect_status(self, pool: connection_pool.ConnectionPool) -> status_data.StatusReport:
+        """status of every group as a StatusReport
 
-        out.append("# Groups and Stages")
+        all status codes are read in one pipelined batch, texts come from the
+        status string cache and are only looked up (concurrently) when missing
+        """
+        commands = ['ElapsedTimeGet(double *)']
         for group in self.groups:
-            out.append(await group.get_full_status(sock))
+            commands += group.status_commands()
+        uptime, *replies = await pool.send_recv_many(commands)
+        boot_time = time.time() - float(uptime)
 
-        return "\n".join(out)
+        group_statuses = [None] * len(self.groups)
+
+        async def parse_group(index, group, group_replies):
+            group_statuses[index] = await group.parse_status(pool, group_replies, self.status_strings)
+
+        async with anyio.create_task_group() as nursery:
+            start = 0
+            for index, group in enumerate(self.groups):
+                n_replies = len(group.status_commands())
+                nursery.start_soon(parse_group, index, group, replies[start:start + n_replies])
+                start += n_replies
+
+        return status_data.StatusReport(self.host, await self._get_fqdn(), self.firmware_version,
+                                          boot_time, group_statuses)
+
+    # ErrorStringGet :  Return the error string corresponding to the error code
+    async def error_string(self, pool: connection_pool.ConnectionPool, code: int) -> str:
+        return await self.status_strings.error_string(pool, code)
+
+    def start_telemetry(self, nursery: anyio.abc.TaskGroup, pool: connection_pool.ConnectionPool,
+                        rate: float = 10.0) -> telemetry.TelemetryService:
+        """poll every group at rate (Hz) in one task, subscribe to the returned service"""
+        self.telemetry_service = telemetry.TelemetryService(self.groups, pool, rate)
+        nursery.start_soon(self.telemetry_service.run)
+        return self.telemetry_service
+
+    def create_gathering(self, quantities: dict = None) -> gathering.Gathering:
+        """quantities maps group name -> gathered quantities,
+        by default the current position of every group is gathered"""
+        gather = gathering.Gathering()
+        if quantities is None:
+            for group in self.groups:
+                gather.add(group)
+            return gather
+
+        for group_name, group_quantities in quantities.items():
+            gather.add(self.get_group(group_name), *group_quantities)
+        return gather
+
+    async def fly_scan(self, pool: connection_pool.ConnectionPool, motion: motion_channel.MotionChannels,
+                       group_name: str, start: float, stop: float, step: float, velocity: float) -> dict:
+        """trigger every step from start to stop during one move at velocity,
+        returns the trigger targets and the positions latched at each trigger"""
+        scan = fly_scan.FlyScan(self.get_group(group_name), start, stop, step, velocity)
+        return await scan.run(self, pool, motion)
+
+    def jog_stream(self, group_name: str, accel: float = None, port: int = None) -> setpoint_stream.JogStream:
+        """async context manager: velocity setpoints for the group in jog mode, newest value wins
+        port: default the command port the controller was built with"""
+        return setpoint_stream.JogStream(self.host, self.get_group(group_name), port or self.port_number,
+                                         accel, self.instrumentation, self.recorder)
+
+    def retarget_stream(self, group_name: str, port: int = None) -> setpoint_stream.RetargetStream:
+        """async context manager: absolute position setpoints for the group, newest value wins"""
+        return setpoint_stream.RetargetStream(self.host, self.get_group(group_name), port or self.port_number,
+                                              self.instrumentation, self.recorder)
+
+    def get_group(self, group_name: str) -> motion_group.XpsMotionGroup:
+        for group in self.groups:
+            if group.name == group_name:
+                return group
+        raise XPSException(f"unknown group '{group_name}'")
+
+    async def fetch_gathering_file(self, filename: str = gathering.GATHERING_FILE) -> tuple:
+        """as load_gathering_file, without blocking the event loop"""
+        text = await self.file_transfer.read_text(os.path.join(self.ftp_home, 'Public'), filename)
+        return gathering.parse_gathering_file(text)
+
+    async def store_trajectory(self, pvt: trajectory.PvtTrajectory, filename: str,
+                               check_limits: bool = True) -> None:
+        """as upload_trajectory, without blocking the event loop"""
+        if check_limits:
+            pvt.verify_limits()
+        await self.file_transfer.upload(pvt.to_bytes(), os.path.join(self.ftp_home, 'Public', 'Trajectories'),
+                                        filename)
+
+    async def aclose(self) -> None:
+        """close the ftp/sftp sessions kept open for file transfers"""
+        if self.file_transfer is not None:
+            await self.file_transfer.aclose()
+
+    def load_gathering_file(self, filename: str = gathering.GATHERING_FILE) -> tuple:
+        """column names and samples saved by the last GatheringStopAndSave
+        (or GatheringExternalStopAndSave with gathering.EXTERNAL_GATHERING_FILE)"""
+        return gathering.parse_gathering_file(self.ftp.get_gathering_text(self.ftp_home, filename))
+
+    def upload_trajectory(self, pvt: trajectory.PvtTrajectory, filename: str,
+                          check_limits: bool = True) -> None:
+        """write a PVT trajectory to Public/Trajectories, ready for MultipleAxesPVTVerification"""
+        if check_limits:
+            pvt.verify_limits()
+        self.ftp.put_trajectory(pvt.to_bytes(), filename, self.ftp_home)
 
 #########################################################
 
-    async def _create_status_header(self, sock: trio_socket.AsyncSocket):
+    # reverse dns can block for seconds: look it up once, off the event loop
+    async def _get_fqdn(self) -> str:
+        if self._fqdn is None:
+            self._fqdn = await anyio.to_thread.run_sync(getfqdn, self.host)
+        return self._fqdn
 
-        boot_time = await self._calculate_boot_time(sock)
-
-        out = ["# XPS host:         %s (%s)" % (self.host, getfqdn(self.host)),
-               "# Firmware:         %s" % self.firmware_version,
-               "# Current Time:     %s" % time.ctime(),
-               "# Last Reboot:      %s" % time.ctime(boot_time),
-               ]
-        return out
-
-    # ElapsedTimeGet :  Return elapsed time from controller power on
+    # ElapsedTimeGet and ObjectsListGet pipelined: one round trip
     @staticmethod
-    async def _calculate_boot_time(sock: trio_socket.AsyncSocket) -> float:
-        uptime = await sock.send_recv(f'ElapsedTimeGet(double *)')
+    async def _snapshot_check_values(pool: connection_pool.ConnectionPool) -> tuple:
+        uptime, objects_list = await pool.send_recv_many(
+            ['ElapsedTimeGet(double *)', 'ObjectsListGet(char *)'])
+        return time.time() - float(uptime), status_codes.reply_text(objects_list)
+
+    async def _restore_snapshot(self, pool: connection_pool.ConnectionPool,
+                                snapshot: topology_cache.TopologySnapshot, same_boot: bool) -> bool:
+        """check a snapshot against the controller in one pipelined round trip
+        and adopt its groups if it still matches
+
+        user travel limits can be changed without a reboot, so they are re-read
+        as part of the same batch
+        """
+        groups = snapshot.restore_groups()
+        positioners = [pos for group in groups for pos in group.positioners]
+        try:
+            uptime, objects_list, *travel_lims = await pool.send_recv_many(
+                ['ElapsedTimeGet(double *)', 'ObjectsListGet(char *)'] +
+                [pos._travel_lims_cmd() for pos in positioners])
+        except trio_socket.MyException:
+            # a positioner in the snapshot no longer exists
+            return False
+
         boot_time = time.time() - float(uptime)
-        return boot_time
+        if status_codes.reply_text(objects_list) != snapshot.objects_list:
+            return False
+        if same_boot and not snapshot.same_boot(boot_time):
+            return False
 
+        for pos, lims in zip(positioners, travel_lims):
+            pos.min_position, pos.max_position = (float(val) for val in lims)
+        self.groups = groups
+        self.discovery_errors = {}
+        return True
 
     def _setup_ftp_client(self):
         raise NotImplemented
 
+    def _new_ftp_wrapper(self) -> ftp_wrappers.FTPBaseWrapper:
+        return type(self.ftp)(**self._ftp_args())
+
     def _ftp_args(self):
-        return dict(host=self.host, username=self.username, password=self.password)
+        return dict(host=self.host, username=self.username, password=self.password, port=self.ftp_port)
 
-    async def _setup_stage_and_group_info(self, sock: trio_socket.AsyncSocket):
-        """read group info from system.ini
+    async def _setup_stage_and_group_info(self, pool: connection_pool.ConnectionPool,
+                                          config_dict: dict):
+        """read group info from the parsed system.ini
         this is part of the connection process
         """
-        # get the lines via ftp connection
-        config_dict = self.ftp.get_ini_info(self.ftp_home)
-
-        await trio.sleep(0)
+        await anyio.sleep(0)
         # get group names from groups section
+        groups = []
         for group_type, groups_of_type in config_dict["GROUPS"].items():
-            if "SingleAxis" not in group_type:
-                raise Exception("bad group type: only single axis supported")
-            else:
-                single_ax_groups = [g for g in groups_of_type.split(", ")]
-                for group_name in single_ax_groups:
-                    self.groups.append(motion_group.XpsMotionGroup(group_name))
-
-                    positioner_name = config_dict[group_name]["PositionerInUse"]
+            if not groups_of_type:
+                continue
+            if group_type not in GROUP_TYPES:
+                raise XPSException(f"bad group type: {group_type}")
+            for group_name in groups_of_type.split(", "):
+                group = motion_group.XpsMotionGroup(group_name, GROUP_TYPES[group_type])
+                # several positioners for XY, XYZ and MultipleAxes groups
+                for positioner_name in config_dict[group_name]["PositionerInUse"].split(", "):
                     pos_hardware_name = f"{group_name}.{positioner_name}"
                     pos_dict = config_dict[pos_hardware_name]
 
@@ -136,25 +331,39 @@ class NewportXps:
                     plug_number = pos_dict["PlugNumber"]
 
                     assert isinstance(plug_number, str)
-                    await self.groups[-1].add_positioner(pos_hardware_name,
-                                                                 stage_type,
-                                                                 plug_number,
-                                                                 sock)
+                    group.positioners.append(
+                        motion_group.XpsPositioner(pos_hardware_name, stage_type, plug_number))
+                groups.append(group)
+
+        # query every positioner at once, the pool spreads them over its connections
+        self.groups = groups
+        self.discovery_errors = {}
+        async with anyio.create_task_group() as nursery:
+            for group in groups:
+                for positioner in group.positioners:
+                    nursery.start_soon(self._discover_positioner, positioner, pool)
 
         return
 
+    async def _discover_positioner(self, positioner: motion_group.XpsPositioner,
+                                   pool: connection_pool.ConnectionPool):
+        try:
+            await positioner.find_hardware_limits(pool)
+        except Exception as err:
+            self.discovery_errors[positioner.name] = err
+
     # returns string of firmware version
     @staticmethod
-    async def firmware_version_get(socket):
-        return await socket.send_recv(f"FirmwareVersionGet(char *)")
+    async def firmware_version_get(pool):
+        return await pool.send_recv(f"FirmwareVersionGet(char *)")
 
 #########################################################
     # functions to remove
 
     # ObjectsListGet :  Group name and positioner name
     @staticmethod
-    async def get_object_list(sock):
-        return sock.send_recv('ObjectsListGet(char *)')
+    async def get_object_list(pool):
+        return await pool.send_recv('ObjectsListGet(char *)')
 
 
 class NewportXpsC(NewportXps):
@@ -0,0 +1,12 @@
+"""numpy is optional: modules take np from here and call check_numpy() where they need it"""
+HAS_NUMPY = False
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    np = None
+
+
+def check_numpy():
+    if not HAS_NUMPY:
+        raise ValueError("numpy not installed.")
@@ -0,0 +1,238 @@
+import errno
+import selectors
+import socket
+import time
+from . import framing
+from . import instrumentation as instr
+from .framing import ConnectionLost, DesyncError, XpsTimeout
+
+
+class _Connection:
+    """one non-blocking socket and the batch it is working through"""
+
+    def __init__(self, name: str, host: str, port: int, instrumentation: instr.Instrumentation) -> None:
+        self.name = name
+        self.host = host
+        self.port_number = port
+        self.instrumentation = instrumentation
+        self.sock = None
+        self.connecting = False
+        self.framer = framing.ReplyFramer()
+        # the batch in progress: unsent bytes, commands, and how many replies are in
+        self.outgoing = None
+        self.commands = []
+        self.n_received = 0
+        self.submitted = 0.0
+
+    @property
+    def waiting(self) -> bool:
+        return self.n_received < len(self.commands)
+
+
+class SelectorClient:
+    """synchronous client sending batches to many controllers (or connections) at once
+
+        client = SelectorClient()
+        client.add("xps1", "192.168.0.254")
+        client.add("xps2", "192.168.0.253")
+        replies = client.send_recv_many({"xps1": [cmd1, cmd2], "xps2": [cmd3]})
+
+    every connection is a non-blocking socket watched by one selector: all
+    batches are written at once and replies are gathered as they arrive, so
+    one thread drives any number of controllers. commands of a batch are
+    pipelined down their connection. when a call fails or times out, the
+    connections still waiting for replies are dropped and reopened by the next call
+    """
+    buffer_size = 2048
+
+    def __init__(self, timeout: float = 10.0) -> None:
+        # seconds to wait for all replies of a call
+        self.timeout = timeout
+        self._connections = {}
+        self._selector = selectors.DefaultSelector()
+        self._buffer = memoryview(bytearray(self.buffer_size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, name: str, host: str, port: int = 5001,
+            instrumentation: instr.Instrumentation = None) -> None:
+        """name: how calls address the connection, several names may share a host"""
+        if name in self._connections:
+            raise ValueError(f"connection {name} already added")
+        self._connections[name] = _Connection(name, host, port, instrumentation)
+
+    @property
+    def names(self) -> list:
+        return list(self._connections)
+
+    def close(self) -> None:
+        for conn in self._connections.values():
+            self._drop(conn)
+        self._selector.close()
+
+    def send_recv(self, name: str, cmd, timeout: float = -1):
+        return self.send_recv_many({name: [cmd]}, timeout)[name][0]
+
+    def send_recv_many(self, batches: dict, timeout: float = -1) -> dict:
+        """name -> commands, returns name -> replies, each a string or tuple of strings
+
+        an error reply raises MyException, once every reply has been read
+        """
+        return {name: [framing.unpack_reply(reply) for reply in replies]
+                for name, replies in self.exchange_many(batches, timeout).items()}
+
+    # the values of each reply as one undivided string, for callers that decode them themselves
+    def send_recv_raw_many(self, batches: dict, timeout: float = -1) -> dict:
+        return {name: [framing.checked_values(reply) for reply in replies]
+                for name, replies in self.exchange_many(batches, timeout).items()}
+
+    def exchange_many(self, batches: dict, timeout: float = -1) -> dict:
+        """name -> commands, returns name -> reply texts (error code included), in command order"""
+        replies = {name: [None] * len(commands) for name, commands in batches.items()}
+        for name, index, reply in self.iter_replies(batches, timeout):
+            replies[name][index] = reply
+        return replies
+
+    def iter_replies(self, batches: dict, timeout: float = -1):
+        """name -> commands, yields (name, index of the command, reply text) as replies arrive
+
+        stopping early drops the connections whose replies are still outstanding
+        """
+        if timeout == -1:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        active = []
+        try:
+            for name, commands in batches.items():
+                commands = list(commands)
+                if not commands:
+                    continue
+                conn = self._connections[name]
+                self._submit(conn, commands)
+                active.append(conn)
+
+            while any(conn.waiting for conn in active):
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timed_out(active, timeout)
+                for key, mask in self._selector.select(remaining):
+                    conn = key.data
+                    if mask & selectors.EVENT_WRITE:
+                        self._write(conn)
+                    if mask & selectors.EVENT_READ:
+                        for index, reply in self._read(conn):
+                            yield conn.name, index, reply
+        finally:
+            for conn in active:
+                if conn.waiting:
+                    if conn.instrumentation is not None:
+                        conn.instrumentation.abandon(len(conn.commands) - conn.n_received)
+                    self._drop(conn)
+                elif conn.sock is not None:
+                    # idle connections are not watched between calls
+                    self._selector.unregister(conn.sock)
+
+    def _submit(self, conn: _Connection, commands: list) -> None:
+        if conn.sock is None:
+            self._connect(conn)
+        conn.outgoing = memoryview("".join(commands).encode())
+        conn.commands = commands
+        conn.n_received = 0
+        conn.submitted = time.perf_counter()
+        if conn.instrumentation is not None:
+            conn.instrumentation.begin(len(commands))
+        self._selector.register(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, conn)
+
+    def _connect(self, conn: _Connection) -> None:
+        # the connection completes in the selector loop, alongside the other connections
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        err = sock.connect_ex((conn.host, conn.port_number))
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            raise ConnectionLost(f"could not connect to {conn.host}: {errno.errorcode.get(err, err)}")
+        conn.sock = sock
+        conn.connecting = err != 0
+        conn.framer.clear()
+
+    def _write(self, conn: _Connection) -> None:
+        if conn.connecting:
+            err = conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                raise self._lost(conn, f"could not connect to {conn.host}: {errno.errorcode.get(err, err)}")
+            conn.connecting = False
+        try:
+            n_bytes = conn.sock.send(conn.outgoing)
+        except BlockingIOError:
+            return
+        except OSError as err:
+            raise self._lost(conn, f"connection to {conn.host} lost: {err}")
+        conn.outgoing = conn.outgoing[n_bytes:]
+        if not conn.outgoing:
+            self._selector.modify(conn.sock, selectors.EVENT_READ, conn)
+
+    def _read(self, conn: _Connection) -> list:
+        """(index, reply) of the replies completed by the bytes now waiting on the socket"""
+        try:
+            n_bytes = conn.sock.recv_into(self._buffer)
+        except BlockingIOError:
+            return []
+        except OSError as err:
+            raise self._lost(conn, f"connection to {conn.host} lost: {err}")
+        if n_bytes == 0:
+            raise self._lost(conn, f"connection to {conn.host} closed by controller")
+        conn.framer.feed(self._buffer[:n_bytes])
+
+        replies = []
+        reply = conn.framer.next_reply()
+        while reply is not None:
+            if not conn.waiting:
+                raise self._lost(conn, f"unexpected reply {reply[:40]!r} from {conn.host}", DesyncError)
+            command = conn.commands[conn.n_received]
+            try:
+                err = framing.check_reply(command, reply)
+            except ValueError as why:
+                raise self._lost(conn, f"stream from {conn.host} out of step: {why}", DesyncError)
+            if conn.instrumentation is not None:
+                conn.instrumentation.record(command, time.perf_counter() - conn.submitted, len(command),
+                                            len(reply) + len(framing.END_OF_API), err)
+            replies.append((conn.n_received, reply))
+            conn.n_received += 1
+            reply = conn.framer.next_reply()
+        if not conn.waiting and len(conn.framer):
+            raise self._lost(conn, f"stream from {conn.host} out of step: bytes left over after the last reply",
+                             DesyncError)
+        return replies
+
+    def _timed_out(self, active: list, timeout: float) -> None:
+        waiting = [conn for conn in active if conn.waiting]
+        for conn in waiting:
+            if conn.instrumentation is not None:
+                conn.instrumentation.record_timeout()
+        names = ", ".join(conn.name for conn in waiting)
+        raise XpsTimeout(f"no reply within {timeout}s from {names}")
+
+    def _lost(self, conn: _Connection, why: str, error=ConnectionLost) -> ConnectionLost:
+        if conn.instrumentation is not None and conn.waiting:
+            conn.instrumentation.abandon(len(conn.commands) - conn.n_received)
+        self._drop(conn)
+        return error(why)
+
+    def _drop(self, conn: _Connection) -> None:
+        """close the socket, the next call to the connection reconnects"""
+        if conn.sock is None:
+            return
+        if conn.sock in self._selector.get_map():
+            self._selector.unregister(conn.sock)
+        conn.sock.close()
+        conn.sock = None
+        conn.outgoing = None
+        conn.commands = []
+        conn.n_received = 0
@@ -0,0 +1,199 @@
+import anyio
+from contextlib import AsyncExitStack
+from . import instrumentation as instr
+from . import motion_group
+from . import trio_socket
+from . import wire_recorder
+from . import xps_api
+
+
+class SetpointStream:
+    """setpoints for one group over a dedicated connection, the newest value wins
+
+    set() never blocks: it replaces any setpoint that has not been sent yet.
+    one task sends the newest value as soon as the previous one has been
+    acknowledged, so a controller slower than the feedback loop costs
+    skipped setpoints rather than a growing backlog. once a command fails
+    the stream stops and set() raises the error
+    """
+    # seconds to wait for each acknowledgement
+    timeout = 2.0
+
+    def __init__(self, host: str, group: motion_group.XpsMotionGroup, port: int = 5001,
+                 instrumentation: instr.Instrumentation = None, recorder: wire_recorder.WireRecorder = None) -> None:
+        self.host = host
+        self.port_number = port
+        self.group = group
+        # optional, usually the ones shared with the controller's pool
+        self.instrumentation = instrumentation
+        self.recorder = recorder
+        self.n_sent = 0
+        self.n_replaced = 0
+        # seconds from set() to the acknowledgement, for the last value sent
+        self.last_latency = None
+        self.error = None
+        self._sock = None
+        self._nursery = None
+        self._exit_stack = None
+        # (values, time of set()) not yet sent
+        self._pending = None
+        self._wakeup = anyio.Event()
+
+    async def __aenter__(self):
+        async with AsyncExitStack() as stack:
+            self._sock = await stack.enter_async_context(
+                trio_socket.AsyncSocket(self.host, self.port_number, self.instrumentation, timeout=self.timeout,
+                                    recorder=self.recorder))
+            # unwound in reverse: stop the sender, then leave the control mode, then close.
+            # only a mode that was entered is left again
+            await self._start(stack)
+            stack.push_async_callback(self._finish)
+            self._nursery = await stack.enter_async_context(anyio.create_task_group())
+            stack.callback(self._nursery.cancel_scope.cancel)
+            self._nursery.start_soon(self._run)
+            self._exit_stack = stack.pop_all()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._exit_stack.__aexit__(exc_type, exc_val, exc_tb)
+        self._exit_stack = None
+        self._nursery = None
+
+    def set(self, values) -> None:
+        """a float for single positioner groups, otherwise one value per positioner"""
+        if self.error is not None:
+            raise self.error
+        values = self._check(self.group._per_positioner(values))
+        if self._pending is not None:
+            self.n_replaced += 1
+        self._pending = (values, anyio.current_time())
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                await self._wakeup.wait()
+                # renewed before taking the value: a set() from here on wakes the next round
+                self._wakeup = anyio.Event()
+                (values, set_at), self._pending = self._pending, None
+                await self._send(values)
+                self.n_sent += 1
+                self.last_latency = anyio.current_time() - set_at
+        except trio_socket.MyException as err:
+            self.error = err
+
+    def _check(self, values: list) -> list:
+        return values
+
+    async def _start(self, stack: AsyncExitStack) -> None:
+        pass
+
+    async def _send(self, values: list) -> None:
+        raise NotImplementedError
+
+    async def _finish(self) -> None:
+        pass
+
+
+class JogStream(SetpointStream):
+    """velocity control with the group in jog mode: setpoints are velocities
+
+    leaving the context ramps every positioner to rest and ends jog mode
+    """
+    # seconds allowed on top of the deceleration time for coming to rest
+    stop_margin = 1.0
+
+    def __init__(self, host: str, group: motion_group.XpsMotionGroup, port: int = 5001,
+                 accel: float = None, instrumentation: instr.Instrumentation = None,
+                 recorder: wire_recorder.WireRecorder = None) -> None:
+        """accel: acceleration for every velocity change, default each positioner's maximum"""
+        super().__init__(host, group, port, instrumentation, recorder)
+        self.accels = [accel if accel is not None else pos.max_accel for pos in group.positioners]
+        for pos, pos_accel in zip(group.positioners, self.accels):
+            if pos_accel is None:
+                raise ValueError(f"{pos.name}: no maximum acceleration known, give accel")
+
+    def _check(self, velocities: list) -> list:
+        for pos, velocity in zip(self.group.positioners, velocities):
+            if pos.max_velocity is not None and abs(velocity) > pos.max_velocity:
+                raise ValueError(f"{pos.name}: jog velocity {velocity:g} > {pos.max_velocity:g}")
+        return velocities
+
+    # GroupJogModeEnable :  Enable Jog mode on selected group
+    async def _start(self, stack: AsyncExitStack) -> None:
+        await self._sock.send_recv(xps_api.function("GroupJogModeEnable").command(self.group.name))
+
+    # GroupJogParametersSet :  Modify Jog parameters on selected group and activate the continuous move
+    async def _send(self, velocities: list) -> None:
+        args = [value for velocity, accel in zip(velocities, self.accels) for value in (velocity, accel)]
+        await self._sock.send_recv(xps_api.function("GroupJogParametersSet").command(self.group.name, *args))
+
+    # GroupJogModeDisable :  Disable Jog mode on selected group
+    async def _finish(self) -> None:
+        name = self.group.name
+        n_positioners = len(self.group.positioners)
+        jog_current = xps_api.function("GroupJogCurrentGet")
+        with anyio.CancelScope(shield=True):
+            await self._send([0.0] * n_positioners)
+            # jog mode can only end once every positioner is at rest
+            max_speed = max(pos.max_velocity or 0.0 for pos in self.group.positioners)
+            with anyio.move_on_after(max_speed / min(self.accels) + self.stop_margin):
+                while True:
+                    current = jog_current.decode(await self._sock.send_recv_raw(
+                        jog_current.command(name, n_values=2 * n_positioners)))
+                    if not any(current[0::2]):
+                        break
+                    await anyio.sleep(0.01)
+            await self._sock.send_recv(xps_api.function("GroupJogModeDisable").command(name))
+
+
+class RetargetStream(SetpointStream):
+    """position control by retargeting: setpoints are absolute positions
+
+    GroupMoveAbsolute is only answered once the move ends, so moves run on a
+    second connection. a new target aborts the move in progress and starts
+    one to the newest target. for groups that cannot be jogged
+    """
+
+    def __init__(self, host: str, group: motion_group.XpsMotionGroup, port: int = 5001,
+                 instrumentation: instr.Instrumentation = None, recorder: wire_recorder.WireRecorder = None) -> None:
+        super().__init__(host, group, port, instrumentation, recorder)
+        self._motion_sock = None
+        self._move_done = None
+        # set while a newer target aborts the move in progress
+        self._aborting = False
+
+    def _check(self, targets: list) -> list:
+        self.group.check_position_within_limits(targets)
+        return targets
+
+    async def _start(self, stack: AsyncExitStack) -> None:
+        self._motion_sock = await stack.enter_async_context(
+            trio_socket.AsyncSocket(self.host, self.port_number, self.instrumentation, timeout=None,
+                                    recorder=self.recorder))
+
+    # GroupMoveAbort :  Abort a move
+    async def _send(self, targets: list) -> None:
+        if self._move_done is not None and not self._move_done.is_set():
+            self._aborting = True
+            try:
+                await self._sock.send_recv(xps_api.function("GroupMoveAbort").command(self.group.name))
+            except trio_socket.MyException:
+                # the move ended before the abort arrived
+                pass
+            await self._move_done.wait()
+            self._aborting = False
+        self._move_done = anyio.Event()
+        self._nursery.start_soon(self._move, targets, self._move_done)
+
+    # GroupMoveAbsolute :  Do an absolute move
+    async def _move(self, targets: list, done: anyio.Event) -> None:
+        command = xps_api.function("GroupMoveAbsolute").command(self.group.name, *targets)
+        try:
+            await self._motion_sock.send_recv(command)
+        except trio_socket.MyException as err:
+            # the move aborted for a newer target answers with an error too
+            if not self._aborting and self.error is None:
+                self.error = err
+        finally:
+            done.set()
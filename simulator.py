@@ -0,0 +1,685 @@
+import math
+import random
+import anyio
+from contextlib import AsyncExitStack
+from . import command_server
+from .status_codes import (ERR_UNKNOWN_COMMAND, ERR_WRONG_FORMAT, ERR_WRONG_PARAMETERS_NUMBER, ERR_OUT_OF_RANGE,
+                           ERR_POSITIONER_NAME, ERR_GROUP_NAME, ERR_NOT_ALLOWED, ERR_MOVE_ABORTED)
+
+ERROR_STRINGS = {
+    0: "Successful command",
+    ERR_UNKNOWN_COMMAND: "Unknown command",
+    ERR_WRONG_FORMAT: "Wrong format in the command string",
+    ERR_WRONG_PARAMETERS_NUMBER: "Wrong number of parameters in the command",
+    ERR_OUT_OF_RANGE: "Parameter out of allowed range",
+    ERR_POSITIONER_NAME: "Positioner Name doesn't exist or unknown command",
+    ERR_GROUP_NAME: "GroupName doesn't exist or unknown command",
+    ERR_NOT_ALLOWED: "Not allowed action",
+    ERR_MOVE_ABORTED: "Move Aborted",
+}
+
+# group states
+NOT_INITIALIZED = 0
+READY_FROM_HOMING = 11
+READY_FROM_MOTION = 12
+READY_FROM_JOGGING = 15
+NOT_REFERENCED = 42
+HOMING = 43
+MOVING = 44
+JOGGING = 47
+NOT_INITIALIZED_FROM_KILL = 7
+
+GROUP_STATUS_STRINGS = {
+    NOT_INITIALIZED: "Not initialized state",
+    NOT_INITIALIZED_FROM_KILL: "Not initialized state due to a GroupKill or KillAll command",
+    READY_FROM_HOMING: "Ready state from homing",
+    READY_FROM_MOTION: "Ready state from motion",
+    READY_FROM_JOGGING: "Ready state from jogging",
+    NOT_REFERENCED: "Not referenced state",
+    HOMING: "Homing state",
+    MOVING: "Moving state",
+    JOGGING: "Jogging state",
+}
+READY = (READY_FROM_HOMING, READY_FROM_MOTION, READY_FROM_JOGGING)
+
+# system.ini key for a group of n positioners
+GROUP_KEYS = {1: "SingleAxisInUse", 2: "XYInUse", 3: "XYZInUse"}
+
+
+class CommandError(Exception):
+    """answered with a controller error code"""
+
+    def __init__(self, code: int) -> None:
+        self.code = code
+
+
+class TrapezoidalMove:
+    """point to point motion at constant acceleration, limited by velocity and acceleration"""
+
+    def __init__(self, start: float, target: float, velocity: float, accel: float,
+                 start_time: float) -> None:
+        self.start = start
+        self.target = target
+        self.start_time = start_time
+        self.direction = 1.0 if target >= start else -1.0
+        distance = abs(target - start)
+        if distance >= velocity ** 2 / accel:
+            self.ramp_time = velocity / accel
+            self.peak_velocity = velocity
+            cruise_time = distance / velocity - self.ramp_time
+        else:
+            # never reaches full velocity: triangular profile
+            self.ramp_time = math.sqrt(distance / accel)
+            self.peak_velocity = accel * self.ramp_time
+            cruise_time = 0.0
+        self.accel = accel
+        self.duration = 2 * self.ramp_time + cruise_time
+        self.end_time = start_time + self.duration
+
+    def position(self, now: float) -> float:
+        t = min(max(now - self.start_time, 0.0), self.duration)
+        ramp, accel = self.ramp_time, self.accel
+        if t < ramp:
+            travelled = 0.5 * accel * t ** 2
+        elif t < self.duration - ramp:
+            travelled = 0.5 * accel * ramp ** 2 + self.peak_velocity * (t - ramp)
+        else:
+            remaining = self.duration - t
+            travelled = abs(self.target - self.start) - 0.5 * accel * remaining ** 2
+        return self.start + self.direction * travelled
+
+    def velocity(self, now: float) -> float:
+        t = now - self.start_time
+        if t <= 0 or t >= self.duration:
+            return 0.0
+        speed = min(self.accel * t, self.peak_velocity, self.accel * (self.duration - t))
+        return self.direction * speed
+
+
+class JogMotion:
+    """ramps at constant acceleration from the current velocity to the jog velocity, then holds it"""
+
+    def __init__(self, start: float, start_velocity: float, velocity: float, accel: float,
+                 start_time: float) -> None:
+        self.start = start
+        self.start_velocity = start_velocity
+        self.target_velocity = velocity
+        self.accel = accel
+        self.start_time = start_time
+        self.direction = 1.0 if velocity >= start_velocity else -1.0
+        self.ramp_time = abs(velocity - start_velocity) / accel
+
+    def position(self, now: float) -> float:
+        t = max(now - self.start_time, 0.0)
+        ramp = min(t, self.ramp_time)
+        ramped = self.start_velocity * ramp + 0.5 * self.direction * self.accel * ramp ** 2
+        return self.start + ramped + self.target_velocity * (t - ramp)
+
+    def velocity(self, now: float) -> float:
+        t = max(now - self.start_time, 0.0)
+        if t >= self.ramp_time:
+            return self.target_velocity
+        return self.start_velocity + self.direction * self.accel * t
+
+
+class SimulatedPositioner:
+
+    def __init__(self, name: str, max_velocity: float, max_accel: float,
+                 min_position: float, max_position: float) -> None:
+        self.name = name
+        self.max_velocity = max_velocity
+        self.max_accel = max_accel
+        self.min_position = min_position
+        self.max_position = max_position
+        # PositionerSGammaParametersSet: velocity and acceleration used for moves
+        self.move_velocity = max_velocity
+        self.move_accel = max_accel
+        self.min_jerk_time = 0.005
+        self.max_jerk_time = 0.05
+        # PositionerErrorGet reads and clears it, PositionerErrorRead only reads it
+        self.error_code = 0
+        self._position = 0.0
+        self._target = 0.0
+        self._move = None
+
+    def position(self, now: float) -> float:
+        if self._move is not None:
+            return self._move.position(now)
+        return self._position
+
+    def velocity(self, now: float) -> float:
+        return self._move.velocity(now) if self._move is not None else 0.0
+
+    def start_move(self, target: float, now: float) -> float:
+        """returns the time the move ends"""
+        self._position = self.position(now)
+        self._target = target
+        self._move = TrapezoidalMove(self._position, target, self.move_velocity, self.move_accel, now)
+        return self._move.end_time
+
+    def start_jog(self, velocity: float, accel: float, now: float) -> None:
+        self._move = JogMotion(self.position(now), self.velocity(now), velocity, accel, now)
+
+    def jog_parameters(self) -> tuple:
+        """(jog velocity, acceleration), zero when not jogging"""
+        if isinstance(self._move, JogMotion):
+            return self._move.target_velocity, self._move.accel
+        return 0.0, 0.0
+
+    def stop(self, now: float) -> None:
+        self._position = self._target = self.position(now)
+        self._move = None
+
+
+class SimulatedGroup:
+
+    def __init__(self, name: str, positioners: list, status: int) -> None:
+        self.name = name
+        self.positioners = positioners
+        self.status = status
+        # cancelled by GroupMoveAbort / GroupKill
+        self.motion_scope = None
+
+
+class XpsSimulator(command_server.CommandServer):
+    """a local stand-in for an XPS controller, for tests and benchmarks
+
+    serves the ASCII command protocol with simulated groups whose positioners
+    move with trapezoidal velocity profiles, and an ftp endpoint serving
+    Config/system.ini and accepting uploads. latency and jitter delay every
+    reply, command_time is the controller's own processing time per command
+    and fragment_size splits replies into several writes. commands on one
+    connection are executed one after the other, as on the controller
+    """
+    firmware_version = "XPS-Q8 Simulator"
+    username = "Administrator"
+    password = "Administrator"
+
+    def __init__(self, n_groups: int = 8, groups: dict = None, latency: float = 0.0,
+                 jitter: float = 0.0, command_time: float = 0.0, fragment_size: int = None,
+                 host: str = "127.0.0.1", port: int = 0, ftp_port: int = 0, ready: bool = True,
+                 max_velocity: float = 20.0, max_accel: float = 80.0, travel: tuple = (-100.0, 100.0),
+                 seed: int = None) -> None:
+        """groups: {group name: [positioner names]}, default n_groups single axis groups G1..Gn"""
+        if groups is None:
+            groups = {f"G{i + 1}": ["Pos"] for i in range(n_groups)}
+        status = READY_FROM_HOMING if ready else NOT_INITIALIZED
+        self.groups = {}
+        self.positioners = {}
+        for group_name, positioner_names in groups.items():
+            positioners = [SimulatedPositioner(f"{group_name}.{name}", max_velocity, max_accel, *travel)
+                           for name in positioner_names]
+            self.groups[group_name] = SimulatedGroup(group_name, positioners, status)
+            self.positioners.update((pos.name, pos) for pos in positioners)
+
+        self.latency = latency
+        self.jitter = jitter
+        self.command_time = command_time
+        self.fragment_size = fragment_size
+        self.host = host
+        self.port = port
+        self.ftp_port = ftp_port
+        self.ftp = SimulatedFtpServer({"/Config/system.ini": self.system_ini().encode()},
+                                      ("/Public", "/Public/Trajectories"))
+        self.n_commands = 0
+        # command names whose next reply is lost, see drop_reply
+        self._dropped_replies = set()
+        self._random = random.Random(seed)
+        self._boot_time = None
+        self._exit_stack = None
+
+        self._handlers = {
+            "FirmwareVersionGet": self._firmware_version_get,
+            "ElapsedTimeGet": self._elapsed_time_get,
+            "ObjectsListGet": self._objects_list_get,
+            "ErrorStringGet": self._error_string_get,
+            "GroupStatusGet": self._group_status_get,
+            "GroupStatusStringGet": self._group_status_string_get,
+            "GroupInitialize": self._group_initialize,
+            "GroupHomeSearch": self._group_home_search,
+            "GroupKill": self._group_kill,
+            "GroupMoveAbort": self._group_move_abort,
+            "GroupMoveAbsolute": self._group_move_absolute,
+            "GroupMoveRelative": self._group_move_relative,
+            "GroupPositionCurrentGet": self._group_position_current_get,
+            "GroupPositionSetpointGet": self._group_position_current_get,
+            "GroupPositionTargetGet": self._group_position_target_get,
+            "GroupVelocityCurrentGet": self._group_velocity_current_get,
+            "GroupJogModeEnable": self._group_jog_mode_enable,
+            "GroupJogModeDisable": self._group_jog_mode_disable,
+            "GroupJogParametersSet": self._group_jog_parameters_set,
+            "GroupJogParametersGet": self._group_jog_parameters_get,
+            "GroupJogCurrentGet": self._group_jog_current_get,
+            "PositionerUserTravelLimitsGet": self._travel_limits_get,
+            "PositionerUserTravelLimitsSet": self._travel_limits_set,
+            "PositionerMaximumVelocityAndAccelerationGet": self._max_velocity_and_accel_get,
+            "PositionerSGammaParametersGet": self._sgamma_get,
+            "PositionerSGammaParametersSet": self._sgamma_set,
+            "PositionerHardwareStatusGet": self._zero_code_get,
+            "PositionerErrorGet": self._positioner_error_get,
+            "PositionerErrorRead": self._positioner_error_read,
+            "PositionerHardwareStatusStringGet": self._status_string_get,
+            "PositionerErrorStringGet": self._status_string_get,
+        }
+
+    async def __aenter__(self):
+        async with AsyncExitStack() as stack:
+            # unwound in reverse: stop serving, then close the listeners
+            command_listener = await stack.enter_async_context(
+                await anyio.create_tcp_listener(local_host=self.host, local_port=self.port))
+            ftp_listener = await stack.enter_async_context(
+                await anyio.create_tcp_listener(local_host=self.host, local_port=self.ftp_port))
+            self.port = command_listener.extra(anyio.abc.SocketAttribute.local_port)
+            self.ftp_port = ftp_listener.extra(anyio.abc.SocketAttribute.local_port)
+            task_group = await stack.enter_async_context(anyio.create_task_group())
+            stack.callback(task_group.cancel_scope.cancel)
+            task_group.start_soon(command_listener.serve, self._serve_commands)
+            task_group.start_soon(ftp_listener.serve, self.ftp.serve)
+            self._boot_time = anyio.current_time()
+            self._exit_stack = stack.pop_all()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._exit_stack.aclose()
+        self._exit_stack = None
+
+    def system_ini(self) -> str:
+        by_key = {}
+        for group in self.groups.values():
+            key = GROUP_KEYS.get(len(group.positioners), "MultipleAxesInUse")
+            by_key.setdefault(key, []).append(group.name)
+        lines = ["[GROUPS]"]
+        for key in ("SingleAxisInUse", "SpindleInUse", "XYInUse", "XYZInUse", "MultipleAxesInUse"):
+            lines.append(f"{key} = {', '.join(by_key.get(key, []))}")
+        plug_number = 1
+        for group in self.groups.values():
+            short_names = [pos.name.split('.', 1)[1] for pos in group.positioners]
+            lines += ["", f"[{group.name}]", f"PositionerInUse = {', '.join(short_names)}"]
+            for pos in group.positioners:
+                lines += ["", f"[{pos.name}]", "StageName = @SIM@SIMULATED_STAGE@",
+                          f"PlugNumber = {plug_number}"]
+                plug_number += 1
+        return "\n".join(lines) + "\n"
+
+    def drop_reply(self, name: str) -> None:
+        """the next time command name runs, close its connection instead of replying
+
+        the command still takes effect: as a link dropping just after the controller acted
+        """
+        self._dropped_replies.add(name)
+
+    async def execute(self, command: str) -> str:
+        """the reply text to one command, without the terminator"""
+        self.n_commands += 1
+        name, args = self._split(command)
+        try:
+            if name is None:
+                raise CommandError(ERR_WRONG_FORMAT)
+            handler = self._handlers.get(name)
+            if handler is None:
+                raise CommandError(ERR_UNKNOWN_COMMAND)
+            values = await handler(*args)
+        except CommandError as err:
+            return f"{err.code},{command}"
+        except TypeError:
+            return f"{ERR_WRONG_PARAMETERS_NUMBER},{command}"
+        except ValueError:
+            return f"{ERR_WRONG_FORMAT},{command}"
+        return ",".join(["0"] + [_format(value) for value in values])
+
+    @staticmethod
+    def _split(command: str) -> tuple:
+        opening = command.find('(')
+        if opening == -1 or not command.endswith(')'):
+            return None, []
+        inner = command[opening + 1:-1]
+        # output parameters ('double *') are only placeholders
+        args = [arg.strip() for arg in inner.split(',') if arg.strip() and not arg.strip().endswith('*')]
+        return command[:opening], args
+
+    # command connections
+
+    async def _reply_to(self, command: str):
+        if self.command_time:
+            await anyio.sleep(self.command_time)
+        reply = await self.execute(command)
+        name = self._split(command)[0]
+        if name in self._dropped_replies:
+            self._dropped_replies.discard(name)
+            return None
+        return reply, self._delivery_time()
+
+    def _delivery_time(self) -> float:
+        # replies keep their order, jitter never lets one overtake an earlier one
+        delay = self.latency
+        if self.jitter:
+            delay += self._random.uniform(0.0, self.jitter)
+        return anyio.current_time() + delay
+
+    # lookups
+
+    def _group(self, name: str) -> SimulatedGroup:
+        if name not in self.groups:
+            raise CommandError(ERR_GROUP_NAME)
+        return self.groups[name]
+
+    def _positioner(self, name: str) -> SimulatedPositioner:
+        if name not in self.positioners:
+            raise CommandError(ERR_POSITIONER_NAME)
+        return self.positioners[name]
+
+    # controller
+
+    async def _firmware_version_get(self):
+        return [self.firmware_version]
+
+    async def _elapsed_time_get(self):
+        return [anyio.current_time() - self._boot_time]
+
+    async def _objects_list_get(self):
+        names = list(self.groups) + list(self.positioners)
+        return [";".join(names)]
+
+    async def _error_string_get(self, code):
+        return [ERROR_STRINGS.get(int(code), f"Error {int(code)}")]
+
+    # groups
+
+    async def _group_status_get(self, group_name):
+        return [self._group(group_name).status]
+
+    async def _group_status_string_get(self, code):
+        return [GROUP_STATUS_STRINGS.get(int(code), f"Status {int(code)}")]
+
+    async def _group_initialize(self, group_name):
+        group = self._group(group_name)
+        if group.status not in (NOT_INITIALIZED, NOT_INITIALIZED_FROM_KILL):
+            raise CommandError(ERR_NOT_ALLOWED)
+        group.status = NOT_REFERENCED
+        return []
+
+    async def _group_home_search(self, group_name):
+        group = self._group(group_name)
+        if group.status != NOT_REFERENCED:
+            raise CommandError(ERR_NOT_ALLOWED)
+        await self._run_motion(group, [0.0] * len(group.positioners), HOMING, READY_FROM_HOMING)
+        return []
+
+    async def _group_kill(self, group_name):
+        group = self._group(group_name)
+        self._stop(group)
+        group.status = NOT_INITIALIZED_FROM_KILL
+        return []
+
+    async def _group_move_abort(self, group_name):
+        group = self._group(group_name)
+        if group.status != MOVING:
+            raise CommandError(ERR_NOT_ALLOWED)
+        self._stop(group)
+        group.status = READY_FROM_MOTION
+        return []
+
+    async def _group_move_absolute(self, group_name, *targets):
+        group = self._group(group_name)
+        await self._move(group, [float(target) for target in targets])
+        return []
+
+    async def _group_move_relative(self, group_name, *displacements):
+        group = self._group(group_name)
+        if len(displacements) != len(group.positioners):
+            raise CommandError(ERR_WRONG_PARAMETERS_NUMBER)
+        targets = [pos._target + float(step) for pos, step in zip(group.positioners, displacements)]
+        await self._move(group, targets)
+        return []
+
+    async def _group_position_current_get(self, group_name):
+        now = anyio.current_time()
+        return [pos.position(now) for pos in self._group(group_name).positioners]
+
+    async def _group_position_target_get(self, group_name):
+        return [pos._target for pos in self._group(group_name).positioners]
+
+    async def _group_velocity_current_get(self, group_name):
+        now = anyio.current_time()
+        return [pos.velocity(now) for pos in self._group(group_name).positioners]
+
+    async def _group_jog_mode_enable(self, group_name):
+        group = self._group(group_name)
+        if group.status not in READY:
+            raise CommandError(ERR_NOT_ALLOWED)
+        group.status = JOGGING
+        return []
+
+    async def _group_jog_mode_disable(self, group_name):
+        group = self._group(group_name)
+        now = anyio.current_time()
+        # only once every positioner has come to rest
+        if group.status != JOGGING or any(pos.velocity(now) != 0.0 or pos.jog_parameters()[0] != 0.0
+                                          for pos in group.positioners):
+            raise CommandError(ERR_NOT_ALLOWED)
+        for pos in group.positioners:
+            pos.stop(now)
+        group.status = READY_FROM_JOGGING
+        return []
+
+    async def _group_jog_parameters_set(self, group_name, *velocities_and_accels):
+        group = self._group(group_name)
+        if len(velocities_and_accels) != 2 * len(group.positioners):
+            raise CommandError(ERR_WRONG_PARAMETERS_NUMBER)
+        if group.status != JOGGING:
+            raise CommandError(ERR_NOT_ALLOWED)
+        values = [float(value) for value in velocities_and_accels]
+        for pos, velocity, accel in zip(group.positioners, values[0::2], values[1::2]):
+            if abs(velocity) > pos.max_velocity or not 0 < accel <= pos.max_accel:
+                raise CommandError(ERR_OUT_OF_RANGE)
+        now = anyio.current_time()
+        for pos, velocity, accel in zip(group.positioners, values[0::2], values[1::2]):
+            pos.start_jog(velocity, accel, now)
+        return []
+
+    async def _group_jog_parameters_get(self, group_name):
+        return [value for pos in self._group(group_name).positioners for value in pos.jog_parameters()]
+
+    async def _group_jog_current_get(self, group_name):
+        now = anyio.current_time()
+        return [value for pos in self._group(group_name).positioners
+                for value in (pos.velocity(now), pos.jog_parameters()[1])]
+
+    async def _move(self, group: SimulatedGroup, targets: list) -> None:
+        if len(targets) != len(group.positioners):
+            raise CommandError(ERR_WRONG_PARAMETERS_NUMBER)
+        if group.status not in READY:
+            raise CommandError(ERR_NOT_ALLOWED)
+        for pos, target in zip(group.positioners, targets):
+            if not pos.min_position <= target <= pos.max_position:
+                raise CommandError(ERR_OUT_OF_RANGE)
+        await self._run_motion(group, targets, MOVING, READY_FROM_MOTION)
+
+    async def _run_motion(self, group: SimulatedGroup, targets: list, moving_status: int,
+                          final_status: int) -> None:
+        """start the positioners and answer once all have arrived"""
+        now = anyio.current_time()
+        end_time = max(pos.start_move(target, now) for pos, target in zip(group.positioners, targets))
+        group.status = moving_status
+        with anyio.CancelScope(deadline=end_time) as group.motion_scope:
+            await anyio.sleep_forever()
+        group.motion_scope = None
+        if not anyio.current_time() >= end_time:
+            # GroupMoveAbort or GroupKill: they set the new state
+            raise CommandError(ERR_MOVE_ABORTED)
+        for pos in group.positioners:
+            pos.stop(end_time)
+        group.status = final_status
+
+    @staticmethod
+    def _stop(group: SimulatedGroup) -> None:
+        now = anyio.current_time()
+        for pos in group.positioners:
+            pos.stop(now)
+        if group.motion_scope is not None:
+            group.motion_scope.cancel()
+
+    # positioners
+
+    async def _travel_limits_get(self, positioner_name):
+        pos = self._positioner(positioner_name)
+        return [pos.min_position, pos.max_position]
+
+    async def _travel_limits_set(self, positioner_name, minimum, maximum):
+        pos = self._positioner(positioner_name)
+        if float(minimum) > float(maximum):
+            raise CommandError(ERR_OUT_OF_RANGE)
+        pos.min_position, pos.max_position = float(minimum), float(maximum)
+        return []
+
+    async def _max_velocity_and_accel_get(self, positioner_name):
+        pos = self._positioner(positioner_name)
+        return [pos.max_velocity, pos.max_accel]
+
+    async def _sgamma_get(self, positioner_name):
+        pos = self._positioner(positioner_name)
+        return [pos.move_velocity, pos.move_accel, pos.min_jerk_time, pos.max_jerk_time]
+
+    async def _sgamma_set(self, positioner_name, velocity, accel, min_jerk_time, max_jerk_time):
+        pos = self._positioner(positioner_name)
+        velocity, accel = float(velocity), float(accel)
+        if not (0 < velocity <= pos.max_velocity and 0 < accel <= pos.max_accel):
+            raise CommandError(ERR_OUT_OF_RANGE)
+        pos.move_velocity, pos.move_accel = velocity, accel
+        pos.min_jerk_time, pos.max_jerk_time = float(min_jerk_time), float(max_jerk_time)
+        return []
+
+    async def _zero_code_get(self, positioner_name):
+        self._positioner(positioner_name)
+        return [0]
+
+    async def _positioner_error_get(self, positioner_name):
+        pos = self._positioner(positioner_name)
+        code, pos.error_code = pos.error_code, 0
+        return [code]
+
+    async def _positioner_error_read(self, positioner_name):
+        return [self._positioner(positioner_name).error_code]
+
+    async def _status_string_get(self, code):
+        return ["OK" if int(code) == 0 else f"Status {int(code)}"]
+
+
+def _format(value) -> str:
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class SimulatedFtpServer:
+    """just enough of an ftp server for ftplib: login, cwd/pwd, size, passive retr and stor
+
+    files are kept in memory as {absolute path: bytes}
+    """
+
+    def __init__(self, files: dict, directories=()) -> None:
+        self.files = dict(files)
+        self.directories = {"/"} | set(directories)
+        for path in self.files:
+            self._add_parents(path)
+
+    def _add_parents(self, path: str) -> None:
+        parent = path.rsplit("/", 1)[0]
+        while parent:
+            self.directories.add(parent)
+            parent = parent.rsplit("/", 1)[0]
+
+    @staticmethod
+    def _resolve(cwd: str, path: str) -> str:
+        if not path.startswith("/"):
+            path = cwd.rstrip("/") + "/" + path
+        parts = []
+        for part in path.split("/"):
+            if part == "..":
+                if parts:
+                    parts.pop()
+            elif part and part != ".":
+                parts.append(part)
+        return "/" + "/".join(parts)
+
+    async def serve(self, stream: anyio.abc.SocketStream) -> None:
+        cwd = "/"
+        data_listener = None
+
+        async def reply(line: str) -> None:
+            await stream.send((line + "\r\n").encode("latin-1"))
+
+        async def data_connection() -> anyio.abc.SocketStream:
+            nonlocal data_listener
+            if data_listener is None:
+                raise anyio.BrokenResourceError("no PASV before transfer")
+            listener, data_listener = data_listener, None
+            async with listener:
+                return await listener.accept()
+
+        async with stream:
+            await reply("220 XPS simulator ftp")
+            buffer = b""
+            while True:
+                try:
+                    data = await stream.receive(4096)
+                except (anyio.EndOfStream, anyio.BrokenResourceError):
+                    return
+                buffer += data
+                while b"\r\n" in buffer:
+                    line, buffer = buffer.split(b"\r\n", 1)
+                    verb, _, arg = line.decode("latin-1").partition(" ")
+                    verb = verb.upper()
+                    if verb == "USER":
+                        await reply("331 password required")
+                    elif verb == "PASS":
+                        await reply("230 logged in")
+                    elif verb in ("TYPE", "NOOP", "MODE", "STRU"):
+                        await reply("200 ok")
+                    elif verb == "SYST":
+                        await reply("215 UNIX Type: L8")
+                    elif verb == "PWD":
+                        await reply(f'257 "{cwd}"')
+                    elif verb == "CWD":
+                        path = self._resolve(cwd, arg)
+                        if path in self.directories:
+                            cwd = path
+                            await reply("250 ok")
+                        else:
+                            await reply("550 no such directory")
+                    elif verb == "SIZE":
+                        path = self._resolve(cwd, arg)
+                        if path in self.files:
+                            await reply(f"213 {len(self.files[path])}")
+                        else:
+                            await reply("550 no such file")
+                    elif verb == "PASV":
+                        if data_listener is not None:
+                            await data_listener.aclose()
+                        data_listener = (await anyio.create_tcp_listener(local_host="127.0.0.1")).listeners[0]
+                        port = data_listener.extra(anyio.abc.SocketAttribute.local_port)
+                        await reply(f"227 Entering Passive Mode (127,0,0,1,{port >> 8},{port & 0xff})")
+                    elif verb == "RETR":
+                        path = self._resolve(cwd, arg)
+                        if path not in self.files:
+                            await reply("550 no such file")
+                            continue
+                        await reply("150 sending")
+                        async with await data_connection() as data_stream:
+                            await data_stream.send(self.files[path])
+                        await reply("226 transfer complete")
+                    elif verb == "STOR":
+                        path = self._resolve(cwd, arg)
+                        await reply("150 receiving")
+                        received = bytearray()
+                        async with await data_connection() as data_stream:
+                            async for chunk in data_stream:
+                                received += chunk
+                        self.files[path] = bytes(received)
+                        self._add_parents(path)
+                        await reply("226 transfer complete")
+                    elif verb == "QUIT":
+                        await reply("221 bye")
+                        return
+                    else:
+                        await reply("502 not implemented")
@@ -0,0 +1,110 @@
+import enum
+from . import connection_pool
+# controller error codes, the first value of an error reply. defined in framing
+# next to MyException, where the transport modules reach them without importing the pool
+from .framing import (ERR_STRING_TOO_LONG, ERR_UNKNOWN_COMMAND, ERR_WRONG_FORMAT,
+                      ERR_WRONG_PARAMETERS_NUMBER, ERR_OUT_OF_RANGE, ERR_POSITIONER_NAME,
+                      ERR_GROUP_NAME, ERR_NOT_ALLOWED, ERR_MOVE_ABORTED)
+
+# functions turning a code into text: FunctionName(code,char *)
+GROUP_STATUS_STRING = "GroupStatusStringGet"
+HARDWARE_STATUS_STRING = "PositionerHardwareStatusStringGet"
+POSITIONER_ERROR_STRING = "PositionerErrorStringGet"
+ERROR_STRING = "ErrorStringGet"
+
+
+class HardwareStatus(enum.IntFlag):
+    """bits of PositionerHardwareStatusGet"""
+    GENERAL_INHIBITION = 0x00000001
+    ZM_HIGH_LEVEL = 0x00000004
+    MINUS_END_OF_RUN = 0x00000100
+    PLUS_END_OF_RUN = 0x00000200
+    MINUS_END_OF_RUN_GLITCH = 0x00000400
+    PLUS_END_OF_RUN_GLITCH = 0x00000800
+    ENCODER_QUADRATURE_ERROR = 0x00001000
+    ENCODER_FREQUENCY_ERROR = 0x00002000
+    HARD_INTERPOLATOR_ENCODER_ERROR = 0x00100000
+    HARD_INTERPOLATOR_QUADRATURE_ERROR = 0x00200000
+
+
+class PositionerError(enum.IntFlag):
+    """bits of PositionerErrorGet"""
+    FATAL_FOLLOWING_ERROR = 0x00000001
+    HOME_SEARCH_TIMEOUT = 0x00000002
+    MOTION_DONE_TIMEOUT = 0x00000004
+    TRAVEL_LIMITS_EXCEEDED = 0x00000008
+    MAX_VELOCITY_EXCEEDED = 0x00000010
+    MAX_ACCELERATION_EXCEEDED = 0x00000020
+    MINUS_END_OF_RUN = 0x00000100
+    PLUS_END_OF_RUN = 0x00000200
+    MINUS_END_OF_RUN_GLITCH = 0x00000400
+    PLUS_END_OF_RUN_GLITCH = 0x00000800
+    ENCODER_QUADRATURE_ERROR = 0x00001000
+    ENCODER_FREQUENCY_ERROR = 0x00002000
+
+
+def active_flags(flags: enum.IntFlag) -> list:
+    """the named bits set in flags, bits without a name are left in flags.value"""
+    return [flag for flag in type(flags) if flag in flags]
+
+
+def decode_hardware_status(code: int) -> list:
+    return active_flags(HardwareStatus(int(code)))
+
+
+def decode_positioner_error(code: int) -> list:
+    return active_flags(PositionerError(int(code)))
+
+
+def reply_text(reply) -> str:
+    """texts containing commas come back from send_recv split into a list"""
+    if isinstance(reply, str):
+        return reply
+    return ",".join(reply)
+
+
+class StatusStringCache:
+    """code -> text for the *StringGet functions
+
+    the texts are fixed for a firmware version, so each one only has to be
+    asked for once. filled lazily, or in one pipelined batch with preload
+    """
+
+    def __init__(self) -> None:
+        self._strings = {}
+
+    async def lookup(self, pool: connection_pool.ConnectionPool, function: str, code: int) -> str:
+        key = (function, int(code))
+        if key not in self._strings:
+            self._strings[key] = reply_text(await pool.send_recv(f"{function}({int(code)},char *)"))
+        return self._strings[key]
+
+    async def preload(self, pool: connection_pool.ConnectionPool, function: str, codes) -> None:
+        missing = [int(code) for code in codes if (function, int(code)) not in self._strings]
+        if not missing:
+            return
+        replies = await pool.send_recv_many([f"{function}({code},char *)" for code in missing])
+        for code, reply in zip(missing, replies):
+            self._strings[(function, code)] = reply_text(reply)
+
+    async def group_status_string(self, pool: connection_pool.ConnectionPool, code: int) -> str:
+        return await self.lookup(pool, GROUP_STATUS_STRING, code)
+
+    async def hardware_status_string(self, pool: connection_pool.ConnectionPool, code: int) -> str:
+        return await self.lookup(pool, HARDWARE_STATUS_STRING, code)
+
+    async def positioner_error_string(self, pool: connection_pool.ConnectionPool, code: int) -> str:
+        return await self.lookup(pool, POSITIONER_ERROR_STRING, code)
+
+    async def error_string(self, pool: connection_pool.ConnectionPool, code: int) -> str:
+        return await self.lookup(pool, ERROR_STRING, code)
+
+
+_caches = {}
+
+
+def cache_for(firmware_version: str = None) -> StatusStringCache:
+    """one shared cache per firmware version"""
+    if firmware_version not in _caches:
+        _caches[firmware_version] = StatusStringCache()
+    return _caches[firmware_version]
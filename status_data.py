@@ -0,0 +1,73 @@
+import time
+from . import status_codes
+
+
+class PositionerStatus:
+    """hardware status and errors of one positioner"""
+
+    def __init__(self, name: str, stage_type: str, hardware_status_code: int, hardware_status: str,
+                 positioner_error_code: int, positioner_errors: str) -> None:
+        self.name = name
+        self.stage_type = stage_type
+        self.hardware_status_code = hardware_status_code
+        self.hardware_status = hardware_status
+        self.positioner_error_code = positioner_error_code
+        self.positioner_errors = positioner_errors
+
+    @property
+    def hardware_flags(self) -> list:
+        return status_codes.decode_hardware_status(self.hardware_status_code)
+
+    @property
+    def error_flags(self) -> list:
+        return status_codes.decode_positioner_error(self.positioner_error_code)
+
+    def to_text(self) -> str:
+        out = [f"   {self.name} {self.stage_type}",
+               f"      Hardware Status: {self.hardware_status}",
+               f"      Positioner Errors: {self.positioner_errors}"]
+        return "\n".join(out)
+
+
+class GroupStatus:
+    """group status code and the status of its positioners"""
+
+    def __init__(self, name: str, group_type: str, status_code: int, positioners: list) -> None:
+        self.name = name
+        self.type = group_type
+        self.status_code = status_code
+        self.positioners = positioners
+
+    def to_text(self) -> str:
+        out = [f"{self.name} ({self.type}), Status: {self.status_code}"]
+        out += [pos.to_text() for pos in self.positioners]
+        return "\n".join(out)
+
+
+class StatusReport:
+    """everything status_report prints, as data"""
+
+    def __init__(self, host: str, fqdn: str, firmware_version: str,
+                 boot_time: float, groups: list) -> None:
+        self.host = host
+        self.fqdn = fqdn
+        self.firmware_version = firmware_version
+        self.current_time = time.time()
+        self.boot_time = boot_time
+        self.groups = groups
+
+    def header_lines(self) -> list:
+        return ["# XPS host:         %s (%s)" % (self.host, self.fqdn),
+                "# Firmware:         %s" % self.firmware_version,
+                "# Current Time:     %s" % time.ctime(self.current_time),
+                "# Last Reboot:      %s" % time.ctime(self.boot_time),
+                ]
+
+    def to_text(self) -> str:
+        out = self.header_lines()
+        out.append("# Groups and Stages")
+        out += [group.to_text() for group in self.groups]
+        return "\n".join(out)
+
+    def __str__(self) -> str:
+        return self.to_text()
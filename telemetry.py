@@ -0,0 +1,94 @@
+import time
+import anyio
+from contextlib import asynccontextmanager
+from . import connection_pool
+from . import trio_socket
+
+
+class TelemetrySnapshot:
+    """positions, velocities and status codes of every group at one poll"""
+
+    def __init__(self, timestamp: float, positions: dict, velocities: dict, statuses: dict) -> None:
+        self.timestamp = timestamp
+        self.positions = positions
+        self.velocities = velocities
+        self.statuses = statuses
+
+
+class TelemetryService:
+    """one task polls every group, any number of subscribers receive the results
+
+    controller load depends only on the poll rate, not on how many clients
+    subscribe. a subscriber that falls behind only ever sees the latest snapshot
+    """
+
+    def __init__(self, groups: list, pool: connection_pool.ConnectionPool, rate: float = 10.0) -> None:
+        self.groups = groups
+        self.pool = pool
+        self.period = 1.0 / rate
+        self.latest = None
+        self.last_error = None
+        self._subscribers = []
+
+    async def run(self, task_status=anyio.TASK_STATUS_IGNORED) -> None:
+        task_status.started()
+        next_poll = anyio.current_time()
+        while True:
+            try:
+                self._publish(await self.poll())
+            except trio_socket.MyException as err:
+                self.last_error = err
+            next_poll += self.period
+            # a slow poll must not queue up extra ones behind it
+            next_poll = max(next_poll, anyio.current_time())
+            await anyio.sleep_until(next_poll)
+
+    # GroupPositionCurrentGet, GroupVelocityCurrentGet, GroupStatusGet for all groups in one pipelined batch
+    async def poll(self) -> TelemetrySnapshot:
+        commands = []
+        for group in self.groups:
+            commands += [group.vector_command("GroupPositionCurrentGet"),
+                         group.vector_command("GroupVelocityCurrentGet"),
+                         f"GroupStatusGet({group.name},int *)"]
+        # undivided replies: values are decoded straight from the reply text
+        replies = await self.pool.send_recv_raw_many(commands)
+
+        # positions and velocities are floats, or arrays for multi-axis groups
+        positions, velocities, statuses = {}, {}, {}
+        for i, group in enumerate(self.groups):
+            position, velocity, status = replies[3 * i:3 * i + 3]
+            positions[group.name] = group.parse_vector(position)
+            velocities[group.name] = group.parse_vector(velocity)
+            statuses[group.name] = int(status)
+        return TelemetrySnapshot(time.time(), positions, velocities, statuses)
+
+    @asynccontextmanager
+    async def subscribe(self):
+        """yields a receive channel of snapshots, only the newest unread one is kept"""
+        send_channel, receive_channel = anyio.create_memory_object_stream(1)
+        subscriber = (send_channel, receive_channel)
+        self._subscribers.append(subscriber)
+        try:
+            if self.latest is not None:
+                send_channel.send_nowait(self.latest)
+            yield receive_channel
+        finally:
+            # _publish drops subscribers whose channel was closed under it
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+            await send_channel.aclose()
+
+    def _publish(self, snapshot: TelemetrySnapshot) -> None:
+        self.latest = snapshot
+        for subscriber in list(self._subscribers):
+            send_channel, receive_channel = subscriber
+            try:
+                try:
+                    send_channel.send_nowait(snapshot)
+                except anyio.WouldBlock:
+                    # the unread snapshot is stale: replace it
+                    receive_channel.receive_nowait()
+                    send_channel.send_nowait(snapshot)
+            except (anyio.BrokenResourceError, anyio.ClosedResourceError):
+                # one closed subscriber must not stop the others or the poll loop
+                self._subscribers.remove(subscriber)
@@ -0,0 +1,29 @@
+import anyio
+import pytest
+
+
+def _trio_usable() -> bool:
+    """trio is installed and recent enough for the installed anyio"""
+    try:
+        import trio  # noqa: F401
+    except ImportError:
+        return False
+
+    async def cancel():
+        with anyio.CancelScope() as scope:
+            scope.cancel()
+
+    try:
+        anyio.run(cancel, backend="trio")
+    except Exception:
+        return False
+    return True
+
+
+@pytest.fixture(params=[
+    "asyncio",
+    pytest.param("trio", marks=pytest.mark.skipif(not _trio_usable(),
+                                                  reason="trio missing or too old for anyio")),
+])
+def anyio_backend(request):
+    return request.param
@@ -0,0 +1,73 @@
+"""move durations and batch limit checks of the planner"""
+import pytest
+from .. import motion_group
+from .. import motion_planner
+from .. import simulator
+
+np = pytest.importorskip("numpy")
+
+
+def _group(name="XY", axes=("X", "Y"), max_velocity=20.0, max_accel=80.0, travel=(-100.0, 100.0)):
+    group = motion_group.XpsMotionGroup(name)
+    group.positioners = []
+    for axis in axes:
+        pos = motion_group.XpsPositioner(f"{name}.{axis}", "STAGE", "1")
+        pos.max_velocity, pos.max_accel = max_velocity, max_accel
+        pos.min_position, pos.max_position = travel
+        group.positioners.append(pos)
+    return group
+
+
+@pytest.mark.parametrize("distance", [0.5, 5.0, 50.0])
+def test_move_time_matches_the_simulated_profile(distance):
+    # 5.0 = v^2/a: the profile just reaches full velocity
+    planner = motion_planner.MotionPlanner(_group(axes=("X",)))
+    expected = simulator.TrapezoidalMove(0.0, distance, 20.0, 80.0, 0.0).duration
+    assert planner.move_time(0.0, distance) == pytest.approx(expected)
+    assert planner.move_time(distance, 0.0) == pytest.approx(expected)
+
+
+def test_group_moves_take_as_long_as_the_slowest_axis():
+    planner = motion_planner.MotionPlanner(_group(), velocity=[10.0, 20.0], jerk_time=0.1)
+    times = planner.axis_times([0.0, 0.0], [[10.0, 10.0], [10.0, -30.0], [10.0, -30.0]])
+    # X: 10/10 + 10/80 and the jerk time, Y: 10/20 + 20/80; no move, no time
+    assert times[0] == pytest.approx([1.225, 0.85])
+    assert times[1] == pytest.approx([0.0, 2.35])
+    assert times[2] == pytest.approx([0.0, 0.0])
+    assert planner.move_times([0.0, 0.0], [[10.0, 10.0], [10.0, -30.0]]) == pytest.approx([1.225, 2.35])
+
+
+def test_move_parameters_beyond_the_maximum_are_refused():
+    with pytest.raises(ValueError):
+        motion_planner.MotionPlanner(_group(), velocity=25.0)
+    with pytest.raises(ValueError):
+        motion_planner.MotionPlanner(_group(), accel=0.0)
+
+
+def test_batch_limit_checks():
+    planner = motion_planner.MotionPlanner(_group(travel=(-10.0, 10.0)))
+    targets = np.zeros((1000, 2))
+    targets[[3, 500], 0] = [11.0, 12.0]
+    targets[7, 1] = -20.0
+    assert planner.check_limits(targets) == [
+        "XY.Y: 1 targets below -10, first -20 at move 7",
+        "XY.X: 2 targets above 10, first 11 at move 3",
+    ]
+    assert planner.check_limits(targets[:3]) == []
+    with pytest.raises(ValueError):
+        planner.verify_limits(targets)
+    with pytest.raises(ValueError):
+        planner.check_limits([[0.0, 0.0, 0.0]])
+
+
+@pytest.mark.anyio
+async def test_wait_for_move_polls_through_every_moving_state(monkeypatch):
+    group = _group()
+    statuses = iter([43, 44, 45, 47, 51, 12])
+
+    async def get_status(pool):
+        return next(statuses)
+
+    monkeypatch.setattr(group, "get_status", get_status)
+    planner = motion_planner.MotionPlanner(group)
+    assert await planner.wait_for_move(None, 0.0, poll_interval=0.0) == 12
@@ -0,0 +1,48 @@
+"""the selector client against two simulated controllers, each in a thread of its own"""
+import pytest
+from .. import framing
+from .. import instrumentation
+from .. import selector_client
+from .. import simulator
+from .. import status_codes
+
+
+@pytest.fixture
+def sims():
+    servers = [simulator.XpsSimulator(n_groups=1).start_in_thread() for _ in range(2)]
+    yield servers
+    for server in servers:
+        server.stop_thread()
+
+
+def test_batches_to_several_controllers(sims):
+    instruments = instrumentation.Instrumentation("sim")
+    with selector_client.SelectorClient(timeout=2.0) as client:
+        for name, sim in zip(("a", "b"), sims):
+            client.add(name, sim.host, sim.port, instruments)
+        replies = client.send_recv_many({"a": ["FirmwareVersionGet(char *)"] * 3,
+                                         "b": ["GroupStatusGet(G1,int *)", "ElapsedTimeGet(double *)"]})
+        assert replies["a"] == [sims[0].firmware_version] * 3
+        assert len(replies["b"]) == 2
+        assert client.send_recv_raw_many({"b": ["GroupPositionCurrentGet(G1,double *)"]}) == {"b": ["0.0"]}
+    assert instruments.commands["FirmwareVersionGet"].count == 3
+
+
+def test_error_reply_carries_the_code(sims):
+    with selector_client.SelectorClient(timeout=2.0) as client:
+        client.add("a", sims[0].host, sims[0].port)
+        with pytest.raises(framing.MyException) as failure:
+            client.send_recv("a", "GroupStatusGet(G9,int *)")
+        assert failure.value.code == status_codes.ERR_GROUP_NAME
+        # the connection is still in step after an error reply
+        assert client.send_recv("a", "FirmwareVersionGet(char *)") == sims[0].firmware_version
+
+
+def test_unreachable_controller(sims):
+    sim = sims[0]
+    with selector_client.SelectorClient(timeout=2.0) as client:
+        client.add("a", sim.host, sim.port)
+        client.add("gone", sim.host, sim.ftp_port + 1000)
+        with pytest.raises((framing.ConnectionLost, framing.XpsTimeout)):
+            client.send_recv_many({"a": ["FirmwareVersionGet(char *)"], "gone": ["FirmwareVersionGet(char *)"]})
+        assert client.send_recv("a", "FirmwareVersionGet(char *)") == sim.firmware_version
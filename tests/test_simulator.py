@@ -0,0 +1,234 @@
+"""the library against the local controller simulator
+
+    cd <parent of the package> && python -m pytest <package>/tests
+"""
+import anyio
+import pytest
+from .. import connection_pool
+from .. import fleet
+from .. import instrumentation
+from .. import motion_group
+from .. import newport_xps
+from .. import setpoint_stream
+from .. import simulator
+from .. import status_codes
+from .. import telemetry
+from .. import topology_cache
+from .. import trio_socket
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_blocking_move_outlasts_the_pool_timeout():
+    # GroupMoveAbsolute is only answered when the move ends, here after about 1 s
+    async with simulator.XpsSimulator(n_groups=1, max_velocity=2.0) as sim:
+        async with connection_pool.ConnectionPool(sim.host, sim.port, 2, timeout=0.3) as pool:
+            xps = await newport_xps.XpsFactory(ftp_port=sim.ftp_port).build(pool)
+            group = xps.get_group("G1")
+            await group.move_to(pool, 2.0)
+            assert await group.get_current_position(pool) == pytest.approx(2.0)
+            await group.move_by(pool, -2.0)
+            assert await group.get_status(pool) == simulator.READY_FROM_MOTION
+            assert await group.get_current_position(pool) == pytest.approx(0.0)
+            await xps.aclose()
+
+
+async def test_read_and_clear_command_is_not_resent():
+    async with simulator.XpsSimulator(n_groups=1) as sim:
+        async with connection_pool.ConnectionPool(sim.host, sim.port, 1) as pool:
+            xps = await newport_xps.XpsFactory(ftp_port=sim.ftp_port).build(pool)
+            positioner = xps.get_group("G1").positioner
+            sim.positioners["G1.Pos"].error_code = 4
+
+            # the status batch only reads the error code: re-sent after the drop
+            sim.drop_reply("PositionerErrorRead")
+            report = await xps.collect_status(pool)
+            assert report.groups[0].positioners[0].positioner_error_code == 4
+
+            # reading clears it: sent twice the error would be lost, so the drop is reported
+            sim.drop_reply("PositionerErrorGet")
+            with pytest.raises(trio_socket.ConnectionLost):
+                await positioner.positioner_error_code_get(pool)
+            assert sim.positioners["G1.Pos"].error_code == 0
+            await xps.aclose()
+
+
+async def test_pipelined_callers_survive_cancellation():
+    # commands are worked through one after the other: the last batch is answered after about 0.3 s
+    async with simulator.XpsSimulator(n_groups=1, command_time=0.005) as sim:
+        async with trio_socket.AsyncSocket(sim.host, sim.port) as sock:
+            replies = {}
+
+            async def call(code, cancel_after):
+                with anyio.move_on_after(cancel_after):
+                    replies[code] = await sock.send_recv_many(
+                        [f"GroupStatusStringGet({code},char *)", f"GroupStatusStringGet({code + 1000},char *)"])
+
+            async with anyio.create_task_group() as task_group:
+                for code in range(100, 130):
+                    # every third caller gives up, most while their replies are still on the way
+                    task_group.start_soon(call, code, 0.05 if code % 3 == 0 else 10)
+
+            cancelled = set(range(100, 130)) - set(replies)
+            assert cancelled and all(code % 3 == 0 for code in cancelled)
+            for code, pair in replies.items():
+                assert pair == [f"Status {code}", f"Status {code + 1000}"]
+            assert await sock.send_recv("GroupStatusStringGet(7,char *)") == simulator.GROUP_STATUS_STRINGS[7]
+
+
+async def test_timeout_then_reconnect():
+    instruments = instrumentation.Instrumentation("sim")
+    async with simulator.XpsSimulator(n_groups=1, latency=0.5) as sim:
+        async with trio_socket.AsyncSocket(sim.host, sim.port, instruments, timeout=0.1) as sock:
+            with pytest.raises(trio_socket.XpsTimeout):
+                await sock.send_recv("GroupStatusGet(G1,int *)")
+            sim.latency = 0.0
+            assert await sock.send_recv("GroupStatusGet(G1,int *)") == str(simulator.READY_FROM_HOMING)
+    assert (instruments.timeouts, instruments.reconnects) == (1, 1)
+
+
+async def test_dropped_connection_retries_reads_only():
+    instruments = instrumentation.Instrumentation("sim")
+    async with simulator.XpsSimulator(n_groups=1) as sim:
+        async with trio_socket.AsyncSocket(sim.host, sim.port, instruments) as sock:
+            sim.drop_reply("GroupStatusGet")
+            assert await sock.send_recv("GroupStatusGet(G1,int *)") == str(simulator.READY_FROM_HOMING)
+
+            sim.drop_reply("PositionerSGammaParametersSet")
+            with pytest.raises(trio_socket.ConnectionLost):
+                await sock.send_recv("PositionerSGammaParametersSet(G1.Pos,10,40,0.01,0.02)")
+            # it did run: only the reply was lost
+            assert sim.positioners["G1.Pos"].move_velocity == 10
+            assert await sock.send_recv("GroupStatusGet(G1,int *)") == str(simulator.READY_FROM_HOMING)
+    assert instruments.reconnects == 2
+
+
+async def test_factory_build_cold_and_warm(tmp_path):
+    cache = topology_cache.TopologyCache(str(tmp_path))
+    async with simulator.XpsSimulator(groups={"G1": ["Pos"], "XY": ["X", "Y"]}) as sim:
+        async with connection_pool.ConnectionPool(sim.host, sim.port, 2) as pool:
+            factory = newport_xps.XpsFactory(cache, ftp_port=sim.ftp_port)
+            n_commands = sim.n_commands
+            cold = await factory.build(pool)
+            cold_commands = sim.n_commands - n_commands
+            await cold.aclose()
+
+            # limits can change without a reboot: the warm build re-reads them
+            sim.positioners["XY.Y"].max_position = 50.0
+            n_commands = sim.n_commands
+            warm = await factory.build(pool)
+            assert sim.n_commands - n_commands < cold_commands
+            await warm.aclose()
+
+    assert [group.name for group in warm.groups] == [group.name for group in cold.groups] == ["G1", "XY"]
+    assert [pos.name for pos in warm.get_group("XY").positioners] == ["XY.X", "XY.Y"]
+    assert warm.get_group("XY").positioners[1].max_position == 50.0
+    assert warm.get_group("XY").positioners[0].max_velocity == cold.get_group("XY").positioners[0].max_velocity
+
+
+async def test_streams_use_the_command_port_and_instrumentation_of_the_build():
+    async with simulator.XpsSimulator(n_groups=1) as sim:
+        instruments = instrumentation.Instrumentation("sim")
+        async with connection_pool.ConnectionPool(sim.host, sim.port, 1, instruments) as pool:
+            xps = await newport_xps.XpsFactory(ftp_port=sim.ftp_port).build(pool)
+            assert xps.port_number == sim.port
+            async with xps.retarget_stream("G1") as stream:
+                stream.set(1.0)
+                await anyio.sleep(0.5)
+            assert stream.error is None
+            # the move went over the stream's own connection, counted with the pool's commands
+            assert instruments.commands["GroupMoveAbsolute"].count == 1
+            assert await xps.get_group("G1").get_current_position(pool) == pytest.approx(1.0)
+            await xps.aclose()
+
+
+async def test_stream_that_fails_to_start_sends_nothing_more():
+    async with simulator.XpsSimulator(n_groups=1) as sim:
+        group = motion_group.XpsMotionGroup("G9")
+        group.positioners = [motion_group.XpsPositioner("G9.X", "STAGE", "1")]
+        group.positioners[0].max_accel = 80.0
+        instruments = instrumentation.Instrumentation("sim")
+        with pytest.raises(trio_socket.MyException) as failure:
+            async with setpoint_stream.JogStream(sim.host, group, sim.port, instrumentation=instruments):
+                pass
+        assert failure.value.code == status_codes.ERR_GROUP_NAME
+        # jog mode was never entered, so there was nothing to ramp down or leave
+        assert list(instruments.commands) == ["GroupJogModeEnable"]
+
+        group.positioners[0].max_accel = None
+        with pytest.raises(ValueError):
+            setpoint_stream.JogStream(sim.host, group, sim.port)
+
+
+async def test_retarget_without_travel_limits():
+    async with simulator.XpsSimulator(n_groups=1) as sim:
+        async with connection_pool.ConnectionPool(sim.host, sim.port, 1) as pool:
+            xps = await newport_xps.XpsFactory(ftp_port=sim.ftp_port).build(pool)
+            group = xps.get_group("G1")
+            group.positioners[0].min_position = group.positioners[0].max_position = None
+            async with xps.retarget_stream("G1") as stream:
+                stream.set(1.0)
+                await anyio.sleep(0.3)
+            assert stream.error is None
+            assert await group.get_current_position(pool) == pytest.approx(1.0)
+            await xps.aclose()
+
+
+async def test_stop_all_reports_an_unreachable_controller():
+    # b runs in a thread of its own, so it can be taken down while the fleet is connected
+    unreachable = simulator.XpsSimulator(n_groups=1).start_in_thread()
+    try:
+        async with simulator.XpsSimulator(n_groups=1) as sim:
+            sims = {"a": sim, "b": unreachable}
+            controllers = [fleet.FleetController(server.host, server.port, name=name,
+                                                 factory=newport_xps.XpsFactory(ftp_port=server.ftp_port))
+                           for name, server in sims.items()]
+            async with fleet.XpsFleet(controllers) as xps_fleet:
+                move = xps_fleet.start_move_to("a/G1", 50.0)
+                await anyio.sleep(0.2)
+                unreachable.stop_thread()
+                unreachable = None
+
+                with pytest.raises(fleet.StopIncomplete) as failure:
+                    await xps_fleet.stop_all()
+                assert failure.value.stopped == ["a/G1"]
+                assert list(failure.value.errors) == ["b/G1"]
+                assert isinstance(failure.value.errors["b/G1"], trio_socket.ConnectionLost)
+                with pytest.raises(trio_socket.MyException) as aborted:
+                    await move.wait()
+                assert aborted.value.code == status_codes.ERR_MOVE_ABORTED
+                # the motion channel counts into the controller's instrumentation
+                moves = controllers[0].instrumentation.commands["GroupMoveAbsolute"]
+                assert moves.errors == {status_codes.ERR_MOVE_ABORTED: 1}
+    finally:
+        if unreachable is not None:
+            unreachable.stop_thread()
+
+
+async def test_discovery_errors_are_kept_per_positioner():
+    async with simulator.XpsSimulator(groups={"XY": ["X", "Y"]}) as sim:
+        # still in system.ini, gone from the controller
+        del sim.positioners["XY.X"], sim.positioners["XY.Y"]
+        async with connection_pool.ConnectionPool(sim.host, sim.port, 2) as pool:
+            xps = await newport_xps.XpsFactory(ftp_port=sim.ftp_port).build(pool)
+            assert sorted(xps.discovery_errors) == ["XY.X", "XY.Y"]
+            assert all(err.code == status_codes.ERR_POSITIONER_NAME for err in xps.discovery_errors.values())
+            await xps.aclose()
+
+
+async def test_telemetry_drops_a_closed_subscriber():
+    async with simulator.XpsSimulator(n_groups=1) as sim:
+        async with connection_pool.ConnectionPool(sim.host, sim.port, 2) as pool:
+            xps = await newport_xps.XpsFactory(ftp_port=sim.ftp_port).build(pool)
+            service = telemetry.TelemetryService(xps.groups, pool, rate=50.0)
+            async with anyio.create_task_group() as tg:
+                await tg.start(service.run)
+                async with service.subscribe() as closed, service.subscribe() as snapshots:
+                    await closed.aclose()
+                    for _ in range(3):
+                        snapshot = await snapshots.receive()
+                    assert "G1" in snapshot.positions
+                    assert len(service._subscribers) == 1
+                assert service._subscribers == []
+                tg.cancel_scope.cancel()
+            await xps.aclose()
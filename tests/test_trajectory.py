@@ -0,0 +1,83 @@
+"""PVT segment maths, checked against the cubics sampled densely"""
+import pytest
+from .. import motion_group
+from .. import trajectory
+
+np = pytest.importorskip("numpy")
+
+
+def _positioner(name, min_position=None, max_position=None):
+    pos = motion_group.XpsPositioner(name, "STAGE", "1")
+    pos.min_position, pos.max_position = min_position, max_position
+    return pos
+
+
+def _sampled(traj, n=2001):
+    """position, velocity and acceleration of every segment at n points"""
+    t = np.linspace(0.0, 1.0, n)[:, np.newaxis, np.newaxis] * traj.durations[:, np.newaxis]
+    p0, v0 = traj.positions[:-1], traj.velocities[:-1]
+    c2, c3 = traj._c2, traj._c3
+    position = p0 + v0 * t + c2 * t ** 2 + c3 * t ** 3
+    velocity = v0 + 2 * c2 * t + 3 * c3 * t ** 2
+    acceleration = 2 * c2 + 6 * c3 * t
+    return position, velocity, acceleration
+
+
+def _random_trajectory(seed):
+    rng = np.random.default_rng(seed)
+    times = np.cumsum(rng.uniform(0.1, 1.0, 8))
+    positions = rng.uniform(-5.0, 5.0, (8, 2))
+    velocities = rng.uniform(-10.0, 10.0, (8, 2))
+    return trajectory.PvtTrajectory([_positioner("G.X"), _positioner("G.Y")], times, positions, velocities)
+
+
+def test_cubics_meet_the_points():
+    traj = _random_trajectory(0)
+    position, velocity, _ = _sampled(traj)
+    assert np.allclose(position[0], traj.positions[:-1])
+    assert np.allclose(position[-1], traj.positions[1:])
+    assert np.allclose(velocity[0], traj.velocities[:-1])
+    assert np.allclose(velocity[-1], traj.velocities[1:])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_peaks_and_range_match_sampling(seed):
+    traj = _random_trajectory(seed)
+    position, velocity, acceleration = _sampled(traj)
+    assert np.allclose(traj.peak_velocities(), np.abs(velocity).max(axis=0), rtol=1e-5)
+    assert np.allclose(traj.peak_accelerations(), np.abs(acceleration).max(axis=0))
+    lowest, highest = traj.position_range()
+    assert np.allclose(lowest, position.min(axis=(0, 1)), atol=1e-6)
+    assert np.allclose(highest, position.max(axis=(0, 1)), atol=1e-6)
+
+
+def test_overshoot_of_a_pure_quadratic():
+    # equal and opposite end velocities, no displacement: c3 == 0 and the
+    # segment turns round at t = 0.5, reaching -0.25
+    traj = trajectory.PvtTrajectory([_positioner("G.X", min_position=-0.1)],
+                                    [0.0, 1.0], [0.0, 0.0], [-1.0, 1.0])
+    assert traj._c3[0, 0] == 0.0
+    lowest, highest = traj.position_range()
+    assert lowest[0] == pytest.approx(-0.25)
+    assert highest[0] == pytest.approx(0.0)
+    assert traj.check_limits() == ["G.X: position -0.25 < -0.1"]
+    with pytest.raises(ValueError):
+        traj.verify_limits()
+
+
+def test_to_bytes_writes_one_line_per_segment():
+    traj = trajectory.PvtTrajectory([_positioner("G.X"), _positioner("G.Y")],
+                                    [0.0, 0.5, 1.5], [[0.0, 1.0], [1.0, 1.0], [3.0, 0.0]],
+                                    [[0.0, 0.0], [1.5, -1.0], [0.0, 0.0]])
+    lines = traj.to_bytes().decode().splitlines()
+    assert lines == ["0.500000, 1.000000, 1.500000, 0.000000, -1.000000",
+                     "1.000000, 2.000000, 0.000000, -1.000000, 0.000000"]
+
+
+def test_bad_points_are_refused():
+    with pytest.raises(ValueError):
+        trajectory.PvtTrajectory([_positioner("G.X")], [0.0, 0.0], [0.0, 1.0])
+    with pytest.raises(ValueError):
+        trajectory.PvtTrajectory([_positioner("G.X")], [0.0], [0.0])
+    with pytest.raises(ValueError):
+        trajectory.PvtTrajectory([_positioner("G.X")], [0.0, 1.0], [[0.0, 1.0], [1.0, 2.0]])
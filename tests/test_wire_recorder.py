@@ -0,0 +1,64 @@
+"""a session recorded against the simulator, then served back by the replay server"""
+import anyio
+import pytest
+from .. import connection_pool
+from .. import newport_xps
+from .. import simulator
+from .. import status_codes
+from .. import trio_socket
+from .. import wire_recorder
+from .. import xps_socket
+
+pytestmark = pytest.mark.anyio
+
+
+async def _record(filename) -> tuple:
+    with wire_recorder.WireRecorder(str(filename)) as recorder:
+        async with simulator.XpsSimulator(n_groups=1) as sim:
+            async with connection_pool.ConnectionPool(sim.host, sim.port, 2, recorder=recorder) as pool:
+                xps = await newport_xps.XpsFactory(ftp_port=sim.ftp_port).build(pool)
+                group = xps.get_group("G1")
+                # the move runs on a stream connection of its own, recorded like the pool's
+                async with xps.retarget_stream("G1") as stream:
+                    stream.set(2.0)
+                    await anyio.sleep(0.5)
+                positions = [await group.get_current_position(pool) for _ in range(2)]
+                await xps.aclose()
+    return sim.firmware_version, positions
+
+
+async def test_recorded_session_replays(tmp_path):
+    filename = tmp_path / "session.xpsrec"
+    firmware_version, positions = await _record(filename)
+    records = list(wire_recorder.read_records(str(filename)))
+    kinds = [kind for kind, *_ in records]
+    assert kinds.count(wire_recorder.OPEN) == kinds.count(wire_recorder.CLOSE) >= 3
+    assert "GroupMoveAbsolute(G1,2.0)" in wire_recorder.reply_table(records)
+
+    async with wire_recorder.ReplayServer(records=records, speed=None) as server:
+        async with trio_socket.AsyncSocket(server.host, server.port) as sock:
+            assert await sock.send_recv("FirmwareVersionGet(char *)") == firmware_version
+            # polling outlasting the recording gets the last reply again
+            replies = [float(await sock.send_recv("GroupPositionCurrentGet(G1,double *)")) for _ in range(3)]
+            assert replies == positions + positions[-1:]
+            assert server.mismatches == 0
+
+            with pytest.raises(trio_socket.MyException) as failure:
+                await sock.send_recv("GroupKill(G1)")
+            assert failure.value.code == status_codes.ERR_UNKNOWN_COMMAND
+            assert server.mismatches == 1
+            # a mismatch does not put the connection out of step
+            assert await sock.send_recv("FirmwareVersionGet(char *)") == firmware_version
+        assert server.n_commands == 6
+
+
+def test_replay_in_a_thread_for_sync_clients():
+    records = [(wire_recorder.SESSION, 0.0, (0, 0), ""),
+               (wire_recorder.COMMAND, 1.0, (0, 0), "ElapsedTimeGet(double *)"),
+               (wire_recorder.REPLY, 1.5, (0, 0), "0,12.5")]
+    server = wire_recorder.ReplayServer(records=records, speed=100.0).start_in_thread()
+    try:
+        sock = xps_socket.XpsSocket(server.host, server.port)
+        assert sock.send_recv("ElapsedTimeGet(double *)") == "12.5"
+    finally:
+        server.stop_thread()
@@ -0,0 +1,74 @@
+"""command building and reply decoding of the API registry"""
+import pytest
+from .. import connection_pool
+from .. import simulator
+from .. import xps_api
+from ..numpy_support import HAS_NUMPY
+
+
+def test_signatures_round_trip():
+    for name, api_function in xps_api.FUNCTIONS.items():
+        assert xps_api.parse_signatures(api_function.signature)[name].signature == api_function.signature
+
+
+def test_unknown_function():
+    with pytest.raises(ValueError):
+        xps_api.function("GroupFly")
+
+
+def test_commands():
+    assert xps_api.function("FirmwareVersionGet").command() == "FirmwareVersionGet(char *)"
+    assert xps_api.function("GroupKill").command("G1") == "GroupKill(G1)"
+    assert xps_api.function("GroupMoveAbsolute").command("XY", 1, 2.5) == "GroupMoveAbsolute(XY,1.0,2.5)"
+    assert xps_api.function("GPIODigitalSet").command("GPIO1.DO", 3.0, 1) == "GPIODigitalSet(GPIO1.DO,3,1)"
+    position = xps_api.function("GroupPositionCurrentGet")
+    assert position.command("XY", n_values=2) == "GroupPositionCurrentGet(XY,double *,double *)"
+    assert position.command("G1") == "GroupPositionCurrentGet(G1,double *)"
+    assert xps_api.function("PositionerMaximumVelocityAndAccelerationGet").command("G1.X") == \
+        "PositionerMaximumVelocityAndAccelerationGet(G1.X,double *,double *)"
+
+
+def test_wrong_number_of_arguments():
+    with pytest.raises(ValueError):
+        xps_api.function("GroupKill").command()
+    with pytest.raises(ValueError):
+        xps_api.function("GroupKill").command("G1", "G2")
+    with pytest.raises(ValueError):
+        xps_api.function("GroupMoveAbsolute").command()
+
+
+def test_decoding():
+    assert xps_api.function("GroupKill").decode("") is None
+    assert xps_api.function("GroupStatusGet").decode("12") == 12
+    assert xps_api.function("ElapsedTimeGet").decode("1.5") == 1.5
+    # a single string keeps its commas
+    assert xps_api.function("ObjectsListGet").decode("G1,G1.X;") == "G1,G1.X;"
+    assert xps_api.function("PositionerUserTravelLimitsGet").decode("-5,5") == (-5.0, 5.0)
+    assert xps_api.function("GatheringCurrentNumberGet").decode("3,100") == (3, 100)
+    assert xps_api.function("MultipleAxesPVTParametersGet").decode("a.trj,4") == ("a.trj", 4)
+    assert xps_api.function("PositionerBacklashGet").decode("0.1,Enable") == (0.1, "Enable")
+    assert xps_api.function("PositionerPositionCompareGet").decode("0,1,0.5,1") == (0.0, 1.0, 0.5, True)
+    assert xps_api.function("PositionerPositionCompareGet").decode("0,1,0.5,0")[3] is False
+    assert list(xps_api.function("GroupPositionCurrentGet").decode("1.5,-2")) == [1.5, -2.0]
+
+
+def test_vector_of_doubles_is_an_array():
+    decoded = xps_api.function("GroupVelocityCurrentGet").decode("1,2,3")
+    if HAS_NUMPY:
+        assert decoded.shape == (3,)
+    else:
+        assert decoded == (1.0, 2.0, 3.0)
+
+
+@pytest.mark.anyio
+async def test_async_api_against_the_simulator():
+    async with simulator.XpsSimulator(groups={"XY": ["X", "Y"]}) as sim:
+        async with connection_pool.ConnectionPool(sim.host, sim.port, 2, timeout=None) as pool:
+            api = xps_api.AsyncApi(pool)
+            assert await api.FirmwareVersionGet() == sim.firmware_version
+            assert await api.GroupMoveAbsolute("XY", 1.0, -2.0) is None
+            assert list(await api.GroupPositionCurrentGet("XY", n_values=2)) == [1.0, -2.0]
+            status, limits = await api.call_many([("GroupStatusGet", ("XY",)),
+                                                  ("PositionerUserTravelLimitsGet", ("XY.X",))])
+            assert isinstance(status, int)
+            assert limits == (-100.0, 100.0)
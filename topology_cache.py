@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+from . import motion_group
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "newport_xps")
+
+# the controller only re-reads system.ini at boot: if it has not rebooted the
+# topology cannot have changed. allows for clock jitter in time.time() - uptime
+BOOT_TIME_TOLERANCE = 5.0
+
+SNAPSHOT_VERSION = 1
+
+
+def ini_fingerprint(lines) -> str:
+    return hashlib.sha256("\n".join(lines).encode()).hexdigest()
+
+
+class TopologySnapshot:
+    """groups, positioners, stage types, plug numbers and limits found on one controller"""
+
+    def __init__(self, host: str, firmware_version: str, ini_fingerprint: str,
+                 boot_time: float, objects_list: str, groups: list) -> None:
+        self.host = host
+        self.firmware_version = firmware_version
+        self.ini_fingerprint = ini_fingerprint
+        self.boot_time = boot_time
+        self.objects_list = objects_list
+        self.groups = groups
+
+    @classmethod
+    def from_groups(cls, host: str, firmware_version: str, ini_fingerprint: str,
+                    boot_time: float, objects_list: str, groups: list):
+        group_dicts = []
+        for group in groups:
+            group_dicts.append({
+                "name": group.name,
+                "type": group.type,
+                "positioners": [{
+                    "name": pos.name,
+                    "stage_type": pos.stage_type,
+                    "plug_number": pos.plug_number,
+                    "max_velocity": pos.max_velocity,
+                    "max_accel": pos.max_accel,
+                    "min_position": pos.min_position,
+                    "max_position": pos.max_position,
+                } for pos in group.positioners],
+            })
+        return cls(host, firmware_version, ini_fingerprint, boot_time, objects_list, group_dicts)
+
+    def restore_groups(self) -> list:
+        groups = []
+        for group_dict in self.groups:
+            group = motion_group.XpsMotionGroup(group_dict["name"], group_dict["type"])
+            for pos_dict in group_dict["positioners"]:
+                pos = motion_group.XpsPositioner(pos_dict["name"], pos_dict["stage_type"],
+                                                 pos_dict["plug_number"])
+                pos.max_velocity = pos_dict["max_velocity"]
+                pos.max_accel = pos_dict["max_accel"]
+                pos.min_position = pos_dict["min_position"]
+                pos.max_position = pos_dict["max_position"]
+                group.positioners.append(pos)
+            groups.append(group)
+        return groups
+
+    def same_boot(self, boot_time: float) -> bool:
+        return abs(boot_time - self.boot_time) <= BOOT_TIME_TOLERANCE
+
+    def to_dict(self) -> dict:
+        return dict(version=SNAPSHOT_VERSION, host=self.host,
+                    firmware_version=self.firmware_version,
+                    ini_fingerprint=self.ini_fingerprint, boot_time=self.boot_time,
+                    objects_list=self.objects_list, groups=self.groups)
+
+    @classmethod
+    def from_dict(cls, snapshot_dict: dict):
+        if snapshot_dict.get("version") != SNAPSHOT_VERSION:
+            raise ValueError("unsupported snapshot version")
+        return cls(snapshot_dict["host"], snapshot_dict["firmware_version"],
+                   snapshot_dict["ini_fingerprint"], snapshot_dict["boot_time"],
+                   snapshot_dict["objects_list"], snapshot_dict["groups"])
+
+
+class TopologyCache:
+    """on-disk snapshots, one json file per host and firmware version"""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR) -> None:
+        self.cache_dir = cache_dir
+
+    def path_for(self, host: str, firmware_version: str) -> str:
+        firmware_key = hashlib.sha1(firmware_version.encode()).hexdigest()[:12]
+        safe_host = "".join(c if c.isalnum() or c in "-." else "_" for c in host)
+        return os.path.join(self.cache_dir, f"{safe_host}_{firmware_key}.json")
+
+    def load(self, host: str, firmware_version: str):
+        """returns the stored snapshot, or None if missing or unreadable"""
+        try:
+            with open(self.path_for(host, firmware_version)) as fin:
+                snapshot = TopologySnapshot.from_dict(json.load(fin))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if snapshot.host != host or snapshot.firmware_version != firmware_version:
+            return None
+        return snapshot
+
+    def save(self, snapshot: TopologySnapshot) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path_for(snapshot.host, snapshot.firmware_version)
+        # write then rename so a crash never leaves half a snapshot behind
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as fout:
+            json.dump(snapshot.to_dict(), fout)
+        os.replace(tmp_path, path)
+
+    def invalidate(self, host: str, firmware_version: str) -> None:
+        try:
+            os.remove(self.path_for(host, firmware_version))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,148 @@
+import io
+from . import connection_pool
+from . import motion_channel
+from .numpy_support import check_numpy, np
+
+
+class PvtTrajectory:
+    """position-velocity-time trajectory for the controller's PVT mode
+
+    built from absolute positions at given times, one column per positioner.
+    every segment is a cubic fixed by its duration, displacement and end
+    velocities; everything is computed on whole arrays at once
+    """
+    # decimals written to the trajectory file
+    precision = 6
+
+    def __init__(self, positioners: list, times, positions, velocities=None) -> None:
+        check_numpy()
+        self.positioners = positioners
+        self.times = np.asarray(times, dtype=float)
+        self.positions = np.asarray(positions, dtype=float).reshape(len(self.times), -1)
+        if self.positions.shape[1] != len(positioners):
+            raise ValueError("need one column of positions per positioner")
+        if len(self.times) < 2:
+            raise ValueError("need at least two points")
+
+        self.durations = np.diff(self.times)
+        if np.any(self.durations <= 0):
+            raise ValueError("times must be strictly increasing")
+        self.displacements = np.diff(self.positions, axis=0)
+
+        if velocities is None:
+            # central differences, at rest at both ends
+            velocities = np.gradient(self.positions, self.times, axis=0)
+            velocities[0] = 0.0
+            velocities[-1] = 0.0
+        self.velocities = np.asarray(velocities, dtype=float).reshape(self.positions.shape)
+
+        self._fit_cubics()
+
+    def _fit_cubics(self) -> None:
+        # p(t) = p0 + v0 t + c2 t^2 + c3 t^3 over each segment
+        duration = self.durations[:, np.newaxis]
+        v0, v1 = self.velocities[:-1], self.velocities[1:]
+        self._c2 = (3 * self.displacements - (2 * v0 + v1) * duration) / duration ** 2
+        self._c3 = (-2 * self.displacements + (v0 + v1) * duration) / duration ** 3
+
+    def peak_accelerations(self):
+        """largest |acceleration| of each segment, shape (n_segments, n_axes)
+
+        acceleration is linear within a segment so the peak is at one of its ends
+        """
+        duration = self.durations[:, np.newaxis]
+        start = 2 * self._c2
+        end = start + 6 * self._c3 * duration
+        return np.maximum(np.abs(start), np.abs(end))
+
+    def peak_velocities(self):
+        """largest |velocity| of each segment, shape (n_segments, n_axes)"""
+        duration = self.durations[:, np.newaxis]
+        v0, v1 = self.velocities[:-1], self.velocities[1:]
+        peak = np.maximum(np.abs(v0), np.abs(v1))
+        # velocity is quadratic: its turning point may lie inside the segment
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_turn = -self._c2 / (3 * self._c3)
+            v_turn = v0 - self._c2 ** 2 / (3 * self._c3)
+        inside = (self._c3 != 0) & (t_turn > 0) & (t_turn < duration)
+        return np.where(inside, np.maximum(peak, np.abs(v_turn)), peak)
+
+    def position_range(self):
+        """(minimum, maximum) position of each axis over the whole trajectory,
+        including overshoot between points"""
+        p0 = self.positions[:-1]
+        duration = self.durations[:, np.newaxis]
+        v0, c2, c3 = self.velocities[:-1], self._c2, self._c3
+        lowest = self.positions.min(axis=0)
+        highest = self.positions.max(axis=0)
+        # stationary points: 3 c3 t^2 + 2 c2 t + v0 = 0. the roots are taken as
+        # q / 3 c3 and v0 / q, which stays exact for a pure quadratic (c3 == 0):
+        # v0 / q is then the turning point -v0 / 2 c2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            q = -(c2 + np.copysign(np.sqrt(c2 ** 2 - 3 * c3 * v0), c2))
+            for t in (q / (3 * c3), v0 / q):
+                inside = np.isfinite(t) & (t > 0) & (t < duration)
+                p = np.where(inside, p0 + v0 * t + c2 * t ** 2 + c3 * t ** 3, np.nan)
+                lowest = np.fmin(lowest, np.nanmin(p, axis=0, initial=np.inf))
+                highest = np.fmax(highest, np.nanmax(p, axis=0, initial=-np.inf))
+        return lowest, highest
+
+    def check_limits(self) -> list:
+        """every violation of the positioners' velocity, acceleration and travel limits"""
+        problems = []
+        peak_velocity = self.peak_velocities().max(axis=0)
+        peak_accel = self.peak_accelerations().max(axis=0)
+        lowest, highest = self.position_range()
+        for i, pos in enumerate(self.positioners):
+            if pos.max_velocity is not None and peak_velocity[i] > pos.max_velocity:
+                problems.append(f"{pos.name}: velocity {peak_velocity[i]:g} > {pos.max_velocity:g}")
+            if pos.max_accel is not None and peak_accel[i] > pos.max_accel:
+                problems.append(f"{pos.name}: acceleration {peak_accel[i]:g} > {pos.max_accel:g}")
+            if pos.min_position is not None and lowest[i] < pos.min_position:
+                problems.append(f"{pos.name}: position {lowest[i]:g} < {pos.min_position:g}")
+            if pos.max_position is not None and highest[i] > pos.max_position:
+                problems.append(f"{pos.name}: position {highest[i]:g} > {pos.max_position:g}")
+        return problems
+
+    def verify_limits(self) -> None:
+        problems = self.check_limits()
+        if problems:
+            raise ValueError("trajectory outside limits: " + "; ".join(problems))
+
+    def to_bytes(self) -> bytes:
+        """trajectory file: one line per segment, 'duration, dx1, v1, dx2, v2, ...'"""
+        n_segments, n_axes = self.displacements.shape
+        table = np.empty((n_segments, 1 + 2 * n_axes))
+        table[:, 0] = self.durations
+        table[:, 1::2] = self.displacements
+        table[:, 2::2] = self.velocities[1:]
+        # formatted straight into one buffer
+        buffer = io.BytesIO()
+        np.savetxt(buffer, table, fmt=f"%.{self.precision}f", delimiter=", ")
+        return buffer.getvalue()
+
+    # MultipleAxesPVTVerification :  Multiple axes PVT trajectory verification
+    @staticmethod
+    async def verify(pool: connection_pool.ConnectionPool, group_name: str, filename: str):
+        return await pool.send_recv(f"MultipleAxesPVTVerification({group_name},{filename})")
+
+    # MultipleAxesPVTPulseOutputSet :  Configure pulse output on trajectory
+    @staticmethod
+    async def set_pulse_output(pool: connection_pool.ConnectionPool, group_name: str,
+                               start_element: int, end_element: int, time_interval: float):
+        return await pool.send_recv(
+            f"MultipleAxesPVTPulseOutputSet({group_name},{start_element},{end_element},{time_interval})")
+
+    # MultipleAxesPVTExecution :  Multiple axes PVT trajectory execution
+    @staticmethod
+    async def execute(pool: connection_pool.ConnectionPool, group_name: str,
+                      filename: str, n_times: int = 1):
+        # answered when the trajectory ends: no deadline
+        return await pool.send_recv(f"MultipleAxesPVTExecution({group_name},{filename},{n_times})",
+                                    timeout=None)
+
+    # MultipleAxesPVTExecution on the group's motion channel: returns without waiting for the trajectory
+    @staticmethod
+    def start_execution(motion: motion_channel.MotionChannels, group_name: str,
+                        filename: str, n_times: int = 1) -> motion_channel.MoveHandle:
+        return motion.start(group_name, f"MultipleAxesPVTExecution({group_name},{filename},{n_times})")
@@ -1,78 +1,259 @@
-import trio
-from contextlib import asynccontextmanager
-
-
-class MyException(Exception):
-    """XPS Controller Exception"""
-
-    def __init__(self, msg):
-        self.msg = msg
-
-    def __str__(self):
-        return str(self.msg)
+import time
+import anyio
+from . import framing
+from . import instrumentation as instr
+from . import wire_recorder
+from .framing import ConnectionLost, DesyncError, MyException, XpsTimeout
 
 
 class AsyncSocket:
     buffer_size = 2048
-    _sock: trio.SocketStream
+    # reconnect: attempts, seconds allowed per attempt, and backoff between attempts
+    reconnect_attempts = 4
+    connect_timeout = 2.0
+    first_backoff = 0.05
+    max_backoff = 1.0
+    _sock: anyio.abc.SocketStream
 
-    def __init__(self, host: str, port: int = 5001):
+    def __init__(self, host: str, port: int = 5001, instrumentation: instr.Instrumentation = None,
+                 timeout: float = 10.0, recorder: wire_recorder.WireRecorder = None):
         self.host = host
         self.port_number = port
+        # optional, may be shared with the other connections to the same controller
+        self.instrumentation = instrumentation
+        # seconds to wait for the replies of a call, None waits for ever (motion commands)
+        self.timeout = timeout
+        # optional, logs the traffic of every connection this socket opens
+        self.recorder = recorder
+        self._connection_id = None
+
+        # pipelining: commands are written back to back under _send_lock and
+        # numbered in the order they were written. whichever task holds
+        # _recv_lock reads the next reply off the stream and files it under
+        # its number for the task that sent it
+        self._send_lock = anyio.Lock()
+        self._recv_lock = anyio.Lock()
+        self._framer = framing.ReplyFramer()
+        self._n_sent = 0
+        self._n_read = 0
+        self._arrived = {}
+        # numbers of replies whose caller gave up: dropped when they arrive
+        self._abandoned = set()
+        # bumped whenever the connection is dropped, outstanding numbers become void
+        self._generation = 0
+        self._broken = False
+        # the send and receive in progress, cancelled when the connection is dropped
+        self._send_scope = None
+        self._recv_scope = None
+        # dropped streams, closed on reconnect or exit
+        self._stale = []
 
     async def __aenter__(self):
         print("opening connection")
-        self._sock = await trio.open_tcp_stream(self.host, self.port_number)
+        self._sock = await anyio.connect_tcp(self.host, self.port_number)
+        if self.recorder is not None:
+            self._connection_id = self.recorder.open_connection(self.host, self.port_number)
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self._sock.aclose()
+        self._break()
+        await self._close_stale()
         print("closing connection")
 
     # handles error, returns either a single string or tuple of strings
-    async def send_recv(self, cmd):
+    async def send_recv(self, cmd, timeout: float = -1):
+        """timeout overrides self.timeout for this call"""
+        reply = (await self._send_recv_batch([cmd], timeout))[0]
+        return framing.unpack_reply(reply)
+
+    # pipelined: writes all commands in one go then collects the replies in order
+    async def send_recv_many(self, cmds, timeout: float = -1) -> list:
+        replies = await self._send_recv_batch(list(cmds), timeout)
+        return [framing.unpack_reply(reply) for reply in replies]
+
+    # the values of the reply as one undivided string, for callers that decode it themselves
+    async def send_recv_raw(self, cmd, timeout: float = -1) -> str:
+        reply = (await self._send_recv_batch([cmd], timeout))[0]
+        return framing.checked_values(reply)
+
+    async def send_recv_raw_many(self, cmds, timeout: float = -1) -> list:
+        replies = await self._send_recv_batch(list(cmds), timeout)
+        return [framing.checked_values(reply) for reply in replies]
+
+    async def _send_recv_batch(self, commands: list, timeout: float = -1) -> list:
+        if not commands:
+            return []
+        if timeout == -1:
+            timeout = self.timeout
         try:
-            err, msg = await self._send_recv(cmd)
-        # todo: implement and test error handling
-        except trio.ClosedResourceError as my_err:
-            err, msg = await self._cleanup(my_err)
-            # because I closed the socket
-
-        except trio.BrokenResourceError as my_err:
-            # because socket closed from other side!
-            raise my_err
-            # another bad error
-        # also applicable are MultiError and BusyResource
-
-        if err != 0:
-            raise MyException(msg)
-        if len(msg) == 1:
-            return msg[0]
-        return msg
-
-    async def _send_recv(self, msg: str):
-        # send:
-        command = msg
-        await self._sock.send_all(command.encode())
-
-        # receive:
-        recieved_data = b''
-        while recieved_data.find(b',EndOfAPI') == -1:
-            recieved_data += await self._sock.receive_some(2048)
-        reply = recieved_data.decode()
-
-        parsed = reply.split(',')
-        reply = (int(parsed[0]), parsed[1:-1])
+            return await self._exchange(commands, timeout)
+        except ConnectionLost:
+            # a read-only batch can be sent again once reconnected, anything else might act twice
+            if not all(framing.is_read_only(command) for command in commands):
+                raise
+        return await self._exchange(commands, timeout)
+
+    async def _exchange(self, commands: list, timeout) -> list:
+        instruments = self.instrumentation
+        submitted = time.perf_counter()
+        deadline = anyio.current_time() + timeout if timeout is not None else float('inf')
+        with anyio.CancelScope(deadline=deadline) as scope:
+            generation, first = await self._submit(commands)
+        if scope.cancelled_caught:
+            raise XpsTimeout(f"could not send to {self.host} within {timeout}s")
+        if instruments is not None:
+            instruments.begin(len(commands))
+
+        replies = []
+        try:
+            with anyio.CancelScope(deadline=deadline) as scope:
+                for index, command in enumerate(commands, first):
+                    reply = await self._reply_for(generation, index)
+                    try:
+                        err = framing.check_reply(command, reply)
+                    except ValueError as why:
+                        raise self._desync(generation, str(why))
+                    if instruments is not None:
+                        instruments.record(command, time.perf_counter() - submitted, len(command),
+                                           len(reply) + len(framing.END_OF_API), err)
+                    # left undivided: the caller decides how to split the values
+                    replies.append(reply)
+            if not scope.cancelled_caught:
+                return replies
+            if instruments is not None:
+                instruments.record_timeout()
+            # most likely a stalled link: waiting longer on it would only hold up later calls
+            self._break(generation)
+            raise XpsTimeout(f"no reply from {self.host} within {timeout}s to {commands[len(replies)]}")
+        finally:
+            if instruments is not None:
+                instruments.abandon(len(commands) - len(replies))
+            self._abandon(generation, range(first + len(replies), first + len(commands)))
+
+    async def _submit(self, commands: list) -> tuple:
+        """write the commands, returns (connection generation, number of the first reply)"""
+        async with self._send_lock:
+            if self._broken:
+                await self._reconnect()
+            generation = self._generation
+            first = self._n_sent
+            # counted before writing: replies can arrive while the rest is still being sent
+            self._n_sent += len(commands)
+            if self.recorder is not None:
+                for command in commands:
+                    self.recorder.command(self._connection_id, command)
+            try:
+                with anyio.CancelScope() as self._send_scope:
+                    await self._sock.send("".join(commands).encode())
+            except BaseException as err:
+                # cancelled or failed part way through a write: the stream is unusable
+                self._break(generation)
+                if isinstance(err, (anyio.BrokenResourceError, anyio.ClosedResourceError)):
+                    raise ConnectionLost(f"connection to {self.host} lost: {err}") from err
+                raise
+            finally:
+                self._send_scope = None
+            if generation != self._generation:
+                raise ConnectionLost(f"connection to {self.host} was reset while sending")
+        return generation, first
+
+    async def _reply_for(self, generation: int, index: int) -> str:
+        while True:
+            if generation != self._generation:
+                raise ConnectionLost(f"connection to {self.host} was reset before the reply arrived")
+            if index in self._arrived:
+                return self._arrived.pop(index)
+            async with self._recv_lock:
+                if generation != self._generation or index in self._arrived:
+                    continue
+                try:
+                    # cancelled by _break: the loop then reports the reset
+                    with anyio.CancelScope() as self._recv_scope:
+                        reply = await self._recv_reply()
+                except (anyio.EndOfStream, anyio.BrokenResourceError, anyio.ClosedResourceError) as err:
+                    self._break(generation)
+                    raise ConnectionLost(f"connection to {self.host} lost: {err!r}") from err
+                finally:
+                    self._recv_scope = None
+                if generation != self._generation:
+                    continue
+                if self.recorder is not None:
+                    self.recorder.reply(self._connection_id, reply)
+                received = self._n_read
+                self._n_read += 1
+                if received in self._abandoned:
+                    self._abandoned.discard(received)
+                else:
+                    self._arrived[received] = reply
+                if self._n_read == self._n_sent and len(self._framer):
+                    raise self._desync(generation, "bytes left over after the last reply")
+
+    async def _recv_reply(self) -> str:
+        # a cancelled receive loses nothing, partial replies stay in the framer.
+        # end of stream (connection closed by controller) raises EndOfStream
+        reply = self._framer.next_reply()
+        while reply is None:
+            data = await self._sock.receive(self.buffer_size)
+            self._framer.feed(data)
+            reply = self._framer.next_reply()
         return reply
 
-    async def _cleanup(self, my_err):
-        print("noticed resource closed")
-        # close the socket, re-connect, resend the command
-        with trio.move_on_after(2) as cancel_scope:
-            await self._sock.aclose()
-            self._sock = await trio.open_tcp_stream(self.host, self.port_number)
-        if cancel_scope.cancelled_caught:
-            raise my_err
-        err, msg = await self._send_recv(cmd)
-        return err, msg
+    def _abandon(self, generation: int, indices) -> None:
+        if generation != self._generation:
+            return
+        for index in indices:
+            if self._arrived.pop(index, None) is None:
+                self._abandoned.add(index)
+
+    def _desync(self, generation: int, why: str) -> DesyncError:
+        self._break(generation)
+        return DesyncError(f"stream from {self.host} out of step: {why}")
+
+    def _break(self, generation: int = None) -> None:
+        """drop the connection, every outstanding reply fails and the next call reconnects"""
+        if generation is not None and generation != self._generation:
+            return
+        self._generation += 1
+        self._broken = True
+        if self.recorder is not None:
+            self.recorder.close_connection(self._connection_id)
+        # wake the tasks blocked on the stream, it is closed once they have let go of it
+        for scope in (self._send_scope, self._recv_scope):
+            if scope is not None:
+                scope.cancel()
+        self._stale.append(self._sock)
+
+    async def _close_stale(self) -> None:
+        stale, self._stale = self._stale, []
+        for sock in stale:
+            await anyio.aclose_forcefully(sock)
+
+    async def _reconnect(self) -> None:
+        await self._close_stale()
+        delay = self.first_backoff
+        error = None
+        for attempt in range(self.reconnect_attempts):
+            if attempt:
+                await anyio.sleep(delay)
+                delay = min(2 * delay, self.max_backoff)
+            with anyio.move_on_after(self.connect_timeout):
+                try:
+                    sock = await anyio.connect_tcp(self.host, self.port_number)
+                    break
+                except OSError as err:
+                    error = err
+                    continue
+            error = f"no answer within {self.connect_timeout}s"
+        else:
+            raise ConnectionLost(f"could not reconnect to {self.host}: {error}")
 
+        self._sock = sock
+        if self.recorder is not None:
+            self._connection_id = self.recorder.open_connection(self.host, self.port_number)
+        self._framer.clear()
+        self._n_sent = self._n_read = 0
+        self._arrived = {}
+        self._abandoned = set()
+        self._broken = False
+        if self.instrumentation is not None:
+            self.instrumentation.record_reconnect()
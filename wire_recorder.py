@@ -0,0 +1,233 @@
+"""record the traffic of the command port and serve it back
+
+    python -m <package>.wire_recorder dump session.xpsrec
+    python -m <package>.wire_recorder replay session.xpsrec --port 5001 --speed 1
+
+a log is a header followed by records, each a fixed size head
+(kind, time, connection, payload length) and the payload text. a
+WireRecorder only appends: every recorder opened on the file starts a new
+session, connection ids count from 0 within a session. ftp transfers are
+not recorded
+"""
+import argparse
+import collections
+import struct
+import sys
+import threading
+import time
+import anyio
+from contextlib import AsyncExitStack
+from . import command_server
+from .framing import ERR_UNKNOWN_COMMAND
+
+MAGIC = b"XPSREC\x00\x01"
+# kind, seconds since the epoch, connection id, payload length
+RECORD = struct.Struct("<BdII")
+
+SESSION = 0
+OPEN = 1
+COMMAND = 2
+REPLY = 3
+CLOSE = 4
+KIND_NAMES = {SESSION: "session", OPEN: "open", COMMAND: "command", REPLY: "reply", CLOSE: "close"}
+
+
+class WireRecorder:
+    """appends commands and replies to a binary log, may be shared by every connection and thread
+
+    writes are buffered: the log is complete once the recorder is closed
+    """
+
+    def __init__(self, filename: str, buffer_size: int = 65536) -> None:
+        self.filename = filename
+        self._file = open(filename, "ab", buffering=buffer_size)
+        self._lock = threading.Lock()
+        self._n_connections = 0
+        # timestamps: wall clock at start, then the monotonic clock
+        self._wall_start = time.time()
+        self._perf_start = time.perf_counter()
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._write(SESSION, 0, b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def open_connection(self, host: str, port: int) -> int:
+        """returns the id to record the connection's traffic under"""
+        with self._lock:
+            connection = self._n_connections
+            self._n_connections += 1
+        self._write(OPEN, connection, f"{host}:{port}".encode())
+        return connection
+
+    def command(self, connection: int, command: str) -> None:
+        self._write(COMMAND, connection, command.encode())
+
+    def reply(self, connection: int, reply: str) -> None:
+        """reply: text without the terminator"""
+        self._write(REPLY, connection, reply.encode())
+
+    def close_connection(self, connection: int) -> None:
+        self._write(CLOSE, connection, b"")
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def _write(self, kind: int, connection: int, payload: bytes) -> None:
+        now = self._wall_start + (time.perf_counter() - self._perf_start)
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(RECORD.pack(kind, now, connection, len(payload)))
+            self._file.write(payload)
+
+
+def read_records(filename: str):
+    """yields (kind, time, (session, connection), text) for every record of the log"""
+    with open(filename, "rb") as fin:
+        if fin.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} is not a wire recording")
+        session = -1
+        while True:
+            head = fin.read(RECORD.size)
+            if len(head) < RECORD.size:
+                # a truncated last record: the recording process died mid-write
+                return
+            kind, timestamp, connection, length = RECORD.unpack(head)
+            payload = fin.read(length)
+            if len(payload) < length:
+                return
+            if kind == SESSION:
+                session += 1
+            yield kind, timestamp, (session, connection), payload.decode()
+
+
+def reply_table(records) -> dict:
+    """command -> [(seconds the reply took, reply text), ...] in recorded order
+
+    replies are paired with the commands of their connection in order, as
+    the controller answers them
+    """
+    table = {}
+    waiting = {}
+    for kind, timestamp, connection, text in records:
+        if kind == COMMAND:
+            waiting.setdefault(connection, collections.deque()).append((text, timestamp))
+        elif kind == REPLY:
+            commands = waiting.get(connection)
+            if not commands:
+                continue
+            command, sent = commands.popleft()
+            table.setdefault(command, []).append((timestamp - sent, text))
+        elif kind in (OPEN, CLOSE):
+            # commands left without a reply were lost with the connection
+            waiting.pop(connection, None)
+    return table
+
+
+class ReplayServer(command_server.CommandServer):
+    """serves a recorded session over tcp in place of the controller
+
+    a command is answered with the next recorded reply to the same command
+    text, whichever connection asks, so a client distributing its commands
+    differently over its connections still gets the session's answers. the
+    last reply to a command is repeated once its recorded ones are used up
+    (polling outlasting the recording), unrecorded commands get error -4
+    and are counted in mismatches.
+
+    speed scales the recorded reply times: 1 is the original timing, 2 twice
+    as fast, None answers as fast as possible
+    """
+
+    def __init__(self, filename: str = None, records=None, speed: float = 1.0,
+                 host: str = "127.0.0.1", port: int = 0) -> None:
+        """filename of a log, or records as read_records yields them"""
+        self.table = reply_table(read_records(filename) if records is None else records)
+        self.speed = speed
+        self.host = host
+        self.port = port
+        self.n_commands = 0
+        self.mismatches = 0
+        self._queues = {command: collections.deque(replies) for command, replies in self.table.items()}
+        self._exit_stack = None
+
+    async def __aenter__(self):
+        async with AsyncExitStack() as stack:
+            listener = await stack.enter_async_context(
+                await anyio.create_tcp_listener(local_host=self.host, local_port=self.port))
+            self.port = listener.extra(anyio.abc.SocketAttribute.local_port)
+            task_group = await stack.enter_async_context(anyio.create_task_group())
+            stack.callback(task_group.cancel_scope.cancel)
+            task_group.start_soon(listener.serve, self._serve_commands)
+            self._exit_stack = stack.pop_all()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._exit_stack.aclose()
+        self._exit_stack = None
+
+    def next_reply(self, command: str) -> tuple:
+        """(seconds the reply took, reply text) for the command"""
+        self.n_commands += 1
+        replies = self._queues.get(command)
+        if not replies:
+            self.mismatches += 1
+            return 0.0, f"{ERR_UNKNOWN_COMMAND},{command}"
+        if len(replies) > 1:
+            return replies.popleft()
+        return replies[0]
+
+    async def _reply_to(self, command: str):
+        delay, reply = self.next_reply(command)
+        deliver_at = anyio.current_time()
+        if self.speed:
+            deliver_at += delay / self.speed
+        return reply, deliver_at
+
+
+def dump(filename: str, out=sys.stdout) -> None:
+    start = None
+    for kind, timestamp, (session, connection), text in read_records(filename):
+        if start is None:
+            start = timestamp
+        out.write(f"{timestamp - start:12.6f} {session}.{connection:<4d} {KIND_NAMES.get(kind, kind):8s} {text}\n")
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    commands = parser.add_subparsers(dest="action", required=True)
+    dump_parser = commands.add_parser("dump", help="print the records of a log")
+    dump_parser.add_argument("filename")
+    replay_parser = commands.add_parser("replay", help="serve a log over tcp until interrupted")
+    replay_parser.add_argument("filename")
+    replay_parser.add_argument("--host", default="127.0.0.1")
+    replay_parser.add_argument("--port", type=int, default=5001)
+    replay_parser.add_argument("--speed", type=float, default=1.0,
+                               help="timing scale, 0 answers as fast as possible")
+    args = parser.parse_args(argv)
+
+    if args.action == "dump":
+        dump(args.filename)
+        return 0
+
+    async def serve():
+        async with ReplayServer(args.filename, speed=args.speed or None, host=args.host,
+                                port=args.port) as server:
+            print(f"replaying {args.filename} on {server.host}:{server.port}")
+            await anyio.sleep_forever()
+
+    try:
+        anyio.run(serve)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""registry of XPS API functions, with their input and output types
+
+each signature line reads  Name(inputs) -> outputs  with the types
+    s  string      i  integer      d  double      b  bool
+and a trailing * for a variable number of values: one per positioner of a
+group, or all the values a function takes (GroupJogParametersSet). command
+strings are built from templates prepared once per function and numeric
+replies are decoded from the undivided reply text
+"""
+from . import connection_pool
+from .numpy_support import HAS_NUMPY, np
+
+SIGNATURES = """
+    FirmwareVersionGet() -> s
+    InstallerVersionGet() -> s
+    HardwareDateAndTimeGet() -> s
+    ElapsedTimeGet() -> d
+    ObjectsListGet() -> s
+    ErrorStringGet(i) -> s
+    ControllerStatusGet() -> i
+    ControllerStatusStringGet(i) -> s
+    ControllerMotionKernelTimeLoadGet() -> d, d, d, d
+    KillAll()
+    CloseAllOtherSockets()
+    Login(s, s)
+    TimerGet(s) -> i
+    TCLScriptExecute(s, s, s)
+    TCLScriptKill(s)
+    GlobalArrayGet(i) -> s
+    GlobalArraySet(i, s)
+    DoubleGlobalArrayGet(i) -> d
+    DoubleGlobalArraySet(i, d)
+    GPIOAnalogGet(s) -> d
+    GPIOAnalogSet(s, d)
+    GPIODigitalGet(s) -> i
+    GPIODigitalSet(s, i, i)
+    EventExtendedStart() -> i
+    EventExtendedRemove(i)
+
+    GroupStatusGet(s) -> i
+    GroupStatusStringGet(i) -> s
+    GroupInitialize(s)
+    GroupHomeSearch(s)
+    GroupReferencingStart(s)
+    GroupReferencingStop(s)
+    GroupKill(s)
+    GroupMoveAbort(s)
+    GroupMotionEnable(s)
+    GroupMotionDisable(s)
+    GroupMoveAbsolute(s, d*)
+    GroupMoveRelative(s, d*)
+    GroupPositionCurrentGet(s) -> d*
+    GroupPositionSetpointGet(s) -> d*
+    GroupPositionTargetGet(s) -> d*
+    GroupVelocityCurrentGet(s) -> d*
+    GroupAccelerationCurrentGet(s) -> d*
+    GroupCurrentFollowingErrorGet(s) -> d*
+    GroupJogModeEnable(s)
+    GroupJogModeDisable(s)
+    GroupJogParametersSet(s, d*)
+    GroupJogParametersGet(s) -> d*
+    GroupJogCurrentGet(s) -> d*
+    GroupSpinParametersSet(s, d, d)
+    GroupSpinCurrentGet(s) -> d, d
+    GroupSpinModeStop(s, d)
+    GroupAnalogTrackingModeEnable(s, s)
+    GroupAnalogTrackingModeDisable(s)
+
+    PositionerUserTravelLimitsGet(s) -> d, d
+    PositionerUserTravelLimitsSet(s, d, d)
+    PositionerMaximumVelocityAndAccelerationGet(s) -> d, d
+    PositionerSGammaParametersGet(s) -> d, d, d, d
+    PositionerSGammaParametersSet(s, d, d, d, d)
+    PositionerSGammaExactVelocityAjustedDisplacementGet(s, d) -> d
+    PositionerMotionDoneGet(s) -> d, d, d, d, d
+    PositionerHardwareStatusGet(s) -> i
+    PositionerHardwareStatusStringGet(i) -> s
+    PositionerErrorGet(s) -> i
+    PositionerErrorRead(s) -> i
+    PositionerErrorStringGet(i) -> s
+    PositionerDriverStatusGet(s) -> i
+    PositionerDriverStatusStringGet(i) -> s
+    PositionerBacklashGet(s) -> d, s
+    PositionerBacklashSet(s, d)
+    PositionerCorrectorTypeGet(s) -> s
+    PositionerStageParameterGet(s, s) -> s
+    PositionerPositionCompareSet(s, d, d, d)
+    PositionerPositionCompareGet(s) -> d, d, d, b
+    PositionerPositionCompareEnable(s)
+    PositionerPositionCompareDisable(s)
+    PositionerPositionComparePulseParametersSet(s, d, d)
+
+    GatheringConfigurationSet(s*)
+    GatheringConfigurationGet() -> s
+    GatheringCurrentNumberGet() -> i, i
+    GatheringRun(i, i)
+    GatheringRunAppend()
+    GatheringStop()
+    GatheringStopAndSave()
+    GatheringReset()
+    GatheringDataMultipleLinesGet(i, i) -> s
+    GatheringExternalConfigurationSet(s*)
+    GatheringExternalArm()
+    GatheringExternalStopAndSave()
+    GatheringExternalCurrentNumberGet() -> i, i
+
+    MultipleAxesPVTVerification(s, s)
+    MultipleAxesPVTVerificationResultGet(s) -> s, d, d, d, d
+    MultipleAxesPVTExecution(s, s, i)
+    MultipleAxesPVTParametersGet(s) -> s, i
+    MultipleAxesPVTPulseOutputSet(s, i, i, d)
+    MultipleAxesPVTPulseOutputGet(s) -> i, i, d
+"""
+
+PLACEHOLDERS = {"s": "char *", "i": "int *", "d": "double *", "b": "bool *"}
+
+
+def _bool_text(value) -> str:
+    return "1" if value else "0"
+
+
+def _parse_bool(text: str) -> bool:
+    return text.strip().lower() in ("1", "true")
+
+
+ENCODERS = {"s": str, "i": lambda value: str(int(value)), "d": lambda value: str(float(value)),
+            "b": _bool_text}
+DECODERS = {"s": str, "i": int, "d": float, "b": _parse_bool}
+
+
+def _decode_doubles(values: str):
+    """'1.5,2.5' -> array (tuple of floats without numpy), without splitting into strings first"""
+    if HAS_NUMPY:
+        return np.fromstring(values, sep=',')
+    return tuple(map(float, values.split(',')))
+
+
+class ApiFunction:
+    """one XPS API function: builds its command strings and decodes its replies"""
+
+    def __init__(self, name: str, inputs: str = "", outputs: str = "") -> None:
+        """inputs, outputs: type letters, e.g. 'sd*' and 'dd'"""
+        self.name = name
+        self.variadic_input = inputs.endswith("*")
+        self.inputs = inputs.rstrip("*")
+        self.vector_output = outputs.endswith("*")
+        self.outputs = outputs.rstrip("*")
+        self._encoders = tuple(ENCODERS[kind] for kind in self.inputs)
+        self._variadic_encoder = ENCODERS[self.inputs[-1]] if self.variadic_input else None
+
+        # templates: the text that never changes is joined once, here
+        placeholders = ",".join(PLACEHOLDERS[kind] for kind in self.outputs)
+        self._prefix = f"{name}("
+        self._suffix = f",{placeholders})" if placeholders else ")"
+        self._bare_command = f"{name}({placeholders})"
+        # n values -> output placeholders, for vector outputs
+        self._vector_suffixes = {}
+        self.decode = self._make_decoder()
+
+    def __repr__(self) -> str:
+        return f"ApiFunction({self.name!r}, {self.signature!r})"
+
+    @property
+    def signature(self) -> str:
+        inputs = ", ".join(self.inputs) + ("*" if self.variadic_input else "")
+        outputs = ", ".join(self.outputs) + ("*" if self.vector_output else "")
+        return f"{self.name}({inputs})" + (f" -> {outputs}" if outputs else "")
+
+    def command(self, *args, n_values: int = 1) -> str:
+        """n_values: how many values a vector output carries, e.g. the positioners of a group"""
+        if self.variadic_input:
+            if len(args) < len(self.inputs):
+                raise ValueError(f"{self.signature} needs at least {len(self.inputs)} arguments")
+            fixed = len(self.inputs) - 1
+            encoded = [encode(arg) for encode, arg in zip(self._encoders[:fixed], args)]
+            encoded += [self._variadic_encoder(arg) for arg in args[fixed:]]
+        else:
+            if len(args) != len(self.inputs):
+                raise ValueError(f"{self.signature} needs {len(self.inputs)} arguments, got {len(args)}")
+            if not args and not self.vector_output:
+                return self._bare_command
+            encoded = [encode(arg) for encode, arg in zip(self._encoders, args)]
+
+        suffix = self._suffix
+        if self.vector_output:
+            suffix = self._vector_suffixes.get(n_values)
+            if suffix is None:
+                suffix = self._vector_suffixes[n_values] = "," * bool(encoded) + \
+                    ",".join([PLACEHOLDERS[self.outputs]] * n_values) + ")"
+        return self._prefix + ",".join(encoded) + suffix
+
+    def _make_decoder(self):
+        """values text of a successful reply -> python values"""
+        outputs = self.outputs
+        if self.vector_output:
+            if outputs == "d":
+                return _decode_doubles
+            convert = DECODERS[outputs]
+            return lambda values: tuple(map(convert, values.split(',')))
+        if not outputs:
+            return lambda values: None
+        if len(outputs) == 1:
+            # the whole text: no split, and strings keep their commas
+            return DECODERS[outputs]
+        if outputs == "d" * len(outputs):
+            return lambda values: tuple(map(float, values.split(',')))
+
+        converters = tuple(DECODERS[kind] for kind in outputs)
+        # a string output last takes whatever follows, commas included
+        max_split = len(outputs) - 1 if outputs[-1] == "s" else -1
+        return lambda values: tuple(convert(value) for convert, value
+                                    in zip(converters, values.split(',', max_split)))
+
+
+def parse_signatures(text: str) -> dict:
+    functions = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        call, _, outputs = line.partition("->")
+        name, _, inputs = call.strip().partition("(")
+        inputs = inputs.rstrip(")").replace(",", "").replace(" ", "")
+        outputs = outputs.replace(",", "").replace(" ", "")
+        functions[name] = ApiFunction(name, inputs, outputs)
+    return functions
+
+
+FUNCTIONS = parse_signatures(SIGNATURES)
+
+
+def function(name: str) -> ApiFunction:
+    try:
+        return FUNCTIONS[name]
+    except KeyError:
+        raise ValueError(f"unknown XPS API function {name}") from None
+
+
+class AsyncApi:
+    """every registered function as a coroutine method, e.g.
+
+        api = AsyncApi(pool)
+        status = await api.GroupStatusGet('G1')
+        positions = await api.GroupPositionCurrentGet('XY', n_values=2)
+
+    transport is a ConnectionPool or an AsyncSocket
+    """
+
+    def __init__(self, transport: connection_pool.ConnectionPool) -> None:
+        self.transport = transport
+
+    async def call(self, name: str, *args, n_values: int = 1):
+        api_function = function(name)
+        return api_function.decode(
+            await self.transport.send_recv_raw(api_function.command(*args, n_values=n_values)))
+
+    async def call_many(self, calls) -> list:
+        """calls: (name, args) or (name, args, n_values) tuples, sent as one pipelined batch"""
+        functions, commands = [], []
+        for name, args, *n_values in calls:
+            api_function = function(name)
+            functions.append(api_function)
+            commands.append(api_function.command(*args, n_values=n_values[0] if n_values else 1))
+        replies = await self.transport.send_recv_raw_many(commands)
+        return [api_function.decode(values) for api_function, values in zip(functions, replies)]
+
+
+class SyncApi:
+    """every registered function as a plain method, over an XpsSocket"""
+
+    def __init__(self, transport) -> None:
+        self.transport = transport
+
+    def call(self, name: str, *args, n_values: int = 1):
+        api_function = function(name)
+        return api_function.decode(self.transport.send_recv_raw(api_function.command(*args, n_values=n_values)))
+
+
+def _add_methods(api_function: ApiFunction) -> None:
+    name = api_function.name
+    encode, decode = api_function.command, api_function.decode
+
+    async def async_method(self, *args, n_values: int = 1):
+        return decode(await self.transport.send_recv_raw(encode(*args, n_values=n_values)))
+
+    def sync_method(self, *args, n_values: int = 1):
+        return decode(self.transport.send_recv_raw(encode(*args, n_values=n_values)))
+
+    for cls, method in ((AsyncApi, async_method), (SyncApi, sync_method)):
+        method.__name__ = name
+        method.__qualname__ = f"{cls.__name__}.{name}"
+        method.__doc__ = api_function.signature
+        setattr(cls, name, method)
+
+
+for _api_function in FUNCTIONS.values():
+    _add_methods(_api_function)
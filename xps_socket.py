@@ -1,24 +1,29 @@
 from abc import ABC
 import socket
-
-class MyException(Exception):
-    """XPS Controller Exception"""
-
-    def __init__(self, msg, *args):
-        self.msg = msg
-
-    def __str__(self):
-        return str(self.msg)
+import time
+from . import framing
+from . import wire_recorder
+# re-exported for the callers catching xps_socket.MyException
+from .framing import MyException
 
 
 class AbstractSocket(ABC):
 
     _socket = None
 
-    def __init__(self, ip_addr, port_number, timeout, blocking):
+    def __init__(self, ip_addr, port_number, timeout, blocking, instrumentation=None,
+                 recorder: wire_recorder.WireRecorder = None):
 
         self.host = ip_addr
         self.port_number = port_number
+        # optional instrumentation.Instrumentation
+        self.instrumentation = instrumentation
+        # optional wire_recorder.WireRecorder
+        self.recorder = recorder
+        self._connection_id = None
+        if recorder is not None:
+            self._connection_id = recorder.open_connection(ip_addr, port_number)
+        self._reply_size = 0
 
         #setup co-routine and prepare it to recieve command
         self._socket = self.socket_coroutine(ip_addr, port_number, timeout, blocking)
@@ -30,49 +35,77 @@ class AbstractSocket(ABC):
 
     # handles error, returns either a single string or tuple of strings
     def send_recv(self, cmd):
-        err, msg = self._socket.send(cmd)
         # todo this is a good place to place an error-check- needs implementing
-        if err != 0:
-            raise MyException(msg)
-        if len(msg) == 1:
-            return msg[0]
-        return msg
-
+        return framing.unpack_reply(self._exchange(cmd))
+
+    # the values of the reply as one undivided string, for callers that decode it themselves
+    def send_recv_raw(self, cmd) -> str:
+        return framing.checked_values(self._exchange(cmd))
+
+    def _exchange(self, cmd) -> str:
+        if self.recorder is not None:
+            self.recorder.command(self._connection_id, cmd)
+            reply = self._exchange_instrumented(cmd)
+            self.recorder.reply(self._connection_id, reply)
+            return reply
+        return self._exchange_instrumented(cmd)
+
+    def _exchange_instrumented(self, cmd) -> str:
+        instruments = self.instrumentation
+        if instruments is None:
+            return self._socket.send(cmd)
+        instruments.begin()
+        submitted = time.perf_counter()
+        try:
+            reply = self._socket.send(cmd)
+        except BaseException:
+            instruments.abandon(1)
+            raise
+        instruments.record(cmd, time.perf_counter() - submitted, len(cmd), self._reply_size,
+                           framing.split_reply(reply)[0])
+        return reply
 
 
 class XpsSocket(AbstractSocket):
 
     buffer_size = 2048
 
-    def __init__(self, host, port=5001, timeout=20.0, blocking=True):
-        super(XpsSocket, self).__init__(host, port, timeout, blocking)
+    def __init__(self, host, port=5001, timeout=20.0, blocking=True, instrumentation=None, recorder=None):
+        super(XpsSocket, self).__init__(host, port, timeout, blocking, instrumentation, recorder)
 
     def socket_coroutine(self, ip_addr, port_number, timeout, blocking):
         try:
-            new_socket = socket.socket()
-            new_socket.connect((ip_addr, port_number))
-            new_socket.settimeout(timeout)
-            new_socket.setblocking(blocking)
-            assert isinstance(new_socket, socket.socket)
+            new_socket = socket.create_connection((ip_addr, port_number), timeout)
+            # setblocking(True) would also clear the timeout: a blocking socket keeps it
+            new_socket.settimeout(timeout if blocking else 0.0)
 
             with new_socket as my_sock:
-                msg = None
+                framer = framing.ReplyFramer()
+                # one receive buffer reused for every chunk of every reply
+                chunk_view = memoryview(bytearray(self.buffer_size))
+                reply = None
                 while True:
                     # replaces __sendandrecieve
-                    command = (yield msg)
-                    my_sock.send(command.encode())
-
-                    msg = my_sock.recv(self.buffer_size).decode()
-                    while (msg.find(',EndOfAPI') == -1):
-                        msg += my_sock.recv(self.buffer_size).decode()
-
-                    if "," in msg:
-                        msg = msg.split(",")
-                        msg = [int(msg[0]), msg[1:-1]]
+                    command = (yield reply)
+                    my_sock.sendall(command.encode())
+
+                    reply = framer.next_reply()
+                    while reply is None:
+                        n_bytes = my_sock.recv_into(chunk_view)
+                        if n_bytes == 0:
+                            raise socket.error("connection closed by controller")
+                        framer.feed(chunk_view[:n_bytes])
+                        reply = framer.next_reply()
+
+                    self._reply_size = len(reply) + len(framing.END_OF_API)
         except socket.timeout:
-            yield [-2, '']
+            if self.instrumentation is not None:
+                self.instrumentation.record_timeout()
+            self._reply_size = 0
+            yield '-2,'
         except socket.error as err:  # (errNb, errString):
             print('Socket error : ', err.errno, err)
-            yield [-2, '']
+            self._reply_size = 0
+            yield '-2,'
 
 